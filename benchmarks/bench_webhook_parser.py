@@ -0,0 +1,80 @@
+"""
+Microbenchmark del parseo del webhook de WhatsApp.
+
+Compara `decode_webhook` (una sola decodificación, registros con __slots__ y atajo para
+payloads de estados) con el parseo anterior (json.loads + un dict por mensaje).
+
+Uso:
+    python -m benchmarks.bench_webhook_parser [iteraciones]
+"""
+import json
+import sys
+import timeit
+from src.modules.whatsapp_handler import decode_webhook
+
+
+def _message(n: int, msg_type: str) -> dict:
+    msg = {"from": "5491122334455", "id": f"wamid.{n}", "timestamp": "1730000000", "type": msg_type}
+    if msg_type == "text":
+        msg["text"] = {"body": "Hola, quería consultar por los productos disponibles"}
+    elif msg_type == "document":
+        msg["document"] = {"id": f"media.{n}", "mime_type": "application/pdf", "filename": "factura.pdf"}
+    else:
+        msg[msg_type] = {"id": f"media.{n}", "mime_type": "audio/ogg; codecs=opus" if msg_type == "audio" else "image/jpeg"}
+    return msg
+
+
+def _payload(value: dict) -> bytes:
+    return json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "5491100000000", "phone_number_id": "123"},
+            **value,
+        }}]}],
+    }).encode()
+
+
+PAYLOADS = {
+    "status": _payload({"statuses": [{"id": "wamid.1", "status": "read", "timestamp": "1730000000",
+                                      "recipient_id": "5491122334455"}]}),
+    "text": _payload({"contacts": [{"wa_id": "5491122334455", "profile": {"name": "Cliente"}}],
+                      "messages": [_message(1, "text")]}),
+    "batch": _payload({"messages": [_message(n, t) for n, t in
+                                    enumerate(["text", "audio", "image", "document"] * 5)]}),
+}
+
+
+def legacy_parse(body: bytes) -> list:
+    """Parseo anterior: decodifica todo el JSON y arma un dict por mensaje."""
+    data = json.loads(body)
+    messages_data = []
+    for entry in data.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            for msg in value.get("messages", []):
+                messages_data.append({
+                    "from": msg.get("from"),
+                    "type": msg.get("type"),
+                    "id": msg.get("id"),
+                    "timestamp": msg.get("timestamp"),
+                    "audio_id": msg.get("audio", {}).get("id"),
+                    "image_id": msg.get("image", {}).get("id"),
+                    "document_id": msg.get("document", {}).get("id"),
+                    "filename": msg.get("document", {}).get("filename", "archivo"),
+                    "mime_type": msg.get(msg.get("type"), {}).get("mime_type"),
+                    "text": msg.get("text", {}).get("body"),
+                })
+    return messages_data
+
+
+def main(iterations: int = 20000):
+    print(f"{'payload':<8} {'legacy (µs)':>12} {'decode_webhook (µs)':>20} {'speedup':>8}")
+    for name, body in PAYLOADS.items():
+        legacy = timeit.timeit(lambda: legacy_parse(body), number=iterations) / iterations * 1e6
+        current = timeit.timeit(lambda: decode_webhook(body), number=iterations) / iterations * 1e6
+        print(f"{name:<8} {legacy:>12.2f} {current:>20.2f} {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,181 @@
+"""
+Generador de carga: reproduce una mezcla realista de webhooks de WhatsApp (texto, audio,
+imagen, documento, estados y reentregas) contra `whatsapp:app` y mide latencias por etapa.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import random
+import time
+import uuid
+from collections import defaultdict
+import httpx
+from loadtest.stubs import Recorder
+
+DEFAULT_MIX = {"text": 0.55, "audio": 0.15, "image": 0.1, "document": 0.05, "status": 0.15}
+
+TEXTS = [
+    "Hola, ¿qué horarios tienen?",
+    "Quiero ver mis pedidos",
+    "Mi cuit es 20123456789",
+    "¿Hacen envíos a Córdoba?",
+    "Gracias!",
+]
+
+
+def percentile(samples: list, p: float) -> float:
+    """Percentil por rango más cercano (samples no vacío)."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _envelope(value: dict) -> dict:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "loadtest", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "5491100000000", "phone_number_id": "loadtest"},
+            **value,
+        }}]}],
+    }
+
+
+def build_message(kind: str, sender: str, seq: int) -> dict:
+    msg = {"from": sender, "id": f"wamid.{uuid.uuid4().hex}", "timestamp": str(int(time.time())), "type": kind}
+    if kind == "text":
+        msg["text"] = {"body": random.choice(TEXTS)}
+    elif kind == "audio":
+        msg["audio"] = {"id": f"audio-{seq}", "mime_type": "audio/ogg; codecs=opus", "voice": True}
+    elif kind == "image":
+        msg["image"] = {"id": f"image-{seq}", "mime_type": "image/jpeg"}
+    elif kind == "document":
+        msg["document"] = {"id": f"document-{seq}", "mime_type": "application/pdf", "filename": f"factura_{seq}.pdf"}
+    return msg
+
+
+def build_status(sender: str) -> dict:
+    return _envelope({"statuses": [{"id": f"wamid.{uuid.uuid4().hex}", "status": random.choice(["delivered", "read"]),
+                                    "timestamp": str(int(time.time())), "recipient_id": sender}]})
+
+
+class LoadGenerator:
+    """
+    Envía webhooks firmados a `target_url` a una tasa constante durante `duration` segundos.
+
+    El tiempo de punta a punta de un turno se mide desde el primer mensaje pendiente de un
+    remitente hasta que el stand-in de Graph recibe la respuesta para ese número.
+    """
+
+    def __init__(self, target_url: str, app_secret: str, recorder: Recorder, rate: float = 5,
+                 duration: float = 30, users: int = 20, mix: dict = None, redelivery_rate: float = 0.05,
+                 burst_rate: float = 0.2):
+        self.target_url = target_url
+        self.app_secret = app_secret
+        self.recorder = recorder
+        self.rate = rate
+        self.duration = duration
+        self.senders = [f"54911{n:08d}" for n in range(users)]
+        self.mix = mix or DEFAULT_MIX
+        self.redelivery_rate = redelivery_rate
+        self.burst_rate = burst_rate
+        self._pending = defaultdict(list)
+        self._seq = 0
+        self.sent = defaultdict(int)
+
+    def _sign(self, body: bytes) -> str:
+        return "sha256=" + hmac.new(self.app_secret.encode(), body, hashlib.sha256).hexdigest()
+
+    async def _post(self, client: httpx.AsyncClient, payload: dict, stage: str = "webhook_ack"):
+        body = json.dumps(payload).encode()
+        start = time.monotonic()
+        try:
+            resp = await client.post(self.target_url, content=body, headers={
+                "Content-Type": "application/json", "X-Hub-Signature-256": self._sign(body)})
+            error = resp.status_code >= 400
+        except httpx.HTTPError:
+            error = True
+        self.recorder.record(stage, time.monotonic() - start, error=error)
+
+    async def _send_one(self, client: httpx.AsyncClient):
+        kind = random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        sender = random.choice(self.senders)
+        self.sent[kind] += 1
+        if kind == "status":
+            await self._post(client, build_status(sender))
+            return
+
+        count = random.randint(2, 4) if random.random() < self.burst_rate else 1
+        messages = []
+        for _ in range(count):
+            self._seq += 1
+            messages.append(build_message(kind if not messages else "text", sender, self._seq))
+        reply_to = sender.replace("549", "54", 1)
+        for msg in messages:
+            self._pending[reply_to].append(time.monotonic())
+            payload = _envelope({"contacts": [{"wa_id": sender, "profile": {"name": "Carga"}}], "messages": [msg]})
+            await self._post(client, payload)
+            if random.random() < self.redelivery_rate:
+                self.sent["redelivery"] += 1
+                await self._post(client, payload, stage="webhook_redelivery_ack")
+
+    async def _collect_replies(self):
+        while True:
+            to, at = await self.recorder.replies.get()
+            pending = self._pending.pop(to, None)
+            if pending:
+                self.recorder.record("end_to_end_turn", at - pending[0])
+
+    async def run(self, drain_timeout: float = 60):
+        collector = asyncio.create_task(self._collect_replies())
+        limits = httpx.Limits(max_connections=100, max_keepalive_connections=100)
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            tasks = []
+            interval = 1 / self.rate
+            started = time.monotonic()
+            n = 0
+            while time.monotonic() - started < self.duration:
+                tasks.append(asyncio.create_task(self._send_one(client)))
+                n += 1
+                await asyncio.sleep(max(0.0, started + n * interval - time.monotonic()))
+            await asyncio.gather(*tasks)
+
+        deadline = time.monotonic() + drain_timeout
+        while any(self._pending.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        collector.cancel()
+        return self.report(time.monotonic() - started)
+
+    def report(self, wall_seconds: float) -> dict:
+        stages = {}
+        for stage, samples in sorted(self.recorder.samples.items()):
+            if not samples:
+                continue
+            stages[stage] = {
+                "count": len(samples),
+                "errors": self.recorder.errors.get(stage, 0),
+                "throughput_per_s": len(samples) / wall_seconds,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+            }
+        return {
+            "wall_seconds": wall_seconds,
+            "sent": dict(self.sent),
+            "unanswered_senders": sum(1 for pending in self._pending.values() if pending),
+            "stages": stages,
+        }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Duración: {report['wall_seconds']:.1f}s  Enviados: {report['sent']}  "
+        f"Remitentes sin respuesta: {report['unanswered_senders']}",
+        f"{'etapa':<26}{'n':>7}{'err':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for stage, s in report["stages"].items():
+        lines.append(f"{stage:<26}{s['count']:>7}{s['errors']:>6}{s['throughput_per_s']:>9.2f}"
+                     f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+    return "\n".join(lines)
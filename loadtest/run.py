@@ -0,0 +1,207 @@
+"""
+Prueba de carga local del bot, sin tocar Meta, OpenAI, SharePoint ni Gmail.
+
+Levanta los stand-ins (Graph, OpenAI, SharePoint, SMTP), un redis-server local, lanza
+`uvicorn whatsapp:app` apuntando a ellos y reproduce webhooks con `LoadGenerator`.
+
+Uso:
+    python -m loadtest.run --rate 10 --duration 60 --users 50 \\
+        --latency openai_responses=800 --latency sharepoint=150 --error-rate graph=0.02
+
+Etapas configurables para --latency/--jitter/--error-rate:
+    graph, openai_responses, openai_transcription, sharepoint, smtp
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+import uvicorn
+from loadtest.loadgen import LoadGenerator, format_report
+from loadtest.smtp_sink import SMTPSink
+from loadtest.stubs import Fault, Recorder, graph_app, openai_app, sharepoint_app, build_workbook
+
+STAGES = ("graph", "openai_responses", "openai_transcription", "sharepoint", "smtp")
+DEFAULT_LATENCY_MS = {"graph": 60, "openai_responses": 900, "openai_transcription": 500, "sharepoint": 180, "smtp": 30}
+
+SITE_PATH = "/sites/LoadTest"
+LIBRARY = "Documentos compartidos/BOT Whatsapp"
+APP_SECRET = "loadtest-secret"
+ADMIN_TOKEN = "loadtest-admin"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_stage_values(values: list, cast=float) -> dict:
+    parsed = {}
+    for item in values or []:
+        stage, _, value = item.partition("=")
+        if stage not in STAGES:
+            raise SystemExit(f"Etapa desconocida '{stage}'. Opciones: {', '.join(STAGES)}")
+        parsed[stage] = cast(value)
+    return parsed
+
+
+async def serve(app, port: int) -> tuple:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise SystemExit(f"La aplicación terminó con código {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.3)
+    raise SystemExit(f"La aplicación no respondió en {timeout}s")
+
+
+def start_redis(args) -> tuple:
+    if args.redis_host:
+        return None, args.redis_host, args.redis_port
+    binary = shutil.which("redis-server")
+    if not binary:
+        raise SystemExit("No se encontró redis-server en el PATH. Instalalo o usá --redis-host/--redis-port.")
+    port = free_port()
+    process = subprocess.Popen([binary, "--port", str(port), "--save", "", "--appendonly", "no"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process, "127.0.0.1", port
+
+
+def app_environment(ports: dict, redis_host: str, redis_port: int, workdir: str) -> dict:
+    sharepoint_config = os.path.join(workdir, "sharepoint_config.json")
+    folders = {key: f"{LIBRARY}/{name}" for key, name in {
+        "staging": "Staging", "potencial_empleado": "Curriculums", "facturacion": "Facturas",
+        "reclamos": "Reclamos", "potencial_proveedor": "Proveedores"}.items()}
+    folders["mother"] = LIBRARY
+    with open(sharepoint_config, "w") as f:
+        json.dump({"Celula": {"site_name": "LoadTest", "site_url": f"http://127.0.0.1:{ports['sharepoint']}{SITE_PATH}",
+                              "fallback_folder": "Error_Handling",
+                              "libraries": {"documents": {"path": LIBRARY, "folders": folders}}}}, f)
+
+    env = dict(os.environ)
+    env.update({
+        "SHEET_ID": "loadtest", "EXCEL_NAME": "db_celula.xlsx",
+        "REDIS_HOST": redis_host, "REDIS_PORT": str(redis_port),
+        "OPENAI_API_KEY": "sk-loadtest", "OPENAI_BASE_URL": f"http://127.0.0.1:{ports['openai']}/v1",
+        "GOOGLE_CREDENTIALS_BASE64": "e30=",
+        "SENDER_EMAIL": "bot@loadtest.local", "SENDER_PASSWORD": "loadtest",
+        "SMTP_SERVER": "127.0.0.1", "SMTP_PORT": str(ports["smtp"]), "SMTP_STARTTLS": "false",
+        "SALES_EMAIL": "sales@loadtest.local", "PROCUREMENT_EMAIL": "procurement@loadtest.local",
+        "HR_EMAIL": "hr@loadtest.local", "ORDERS_EMAIL": "orders@loadtest.local",
+        "BILLING_EMAIL": "billing@loadtest.local", "SUPPORT_EMAIL": "support@loadtest.local",
+        "WHATSAPP_ACCESS_TOKEN": "loadtest", "PHONE_NUMBER_ID": "loadtest", "APP_SECRET": APP_SECRET,
+        "ADMIN_TOKEN": ADMIN_TOKEN,
+        "GRAPH_API_BASE_URL": f"http://127.0.0.1:{ports['graph']}",
+        "AZURE_TENANT_ID": "loadtest", "AZURE_CLIENT_ID": "loadtest", "AZURE_SECRET_ID": "loadtest",
+        "AZURE_CLIENT_SECRET": "loadtest", "SHAREPOINT_SITE_URL": f"http://127.0.0.1:{ports['sharepoint']}{SITE_PATH}",
+        "CERT_KEY_BASE64": "", "THUMBPRINT": "loadtest",
+        "SHAREPOINT_CONFIG_PATH": sharepoint_config, "SHAREPOINT_ACCESS_TOKEN": "loadtest",
+        "LOG_LEVEL": "WARNING", "LOG_FILE": os.path.join(workdir, "app.log"),
+        "TURN_DRAIN_TIMEOUT": "5",
+    })
+    return env
+
+
+async def main(args):
+    latency = {**DEFAULT_LATENCY_MS, **parse_stage_values(args.latency)}
+    jitter = parse_stage_values(args.jitter)
+    error_rate = parse_stage_values(args.error_rate)
+    faults = {stage: Fault(latency[stage], jitter.get(stage, latency[stage] * 0.2), error_rate.get(stage, 0))
+              for stage in STAGES}
+
+    recorder = Recorder()
+    ports = {name: free_port() for name in ("graph", "openai", "sharepoint", "app")}
+    workbook = build_workbook()
+
+    servers = [
+        await serve(graph_app(recorder, faults["graph"], f"http://127.0.0.1:{ports['graph']}"), ports["graph"]),
+        await serve(openai_app(recorder, faults["openai_responses"], faults["openai_transcription"]), ports["openai"]),
+        await serve(sharepoint_app(recorder, faults["sharepoint"], SITE_PATH,
+                                   {f"{LIBRARY}/db_celula.xlsx": workbook}), ports["sharepoint"]),
+    ]
+    smtp = SMTPSink(recorder, faults["smtp"])
+    await smtp.start()
+    ports["smtp"] = smtp.port
+
+    redis_process, redis_host, redis_port = start_redis(args)
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    app_output = open(os.path.join(workdir, "app.out"), "w")
+    app_process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "whatsapp:app", "--host", "127.0.0.1", "--port", str(ports["app"]),
+         "--workers", str(args.app_workers), "--log-level", "warning"],
+        cwd=ROOT, env=app_environment(ports, redis_host, redis_port, workdir),
+        stdout=app_output, stderr=subprocess.STDOUT)
+
+    try:
+        await wait_until_ready(f"http://127.0.0.1:{ports['app']}/metrics", app_process)
+        generator = LoadGenerator(
+            target_url=f"http://127.0.0.1:{ports['app']}/webhook", app_secret=APP_SECRET, recorder=recorder,
+            rate=args.rate, duration=args.duration, users=args.users,
+            redelivery_rate=args.redelivery_rate, burst_rate=args.burst_rate)
+        report = await generator.run(drain_timeout=args.drain_timeout)
+        async with httpx.AsyncClient(headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}) as client:
+            report["app_metrics"] = (await client.get(f"http://127.0.0.1:{ports['app']}/metrics")).json()
+        report["emails_received"] = len(smtp.messages)
+
+        print(format_report(report))
+        print(f"Correos recibidos por el sink SMTP: {report['emails_received']}")
+        print(f"Métricas de la app: {json.dumps(report['app_metrics'], indent=2)}")
+        print(f"Logs de la app en {workdir}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        app_process.terminate()
+        try:
+            app_process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            app_process.kill()
+        app_output.close()
+        if redis_process is not None:
+            redis_process.terminate()
+        await smtp.stop()
+        for server, _ in servers:
+            server.should_exit = True
+        await asyncio.gather(*(task for _, task in servers), return_exceptions=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga local de whatsapp:app con stand-ins.")
+    parser.add_argument("--rate", type=float, default=5, help="webhooks por segundo")
+    parser.add_argument("--duration", type=float, default=30, help="segundos de carga")
+    parser.add_argument("--users", type=int, default=20, help="remitentes distintos")
+    parser.add_argument("--burst-rate", type=float, default=0.2, help="probabilidad de ráfaga de mensajes")
+    parser.add_argument("--redelivery-rate", type=float, default=0.05, help="probabilidad de reentrega de Meta")
+    parser.add_argument("--latency", action="append", metavar="ETAPA=MS")
+    parser.add_argument("--jitter", action="append", metavar="ETAPA=MS")
+    parser.add_argument("--error-rate", action="append", metavar="ETAPA=P")
+    parser.add_argument("--app-workers", type=int, default=1, help="procesos de uvicorn")
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--redis-host")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--output", help="archivo JSON con el reporte completo")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,78 @@
+"""
+Servidor SMTP local que acepta y descarta los correos (sin TLS, AUTH PLAIN/LOGIN sin validar).
+Se usa con `SMTP_STARTTLS=false` para que `gmail_connection` no intente STARTTLS.
+"""
+import asyncio
+import random
+import time
+from loadtest.stubs import Fault, Recorder
+
+
+class SMTPSink:
+    def __init__(self, recorder: Recorder, fault: Fault, host: str = "127.0.0.1", port: int = 0):
+        self.recorder = recorder
+        self.fault = fault
+        self.host = host
+        self.port = port
+        self.messages = []
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+
+        reply("220 loadtest SMTP sink")
+        await writer.drain()
+        try:
+            while line := await reader.readline():
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb in ("EHLO", "HELO"):
+                    writer.write(b"250-loadtest\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                elif verb == "AUTH":
+                    parts = command.split()
+                    if parts[1].upper() == "LOGIN":
+                        for prompt in ("VXNlcm5hbWU6", "UGFzc3dvcmQ6"):
+                            if len(parts) > 2 and prompt == "VXNlcm5hbWU6":
+                                continue
+                            reply(f"334 {prompt}")
+                            await writer.drain()
+                            await reader.readline()
+                    elif len(parts) == 2:
+                        reply("334 ")
+                        await writer.drain()
+                        await reader.readline()
+                    reply("235 2.7.0 Authentication successful")
+                elif verb == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    start = time.monotonic()
+                    data = []
+                    while (chunk := await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        data.append(chunk)
+                    failure = await self.fault.apply()
+                    self.recorder.record("smtp_send", time.monotonic() - start, error=failure is not None)
+                    if failure is not None:
+                        reply("451 4.3.0 Injected failure")
+                    else:
+                        self.messages.append(b"".join(data))
+                        reply(f"250 2.0.0 Ok: queued as {random.getrandbits(32):08x}")
+                elif verb == "QUIT":
+                    reply("221 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    # MAIL, RCPT, RSET, NOOP
+                    reply("250 Ok")
+                await writer.drain()
+        finally:
+            writer.close()
@@ -0,0 +1,521 @@
+"""
+Servidores de reemplazo (stand-ins) para las APIs externas que usa el bot:
+WhatsApp Graph (media y mensajes), OpenAI (Responses y transcripciones) y SharePoint (archivos).
+
+Cada stand-in tiene latencia y tasa de error configurables (`Fault`) y registra los tiempos
+de cada llamada en un `Recorder` compartido con el generador de carga.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import random
+import re
+import time
+import uuid
+from collections import defaultdict
+from typing import Optional
+import pandas as pd
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+try:
+    import av
+    import numpy as np
+except ImportError:  # sin PyAV los audios del stand-in son bytes al azar
+    av = None
+
+
+class Fault:
+    """Latencia (ms, con jitter uniforme) y tasa de error inyectadas en un stand-in."""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 error_status: int = 500):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def delay(self) -> float:
+        """Latencia sorteada para una llamada, en segundos."""
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+    def failure(self) -> Optional[Response]:
+        """Respuesta de error si la llamada debe fallar, o None."""
+        if self.error_rate and random.random() < self.error_rate:
+            return JSONResponse({"error": {"message": "injected failure"}}, status_code=self.error_status)
+        return None
+
+    async def apply(self) -> Optional[Response]:
+        """Espera la latencia configurada y devuelve una respuesta de error si corresponde."""
+        delay = self.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.failure()
+
+
+class Recorder:
+    """Guarda las duraciones (segundos) de cada etapa y los eventos de fin de turno."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.started_at = time.monotonic()
+        self.replies = asyncio.Queue()
+
+    def record(self, stage: str, seconds: float, error: bool = False):
+        self.samples[stage].append(seconds)
+        if error:
+            self.errors[stage] += 1
+
+
+async def _timed(recorder: Recorder, stage: str, fault: Fault, handler):
+    start = time.monotonic()
+    failure = await fault.apply()
+    response = failure if failure is not None else await handler()
+    recorder.record(stage, time.monotonic() - start, error=failure is not None)
+    return response
+
+
+# --------------------------------------------------------------------------------------------
+# WhatsApp Graph API
+# --------------------------------------------------------------------------------------------
+
+MEDIA_SIZES = {"audio": 48_000, "image": 350_000, "document": 1_200_000}
+MEDIA_MIME_TYPES = {"audio": "audio/ogg", "image": "image/jpeg", "document": "application/pdf"}
+VOICE_NOTE_SECONDS = 75
+
+
+def synthetic_voice_note(seconds: float = VOICE_NOTE_SECONDS, rate: int = 48000) -> bytes:
+    """
+    Nota de voz OGG/Opus como las de WhatsApp: "palabras" (tonos de 0.2 a 0.6 s) separadas por
+    pausas cortas, con una pausa larga cada 4 a 8 segundos. Requiere PyAV.
+    """
+    rng = random.Random(7)
+    samples = np.zeros(int(seconds * rate), dtype=np.int16)
+    position, next_pause = 0.3, rng.uniform(4, 8)
+    while position < seconds - 1:
+        length = rng.uniform(0.2, 0.6)
+        t = np.arange(int(length * rate)) / rate
+        start = int(position * rate)
+        samples[start:start + len(t)] = (np.sin(2 * np.pi * rng.uniform(150, 300) * t) * 9000).astype(np.int16)
+        position += length + rng.uniform(0.05, 0.15)
+        if position > next_pause:
+            position += rng.uniform(0.6, 1.2)
+            next_pause = position + rng.uniform(4, 8)
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=rate)
+        stream.layout = "mono"
+        stream.bit_rate = 32000
+        frame = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = rate
+        fifo = av.AudioFifo()
+        fifo.write(frame)
+        for chunk in fifo.read_many(960, partial=True):
+            for packet in stream.encode(chunk):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def audio_seconds(content: bytes) -> float:
+    """Duración de un audio (con PyAV), o una estimación por tamaño."""
+    if av is not None:
+        try:
+            with av.open(io.BytesIO(content)) as container:
+                if container.duration:
+                    return container.duration / av.time_base
+        except Exception:
+            pass
+    return len(content) / 16000
+
+
+def graph_app(recorder: Recorder, fault: Fault, base_url: str, media_sizes: dict = MEDIA_SIZES) -> FastAPI:
+    """
+    Stand-in de la Graph API. Los media_id tienen la forma `<tipo>-<n>` (p. ej. `audio-12`)
+    y el contenido descargado es de `media_sizes[tipo]` bytes (los audios son una nota de voz
+    OGG/Opus de VOICE_NOTE_SECONDS si PyAV está instalado).
+    """
+    app = FastAPI()
+    blobs = {kind: random.randbytes(size) for kind, size in media_sizes.items()}
+    if av is not None and "audio" in blobs:
+        blobs["audio"] = synthetic_voice_note()
+
+    @app.get("/media/{media_id}")
+    async def media_content(media_id: str):
+        kind = media_id.split("-", 1)[0]
+
+        async def handler():
+            return Response(blobs.get(kind, b""), media_type=MEDIA_MIME_TYPES.get(kind, "application/octet-stream"))
+        return await _timed(recorder, "graph_media_download", fault, handler)
+
+    @app.post("/{version}/{phone_number_id}/messages")
+    async def send_message(version: str, phone_number_id: str, request: Request):
+        payload = await request.json()
+
+        async def handler():
+            recorder.replies.put_nowait((payload.get("to"), time.monotonic()))
+            return {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+                "messages": [{"id": f"wamid.out.{uuid.uuid4().hex}"}],
+            }
+        return await _timed(recorder, "graph_send_message", fault, handler)
+
+    @app.get("/{version}/{media_id}")
+    async def media_metadata(version: str, media_id: str):
+        kind = media_id.split("-", 1)[0]
+
+        async def handler():
+            return {
+                "url": f"{base_url}/media/{media_id}",
+                "mime_type": MEDIA_MIME_TYPES.get(kind, "application/octet-stream"),
+                "file_size": len(blobs.get(kind, b"")),
+                "id": media_id,
+                "messaging_product": "whatsapp",
+            }
+        return await _timed(recorder, "graph_media_metadata", fault, handler)
+
+    return app
+
+
+# --------------------------------------------------------------------------------------------
+# OpenAI
+# --------------------------------------------------------------------------------------------
+
+# Guion de herramientas: palabra clave en el mensaje del usuario -> llamada a herramienta.
+TOOL_SCRIPT = [
+    ("pedidos", "get_client_orders", lambda text: {"user_id": "1", "offset": None}),
+    ("cuit", "get_client", lambda text: {"cuit": "20123456789"}),
+    ("Archivo enviado:", "contact_company", lambda text: {
+        "type": "reclamos",
+        "user_id": "1",
+        "data": {"id_de_imagen": re.search(r"FILE_\w+", text).group(0) if re.search(r"FILE_\w+", text) else None,
+                 "info": "Producto dañado", "numero_pedido": "1", "nombre_contacto": "Carga",
+                 "telefono_contacto": "0"},
+    }),
+]
+
+TRANSCRIPTION_MS_PER_AUDIO_SECOND = 40
+
+# La latencia de --latency openai_responses es la del modelo grande; los chicos responden en una fracción
+MODEL_LATENCY_FACTORS = {"gpt-4o-mini": 0.4}
+
+TRANSCRIPTS = [
+    "Hola, quería saber cuáles son mis pedidos",
+    "Buenas, ¿hasta qué hora atienden?",
+    "Mi cuit es 20123456789",
+]
+
+
+def _usage(input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> dict:
+    return {
+        "input_tokens": input_tokens,
+        "input_tokens_details": {"cached_tokens": cached_tokens, "cache_write_tokens": 0},
+        "output_tokens": output_tokens,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": input_tokens + output_tokens,
+    }
+
+
+def _response(output: list, model: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> dict:
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": model,
+        "output": output,
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "temperature": 0.1,
+        "top_p": 1.0,
+        "usage": _usage(input_tokens, output_tokens, cached_tokens),
+    }
+
+
+def _text_output(text: str) -> dict:
+    return {
+        "type": "message",
+        "id": f"msg_{uuid.uuid4().hex}",
+        "role": "assistant",
+        "status": "completed",
+        "content": [{"type": "output_text", "text": text, "annotations": []}],
+    }
+
+
+class PrefixCache:
+    """
+    Imita el caché de prompts de OpenAI: reutiliza el prefijo idéntico más largo ya visto, en
+    bloques de ~128 tokens y sólo a partir de ~1024 tokens (1 token ≈ 4 caracteres).
+    """
+    BLOCK_CHARS = 512
+    MIN_CHARS = 4096
+
+    def __init__(self):
+        self._seen = set()
+
+    def cached_tokens(self, prompt: str) -> int:
+        digest = hashlib.sha256()
+        cached = 0
+        for start in range(0, len(prompt) - self.BLOCK_CHARS + 1, self.BLOCK_CHARS):
+            digest.update(prompt[start:start + self.BLOCK_CHARS].encode())
+            key = digest.copy().hexdigest()
+            if key in self._seen and cached == start:
+                cached = start + self.BLOCK_CHARS
+            self._seen.add(key)
+        return cached // 4 if cached >= self.MIN_CHARS else 0
+
+
+def scripted_output(input_items: list) -> list:
+    """Decide la salida del modelo: llamadas a herramientas según TOOL_SCRIPT o una respuesta de texto."""
+    if any(item.get("type") == "function_call_output" for item in input_items):
+        return [_text_output("Listo, ya lo revisé. ¿Necesitás algo más?")]
+
+    user_text = " ".join(str(item.get("content", "")) for item in input_items if item.get("role") == "user")
+    calls = []
+    for keyword, tool_name, build_args in TOOL_SCRIPT:
+        if keyword.lower() in user_text.lower():
+            calls.append({
+                "type": "function_call",
+                "id": f"fc_{uuid.uuid4().hex}",
+                "call_id": f"call_{uuid.uuid4().hex}",
+                "name": tool_name,
+                "arguments": json.dumps(build_args(user_text)),
+                "status": "completed",
+            })
+    return calls or [_text_output("¡Hola! Atendemos de lunes a viernes de 9 a 18 hs.")]
+
+
+def response_events(response: dict) -> list:
+    """
+    Secuencia de eventos de la Responses API con `stream=True` (la misma forma que graba el SDK
+    contra la API real): created, por cada item de salida added / deltas / done, y completed.
+    """
+    events = [{"type": "response.created", "response": {**response, "status": "in_progress", "output": []}}]
+    for index, item in enumerate(response["output"]):
+        if item["type"] == "function_call":
+            arguments = item["arguments"]
+            half = len(arguments) // 2
+            events += [
+                {"type": "response.output_item.added", "output_index": index,
+                 "item": {**item, "arguments": "", "status": "in_progress"}},
+                {"type": "response.function_call_arguments.delta", "output_index": index, "item_id": item["id"],
+                 "delta": arguments[:half]},
+                {"type": "response.function_call_arguments.delta", "output_index": index, "item_id": item["id"],
+                 "delta": arguments[half:]},
+                {"type": "response.function_call_arguments.done", "output_index": index, "item_id": item["id"],
+                 "arguments": arguments},
+            ]
+        else:
+            text = item["content"][0]["text"]
+            part = {"type": "output_text", "text": "", "annotations": []}
+            events += [
+                {"type": "response.output_item.added", "output_index": index,
+                 "item": {**item, "content": [], "status": "in_progress"}},
+                {"type": "response.content_part.added", "output_index": index, "item_id": item["id"],
+                 "content_index": 0, "part": part},
+            ]
+            events += [{"type": "response.output_text.delta", "output_index": index, "item_id": item["id"],
+                        "content_index": 0, "delta": word, "logprobs": []}
+                       for word in re.findall(r"\S+\s*", text)]
+            events += [
+                {"type": "response.output_text.done", "output_index": index, "item_id": item["id"],
+                 "content_index": 0, "text": text, "logprobs": []},
+                {"type": "response.content_part.done", "output_index": index, "item_id": item["id"],
+                 "content_index": 0, "part": {**part, "text": text}},
+            ]
+        events.append({"type": "response.output_item.done", "output_index": index, "item": item})
+    events.append({"type": "response.completed", "response": response})
+    return [{**event, "sequence_number": n} for n, event in enumerate(events)]
+
+
+def sse_stream(events: list, generation_seconds: float):
+    """
+    Emite los eventos como server-sent events repartiendo `generation_seconds` entre los items
+    de salida, como lo hace el modelo real: cada item se termina de emitir antes de empezar el siguiente.
+    """
+    items = sum(1 for event in events if event["type"] == "response.output_item.added")
+    step = generation_seconds / (items + 1)
+
+    async def body():
+        for event in events:
+            if event["type"] in ("response.output_item.added", "response.completed"):
+                await asyncio.sleep(step)
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+    return body()
+
+
+def openai_app(recorder: Recorder, responses_fault: Fault, transcription_fault: Fault) -> FastAPI:
+    """Stand-in de la API de OpenAI (montar con base_url `<host>/v1`)."""
+    app = FastAPI()
+    prefix_cache = PrefixCache()
+
+    @app.post("/v1/responses")
+    async def create_response(request: Request):
+        body = await request.json()
+        input_items = body.get("input") or []
+        if isinstance(input_items, str):
+            input_items = [{"role": "user", "content": input_items}]
+        factor = MODEL_LATENCY_FACTORS.get(body.get("model"), 1.0)
+        fault = Fault(responses_fault.latency_ms * factor, responses_fault.jitter_ms * factor,
+                      responses_fault.error_rate, responses_fault.error_status)
+
+        def build():
+            # Como en la API real, las herramientas forman parte del prefijo del prompt
+            prompt = json.dumps(body.get("tools") or [], ensure_ascii=False) + json.dumps(input_items, ensure_ascii=False)
+            return _response(scripted_output(input_items), body.get("model", "gpt-4o"), len(prompt) // 4, 40,
+                             cached_tokens=prefix_cache.cached_tokens(prompt))
+
+        if body.get("stream"):
+            # La latencia configurada es el tiempo total de generación, repartido a lo largo del stream
+            started = time.monotonic()
+            failure = fault.failure()
+            if failure is not None:
+                recorder.record("openai_responses", time.monotonic() - started, error=True)
+                return failure
+            events = response_events(build())
+
+            async def timed_stream():
+                async for chunk in sse_stream(events, fault.delay()):
+                    yield chunk
+                recorder.record("openai_responses", time.monotonic() - started)
+            return StreamingResponse(timed_stream(), media_type="text/event-stream")
+
+        async def handler():
+            return build()
+        return await _timed(recorder, "openai_responses", fault, handler)
+
+    @app.post("/v1/audio/transcriptions")
+    async def create_transcription(request: Request):
+        form = await request.form()
+        upload = form.get("file")
+        content = await upload.read() if upload is not None else b""
+        response_format = form.get("response_format", "json")
+        duration = audio_seconds(content)
+
+        async def handler():
+            # La latencia crece con la duración del audio, como en la API real
+            await asyncio.sleep(duration * TRANSCRIPTION_MS_PER_AUDIO_SECOND / 1000)
+            text = TRANSCRIPTS[int(duration) % len(TRANSCRIPTS)]
+            if response_format == "text":
+                return PlainTextResponse(text)
+            if response_format == "json":
+                return {"text": text}
+            return {"text": text, "language": form.get("language", "es"), "duration": duration,
+                    "words": [], "segments": []}
+        return await _timed(recorder, "openai_transcription", transcription_fault, handler)
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": model, "object": "model", "created": 0, "owned_by": "loadtest"}
+                                          for model in ("gpt-4o", *MODEL_LATENCY_FACTORS)]}
+
+    return app
+
+
+# --------------------------------------------------------------------------------------------
+# SharePoint
+# --------------------------------------------------------------------------------------------
+
+def build_workbook() -> bytes:
+    """Libro de Excel con las hojas que leen los handlers de herramientas."""
+    sheets = {
+        "clients": pd.DataFrame([{"id": "1", "cuit": "20123456789", "name": "Cliente de carga",
+                                  "phone_number": "541100000000"}]),
+        "products": pd.DataFrame([{"id": f"P{n}", "name": f"Producto {n}", "price": 100 + n} for n in range(40)]),
+        "orders": pd.DataFrame([{"id": f"O{n}", "user_id": "1", "fecha": f"2024-01-{n + 1:02d} 10:00:00", "status": "delivered"}
+                                for n in range(20)]),
+        "orders_detail": pd.DataFrame([{"id": f"D{n}", "order_id": f"O{n % 20}", "product_id": f"P{n % 40}",
+                                        "quantity": 1 + n % 5, "unit_price": 100 + n % 40} for n in range(60)]),
+        "phones": pd.DataFrame([{"id": "PH1", "user_id": "1", "phone_number": "541100000000"}]),
+    }
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=name)
+    return output.getvalue()
+
+
+_FILES_ADD = re.compile(r"getFolderByServerRelativeUrl\('(?P<folder>[^']*)'\)/Files/add\(overwrite=\w+,url='(?P<name>[^']*)'\)", re.I)
+_FILE_VALUE = re.compile(r"getFileByServerRelativeUrl\('(?P<path>[^']*)'\)/\$value", re.I)
+_FILE_META = re.compile(r"getFileByServerRelativeUrl\('(?P<path>[^']*)'\)$", re.I)
+_FOLDER_META = re.compile(r"getFolderByServerRelativeUrl\('(?P<folder>[^']*)'\)$", re.I)
+_UPLOAD_SESSION = re.compile(
+    r"getFileByServerRelativeUrl\('(?P<path>[^']*)'\)/(?P<op>startUpload|continueUpload|finishUpload|GetUploadStatus|CancelUpload)"
+    r"(\(uploadID='(?P<upload_id>[^']*)'(,fileOffset=(?P<offset>\d+))?\))?", re.I)
+
+
+def sharepoint_app(recorder: Recorder, fault: Fault, site_path: str, seed_files: dict) -> FastAPI:
+    """
+    Stand-in de la API REST de SharePoint (sólo los endpoints que usa `SharePointService`).
+    `seed_files` mapea rutas relativas al sitio (p. ej. `Documentos compartidos/BOT/db.xlsx`) a su contenido.
+    """
+    app = FastAPI()
+    files = {f"{site_path}/{path}": content for path, content in seed_files.items()}
+    sessions = {}
+
+    def absolute(path: str) -> str:
+        return path if path.startswith("/") else f"{site_path}/{path}"
+
+    def metadata(kind: str, path: str) -> dict:
+        return {"d": {"__metadata": {"type": kind}, "ServerRelativeUrl": path,
+                      "Name": path.rsplit("/", 1)[-1], "Exists": True, "Id": str(uuid.uuid5(uuid.NAMESPACE_URL, path))}}
+
+    @app.api_route("/{path:path}", methods=["GET", "POST"])
+    async def api(path: str, request: Request):
+        body = await request.body()
+        path = path.split("_api/", 1)[-1]
+
+        async def handler():
+            if path.lower() == "contextinfo":
+                return {"d": {"GetContextWebInformation": {"FormDigestValue": "loadtest",
+                                                            "FormDigestTimeoutSeconds": 1800}}}
+            if match := _UPLOAD_SESSION.search(path):
+                return upload_session(match, body)
+            if match := _FILES_ADD.search(path):
+                target = f"{absolute(match['folder'])}/{match['name']}"
+                files[target] = body
+                return metadata("SP.File", target)
+            if match := _FILE_VALUE.search(path):
+                content = files.get(absolute(match["path"]))
+                if content is None:
+                    return JSONResponse({"error": {"message": "File Not Found."}}, status_code=404)
+                return Response(content, media_type="application/octet-stream")
+            if match := _FILE_META.search(path):
+                return metadata("SP.File", absolute(match["path"]))
+            if match := _FOLDER_META.search(path):
+                return metadata("SP.Folder", absolute(match["folder"]))
+            return {"d": {}}
+
+        stage = "sharepoint_download" if "$value" in path else "sharepoint_upload" if body else "sharepoint_metadata"
+        return await _timed(recorder, stage, fault, handler)
+
+    def upload_session(match, body: bytes):
+        """Sesión de carga por bloques (StartUpload / ContinueUpload / FinishUpload)."""
+        op = match["op"].lower()
+        target = absolute(match["path"])
+        upload_id = match["upload_id"] or json.loads(body or b"{}").get("uploadId")
+        if op == "getuploadstatus":
+            received = len(sessions.get(upload_id, b""))
+            return {"d": {"ExpectedContentRange": f"{received}-", "UploadId": upload_id}}
+        if op == "cancelupload":
+            sessions.pop(upload_id, None)
+            return {"d": {}}
+        if op == "startupload":
+            sessions[upload_id] = bytearray(body)
+            return {"d": {"StartUpload": str(len(sessions[upload_id]))}}
+
+        buffer = sessions.get(upload_id)
+        if buffer is None or int(match["offset"]) != len(buffer):
+            return JSONResponse({"error": {"message": "Invalid upload offset."}}, status_code=400)
+        buffer.extend(body)
+        if op == "continueupload":
+            return {"d": {"ContinueUpload": str(len(buffer))}}
+        files[target] = bytes(sessions.pop(upload_id))
+        return metadata("SP.File", target)
+
+    return app
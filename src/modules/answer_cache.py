@@ -0,0 +1,193 @@
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+from src.modules.redis_conexion import get_async_redis_client
+from src.modules.redis_resilience import CircuitBreaker, redis_breaker
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_FILLER = re.compile(r"\b(hola|buenas|buen dia|buenos dias|buenas tardes|buenas noches|che|por favor|porfa|gracias)\b")
+
+
+def normalize_question(text: str) -> str:
+    """Minúsculas, sin acentos, signos, emojis ni saludos, y con los espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^a-z0-9ñ ]+", " ", text)
+    text = _FILLER.sub(" ", text)
+    return " ".join(text.split())
+
+
+class AnswerCache:
+    """
+    Caché de respuestas para preguntas frecuentes (horarios, zonas de envío, requisitos, catálogo).
+
+    Sólo se consulta en turnos que inician un hilo nuevo, sin archivos, cuyo texto normalizado
+    corresponde a una intención permitida y a ninguna denegada. Sólo se guarda la respuesta si
+    el turno no llamó herramientas y no menciona datos del cliente. La clave incluye la versión
+    del system message y del catálogo, así que un cambio en cualquiera de los dos invalida todo.
+
+    Entradas en memoria del proceso con TTL y desalojo LRU.
+
+    Un acierto no crea hilo en OpenAI: la pregunta y la respuesta servidas se guardan en Redis
+    y se agregan como contexto al próximo turno del cliente que sí llegue al modelo (cliente
+    asyncio detrás de `redis_breaker`; sin Redis ese contexto se pierde).
+    """
+    SERVED_PREFIX = "answer_served:"
+    SERVED_MAX = 5
+
+    def __init__(self, enabled: bool = settings.ANSWER_CACHE_ENABLED,
+                 ttl_seconds: int = settings.ANSWER_CACHE_TTL_SECONDS,
+                 max_entries: int = settings.ANSWER_CACHE_MAX_ENTRIES,
+                 max_chars: int = settings.ANSWER_CACHE_MAX_CHARS,
+                 intents: Optional[dict] = None, allow: Optional[list] = None, deny: Optional[list] = None,
+                 redis_client=None, breaker: CircuitBreaker = redis_breaker):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        intents = settings.ANSWER_CACHE_INTENTS if intents is None else intents
+        self._intents = {name: re.compile(r"\b(" + "|".join(map(re.escape, keywords)) + r")")
+                         for name, keywords in intents.items()}
+        self.allow = set(settings.ANSWER_CACHE_ALLOW if allow is None else allow)
+        self.deny = set(settings.ANSWER_CACHE_DENY if deny is None else deny)
+        self._entries: OrderedDict = OrderedDict()
+        self._redis = redis_client
+        self.breaker = breaker
+
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stored = 0
+        self.rejected_private = 0
+        self.evicted = 0
+        self.expired = 0
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    def intents_of(self, normalized: str) -> set:
+        return {name for name, pattern in self._intents.items() if pattern.search(normalized)}
+
+    def _cacheable(self, normalized: str) -> bool:
+        if not normalized or len(normalized) > self.max_chars:
+            return False
+        intents = self.intents_of(normalized)
+        if intents & self.deny:
+            return False
+        return bool(intents & self.allow) if self.allow else True
+
+    @staticmethod
+    def _key(normalized: str, scope: str, system_version: str, catalog_version: str) -> str:
+        raw = f"{system_version}:{catalog_version}:{scope}:{normalized}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, text: str, scope: str, system_version: str, catalog_version: str) -> Optional[str]:
+        """Devuelve la respuesta guardada para la pregunta, o None (también si no es cacheable)."""
+        if not self.enabled:
+            return None
+        normalized = normalize_question(text)
+        if not self._cacheable(normalized):
+            self.bypassed += 1
+            return None
+
+        key = self._key(normalized, scope, system_version, catalog_version)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, text: str, scope: str, system_version: str, catalog_version: str, answer: str,
+            private_values: tuple = ()) -> bool:
+        """
+        Guarda la respuesta de un turno sin herramientas. `private_values` son datos del cliente
+        (nombre, cuit, teléfono): si la respuesta menciona alguno no se guarda.
+        """
+        if not self.enabled or not answer:
+            return False
+        normalized = normalize_question(text)
+        if not self._cacheable(normalized):
+            return False
+        lowered = answer.lower()
+        if any(len(value) >= 4 and value.lower() in lowered for value in map(str, private_values) if value):
+            self.rejected_private += 1
+            return False
+
+        key = self._key(normalized, scope, system_version, catalog_version)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, answer)
+        self._entries.move_to_end(key)
+        self.stored += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+        return True
+
+    async def remember_served(self, phone: str, question: str, answer: str):
+        """Registra una respuesta servida desde la caché para dar contexto al próximo turno."""
+        if not self.enabled:
+            return
+        key = f"{self.SERVED_PREFIX}{phone}"
+        try:
+            with self.breaker.guard():
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.rpush(key, json.dumps({"question": question, "answer": answer}))
+                    pipe.ltrim(key, -self.SERVED_MAX, -1)
+                    pipe.expire(key, self.ttl_seconds)
+                    await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo registrar la respuesta servida a {phone}: {e}")
+
+    async def pop_served(self, phone: str) -> list:
+        """Devuelve (y borra) las preguntas y respuestas servidas desde la caché como mensajes user/assistant."""
+        if not self.enabled:
+            return []
+        key = f"{self.SERVED_PREFIX}{phone}"
+        try:
+            with self.breaker.guard():
+                async with self.redis_client.pipeline(transaction=True) as pipe:
+                    pipe.lrange(key, 0, -1)
+                    pipe.delete(key)
+                    served, _ = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron leer las respuestas servidas a {phone}: {e}")
+            return []
+        messages = []
+        for raw in served:
+            item = json.loads(raw)
+            messages += [{"role": "user", "content": item["question"]},
+                         {"role": "assistant", "content": item["answer"]}]
+        return messages
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "stored": self.stored,
+            "rejected_private": self.rejected_private,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+answer_cache = AnswerCache()
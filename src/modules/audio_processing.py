@@ -0,0 +1,200 @@
+"""
+Procesamiento de notas de voz antes de transcribirlas (`prepare`).
+
+1. Detecta el contenedor real por sus primeros bytes (WhatsApp manda OGG/Opus, pero también
+   llegan m4a, mp3, wav o amr reenviados).
+2. Decodifica a PCM mono de 16 kHz, que es lo que el modelo usa internamente.
+3. Recorta el silencio del principio y del final (midiendo la energía en ventanas de 20 ms).
+4. Corta las notas largas en los silencios.
+5. Codifica cada parte como OGG/Opus de bajo bitrate, el formato aceptado más chico. Una nota
+   corta se manda tal como llegó si ya es más chica y su contenedor es aceptado.
+
+Usa PyAV (`av`), que es opcional: sin él sólo se detecta el contenedor y la nota se manda entera.
+Todo es CPU y bloqueante: se ejecuta fuera del event loop.
+"""
+import io
+import time
+from typing import Optional
+import numpy as np
+
+try:
+    import av
+except ImportError:  # PyAV es opcional: sin él no se segmenta el audio
+    av = None
+
+ANALYSIS_RATE = 16000
+FRAME_SECONDS = 0.02
+SEGMENT_BITRATE = 16000
+
+# Formatos que acepta el endpoint de transcripción
+ACCEPTED_CONTAINERS = {"flac", "mp3", "mp4", "m4a", "ogg", "wav", "webm"}
+
+
+def available() -> bool:
+    return av is not None
+
+
+def detect_container(data: bytes) -> Optional[str]:
+    """Extensión del contenedor según su firma, o None si no se reconoce."""
+    head = data[:16]
+    if head.startswith(b"OggS"):
+        return "ogg"
+    if head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+        return "wav"
+    if head.startswith(b"fLaC"):
+        return "flac"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm"
+    if head.startswith(b"#!AMR"):
+        return "amr"
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return None
+
+
+def decode_mono(data: bytes, rate: int = ANALYSIS_RATE) -> np.ndarray:
+    """Decodifica cualquier contenedor que entienda FFmpeg a PCM int16 mono de `rate` Hz."""
+    chunks = []
+    with av.open(io.BytesIO(data)) as container:
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=rate)
+        for frame in container.decode(audio=0):
+            chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(frame))
+        chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(None))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+
+
+def encode_opus(samples: np.ndarray, rate: int = ANALYSIS_RATE, bit_rate: int = SEGMENT_BITRATE) -> bytes:
+    """Codifica PCM int16 mono como OGG/Opus."""
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=rate)
+        stream.layout = "mono"
+        stream.bit_rate = bit_rate
+        frame = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = rate
+        fifo = av.AudioFifo()
+        fifo.write(frame)
+        for chunk in fifo.read_many(int(rate * FRAME_SECONDS), partial=True):
+            for packet in stream.encode(chunk):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def frame_levels(samples: np.ndarray, rate: int = ANALYSIS_RATE, frame_seconds: float = FRAME_SECONDS) -> np.ndarray:
+    """Nivel en dBFS de cada ventana de `frame_seconds`."""
+    size = max(1, int(rate * frame_seconds))
+    count = len(samples) // size
+    if count == 0:
+        return np.zeros(0)
+    frames = samples[:count * size].astype(np.float64).reshape(count, size) / 32768.0
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def split_points(levels: np.ndarray, segment_seconds: float, min_silence: float, silence_db: float,
+                 frame_seconds: float = FRAME_SECONDS) -> list:
+    """
+    Segundos donde cortar para que cada segmento dure cerca de `segment_seconds`.
+    Se corta en el medio del silencio (al menos `min_silence` por debajo de `silence_db`) más
+    cercano al objetivo, dentro de ±50 %; si no hay ninguno, en la ventana más baja de ese rango.
+    """
+    silent = levels < silence_db
+    min_frames = max(1, int(min_silence / frame_seconds))
+    candidates = []
+    run_start = None
+    for index, is_silent in enumerate(np.append(silent, False)):
+        if is_silent and run_start is None:
+            run_start = index
+        elif not is_silent and run_start is not None:
+            if index - run_start >= min_frames:
+                candidates.append((run_start + index) // 2)
+            run_start = None
+
+    total = len(levels)
+    segment = int(segment_seconds / frame_seconds)
+    cuts = []
+    start = 0
+    while total - start > segment * 1.5:
+        low, target, high = start + segment // 2, start + segment, start + segment * 3 // 2
+        window = [c for c in candidates if low <= c <= high]
+        if window:
+            cut = min(window, key=lambda c: abs(c - target))
+        else:
+            cut = low + int(np.argmin(levels[low:high]))
+        cuts.append(cut)
+        start = cut
+    return [cut * frame_seconds for cut in cuts]
+
+
+def trim_bounds(levels: np.ndarray, silence_db: float, padding: float,
+                frame_seconds: float = FRAME_SECONDS) -> tuple:
+    """(primera, última+1) ventana con sonido, con `padding` segundos de margen; None si todo es silencio."""
+    voiced = np.flatnonzero(levels >= silence_db)
+    if len(voiced) == 0:
+        return None
+    pad = int(padding / frame_seconds)
+    return max(0, voiced[0] - pad), min(len(levels), voiced[-1] + 1 + pad)
+
+
+class PreparedAudio:
+    """Resultado de `prepare`: las partes a transcribir (bytes, nombre de archivo) y qué se hizo."""
+    __slots__ = ("parts", "container", "duration", "original_duration", "original_bytes", "prepared_bytes",
+                 "transcoded", "seconds")
+
+    def __init__(self, parts: list, container: Optional[str], duration: Optional[float],
+                 original_duration: Optional[float], original_bytes: int, transcoded: bool, seconds: float):
+        self.parts = parts
+        self.container = container
+        self.duration = duration
+        self.original_duration = original_duration
+        self.original_bytes = original_bytes
+        self.prepared_bytes = sum(len(data) for data, _ in parts)
+        self.transcoded = transcoded
+        self.seconds = seconds
+
+    @property
+    def segments(self) -> int:
+        return len(self.parts)
+
+    @property
+    def trimmed_seconds(self) -> float:
+        if self.duration is None or self.original_duration is None:
+            return 0.0
+        return self.original_duration - self.duration
+
+
+def prepare(data: bytes, segment_seconds: float, min_silence: float, silence_db: float,
+            trim_padding: float = 0.2, bit_rate: int = SEGMENT_BITRATE) -> PreparedAudio:
+    """Deja la nota lista para transcribir (ver el docstring del módulo)."""
+    start = time.monotonic()
+    container = detect_container(data)
+    original = [(data, f"audio.{container if container in ACCEPTED_CONTAINERS else 'ogg'}")]
+    if av is None:
+        return PreparedAudio(original, container, None, None, len(data), False, time.monotonic() - start)
+
+    samples = decode_mono(data)
+    original_duration = len(samples) / ANALYSIS_RATE
+    levels = frame_levels(samples)
+    bounds = trim_bounds(levels, silence_db, trim_padding)
+    if bounds is not None:
+        first, last = bounds
+        size = int(ANALYSIS_RATE * FRAME_SECONDS)
+        samples = samples[first * size:last * size]
+        levels = levels[first:last]
+    duration = len(samples) / ANALYSIS_RATE
+
+    cuts = split_points(levels, segment_seconds, min_silence, silence_db)
+    limits = [0] + [int(cut * ANALYSIS_RATE) for cut in cuts] + [len(samples)]
+    parts = [(encode_opus(samples[a:b], bit_rate=bit_rate), f"segment_{n}.ogg")
+             for n, (a, b) in enumerate(zip(limits, limits[1:]))]
+    if not cuts and container in ACCEPTED_CONTAINERS and len(parts[0][0]) >= len(data):
+        # Ya era chica y en un formato aceptado: se manda como llegó
+        return PreparedAudio(original, container, original_duration, original_duration, len(data), False,
+                             time.monotonic() - start)
+    if not cuts:
+        parts = [(parts[0][0], "audio.ogg")]
+    return PreparedAudio(parts, container, duration, original_duration, len(data), True, time.monotonic() - start)
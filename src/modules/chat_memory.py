@@ -1,50 +1,198 @@
-from datetime import timedelta, datetime
-import json
-from src.modules.redis_conexion import get_redis_client
+from datetime import timedelta
+import time
+from typing import Optional
+from redis.exceptions import WatchError
+from src.modules.redis_conexion import get_async_redis_client
+from src.modules.local_cache import LocalCache, MISSING, session_cache
+from src.modules.redis_resilience import (
+    CircuitBreaker, FallbackStore, RedisUnavailable, redis_breaker, session_fallback)
+from src.utils.settings import settings
 from src.utils.logger import get_logger
 
 logger = get_logger(__name__)
-EXPIRATION_TIME = timedelta(hours=24)
+EXPIRATION_TIME = timedelta(seconds=settings.SESSION_TTL_SECONDS)
 
 class MemoryHandler:
-    """Maneja la memoria conversacional de los clientes (threads activos)."""
+    """
+    Maneja la memoria conversacional de los clientes (threads activos).
 
-    def __init__(self, expiration_time: timedelta = EXPIRATION_TIME):
-        self.expiration_time = expiration_time
-        self.redis_client = get_redis_client()
+    Cada número tiene un hash `session:{número}` con el thread_id (último response id de la
+    cadena), la última actividad y los turnos y tokens acumulados del hilo, que usa la
+    compactación. Un hilo compactado no tiene thread_id sino un resumen (`summary`) con el que
+    arranca la cadena siguiente.
 
-    def get_or_create_thread(self, client_number: str):
+    La expiración es el TTL de Redis, renovado en cada escritura y en cada lectura que va a
+    Redis: un hilo sin actividad durante `expiration_time` desaparece solo. Leer y renovar es un
+    único viaje (pipeline) con el cliente asyncio compartido.
+
+    El estado también queda en la caché local del worker (`session_cache`): la lectura de un hilo
+    activo no sale del proceso y no renueva el TTL, que igual se renueva al guardar el turno.
+
+    Si Redis no responde, los hilos siguen en memoria (`session_fallback`, con la última copia
+    conocida) y lo escrito mientras tanto se vuelca a Redis cuando vuelve, salvo que otro worker
+    haya guardado algo más nuevo.
+    """
+    PREFIX = "session:"
+
+    def __init__(self, expiration_time: timedelta = EXPIRATION_TIME, redis_client=None,
+                 cache: LocalCache = session_cache, breaker: CircuitBreaker = redis_breaker,
+                 fallback: FallbackStore = session_fallback):
+        self.ttl_seconds = int(expiration_time.total_seconds())
+        self._redis = redis_client
+        self.cache = cache
+        self.breaker = breaker
+        self.fallback = fallback
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    def _key(self, client_number: str) -> str:
+        return f"{self.PREFIX}{client_number}"
+
+    @staticmethod
+    def _decode(raw: dict) -> Optional[dict]:
+        if not raw:
+            return None
+        return {
+            "thread_id": raw.get("thread_id") or None,
+            "summary": raw.get("summary") or None,
+            "last_activity": float(raw.get("last_activity", 0)),
+            "turns": int(raw.get("turns", 0)),
+            "tokens": int(raw.get("tokens", 0)),
+            "compactions": int(raw.get("compactions", 0)),
+        }
+
+    async def get_thread_state(self, client_number: str) -> Optional[dict]:
         """
-        Devuelve el thread_id activo del cliente o crea uno nuevo si expiró o no existe.
+        Estado del hilo activo del cliente (renovando su TTL), o None si expiró o no existe.
         """
-        thread_info_json = self.redis_client.get(client_number)
-        thread_info = json.loads(thread_info_json) if thread_info_json else None
+        key = self._key(client_number)
+        cached = self.cache.get(key)
+        if cached is not MISSING:
+            return dict(cached)
+        token = None
+        try:
+            with self.breaker.guard():
+                await self.reconcile()
+                token = self.cache.begin(key, writes=True)
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.hgetall(key)
+                    pipe.expire(key, self.ttl_seconds)
+                    raw, touched = await pipe.execute()
+        except RedisUnavailable:
+            self.cache.abort(token)
+            self.fallback.degraded_reads += 1
+            state = self.fallback.get(key)
+            return dict(state) if state else None
+        except Exception:
+            self.cache.abort(token)
+            raise
+        state = self._decode(raw)
+        self.cache.finish(token, state and dict(state), wrote=bool(touched))
+        self.fallback.put(key, state and dict(state))
+        return state
 
-        if thread_info:
-            last_activity_str = thread_info.get("last_activity")
-            last_activity = datetime.fromisoformat(last_activity_str) if last_activity_str else None
-            
-            if not last_activity or datetime.now() - last_activity > self.expiration_time:
-                logger.info(f"🕒 Conversación expirada para {client_number}. Reiniciando...")
-                self.redis_client.delete(client_number)
-                thread_id = None
-            else:
-                thread_id = thread_info.get("thread_id")
-        else:
-            thread_id = None
-
-        return thread_id
+    async def get_or_create_thread(self, client_number: str):
+        """
+        Devuelve el thread_id activo del cliente o None si hay que crear uno nuevo.
+        """
+        thread_info = await self.get_thread_state(client_number)
+        return thread_info["thread_id"] if thread_info else None
 
-    def update_thread_activity(self, client_number: str, thread_id: str):
+    async def update_thread_activity(self, client_number: str, thread_id: str, tokens: int = 0) -> dict:
         """
-        Actualiza o crea la entrada de conversación con su timestamp.
+        Guarda el nuevo extremo de la cadena y suma el turno y sus tokens a los del hilo.
+        Devuelve el estado resultante.
         """
-        thread_info = {
-            "thread_id": thread_id,
-            "last_activity": datetime.now().isoformat()
-        }
-        self.redis_client.set(client_number, json.dumps(thread_info))
+        key = self._key(client_number)
+        token = None
+        try:
+            with self.breaker.guard():
+                await self.reconcile()
+                token = self.cache.begin(key, writes=True)
+                async with self.redis_client.pipeline(transaction=True) as pipe:
+                    pipe.hset(key, mapping={"thread_id": thread_id, "last_activity": time.time()})
+                    pipe.hdel(key, "summary")
+                    pipe.hincrby(key, "turns", 1)
+                    pipe.hincrby(key, "tokens", tokens)
+                    pipe.hgetall(key)
+                    pipe.expire(key, self.ttl_seconds)
+                    *_, raw, _ = await pipe.execute()
+        except RedisUnavailable:
+            self.cache.abort(token)
+            previous = self.fallback.get(key) or self._decode({"turns": 0})
+            state = dict(previous, thread_id=thread_id, summary=None, last_activity=time.time(),
+                         turns=previous["turns"] + 1, tokens=previous["tokens"] + tokens)
+            return self._write_degraded(key, state)
+        except Exception:
+            self.cache.abort(token)
+            raise
+        state = self._decode(raw)
+        self.cache.finish(token, dict(state))
+        self.fallback.put(key, dict(state))
         logger.info(f"💾 Memoria actualizada para {client_number} (thread {thread_id})")
-        return thread_id
+        return state
+
+    async def start_compacted_thread(self, client_number: str, summary: str, state: dict) -> dict:
+        """
+        Cierra la cadena actual: el próximo turno arranca un hilo nuevo con `summary` como contexto.
+        """
+        key = self._key(client_number)
+        thread_info = {"summary": summary, "last_activity": time.time(), "turns": 0, "tokens": 0,
+                       "compactions": state.get("compactions", 0) + 1}
+        token = None
+        try:
+            with self.breaker.guard():
+                await self.reconcile()
+                token = self.cache.begin(key, writes=True)
+                async with self.redis_client.pipeline(transaction=True) as pipe:
+                    pipe.delete(key)
+                    pipe.hset(key, mapping=thread_info)
+                    pipe.expire(key, self.ttl_seconds)
+                    await pipe.execute()
+        except RedisUnavailable:
+            self.cache.abort(token)
+            return self._write_degraded(key, self._decode(thread_info))
+        except Exception:
+            self.cache.abort(token)
+            raise
+        state = self._decode(thread_info)
+        self.cache.finish(token, dict(state))
+        self.fallback.put(key, dict(state))
+        logger.info(f"🗜️ Hilo de {client_number} compactado; el próximo turno arranca una cadena nueva")
+        return state
+
+    def _write_degraded(self, key: str, state: dict) -> dict:
+        self.fallback.put(key, dict(state), dirty=True)
+        self.fallback.degraded_writes += 1
+        logger.warning(f"⚠️ Redis no disponible: el hilo {key} queda en memoria hasta que vuelva")
+        return state
+
+    async def reconcile(self):
+        """
+        Vuelca a Redis los hilos escritos sin Redis. Si mientras tanto otro worker guardó una
+        actividad más reciente, gana la de Redis.
+        """
+        for key, state, _ in self.fallback.dirty_items():
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(key)
+                    current = self._decode(await pipe.hgetall(key))
+                    if current and current["last_activity"] >= state["last_activity"]:
+                        self.fallback.mark_clean(key, conflict=True)
+                        continue
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.hset(key, mapping={k: v for k, v in state.items() if v is not None})
+                    pipe.expire(key, self.ttl_seconds)
+                    await pipe.execute()
+                except WatchError:
+                    self.fallback.mark_clean(key, conflict=True)
+                    continue
+            self.fallback.mark_clean(key)
+            logger.info(f"🔁 Hilo {key} reconciliado con Redis")
 
 memory_handler = MemoryHandler()
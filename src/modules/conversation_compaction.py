@@ -0,0 +1,125 @@
+import asyncio
+import time
+from typing import Optional
+from src.modules.openai_client import get_openai_service
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+COMPACTION_PROMPT = (
+    "Resumí esta conversación para continuarla en un hilo nuevo. No le respondas al cliente. "
+    "Escribí en pocas líneas, sólo con datos confirmados en la conversación:\n"
+    "- Cliente: user_id, CUIT, nombre y si el teléfono ya está vinculado (o que no está registrado).\n"
+    "- Pedidos: ids de pedidos creados en esta conversación y el pedido en armado que falte "
+    "confirmar (productos, cantidades y qué falta).\n"
+    "- Consultas o reclamos derivados (tipo y estado) y cualquier dato que el cliente ya haya dado.\n"
+    "- Lo último que se le preguntó o prometió al cliente.\n"
+    "Omití saludos, el catálogo y las salidas completas de herramientas."
+)
+
+
+def summary_message(summary: str) -> dict:
+    """Mensaje developer con el que arranca la cadena nueva de un hilo compactado."""
+    return {"role": "developer",
+            "content": f"Resumen de la conversación previa con este cliente (hilo compactado):\n{summary}"}
+
+
+class ConversationCompactor:
+    """
+    Compactación de hilos largos.
+
+    Cada turno reenvía toda la cadena de `previous_response_id` (con las salidas de herramientas
+    anteriores), así que los tokens de entrada crecen con cada turno del día. Cuando el hilo llega
+    a `max_turns` turnos o a `max_tokens` tokens acumulados, después de enviar la respuesta se le
+    pide al modelo un resumen (sin herramientas) y el hilo se cierra: el próximo turno arranca una
+    cadena nueva con el prefijo de siempre más el resumen como mensaje developer.
+
+    Se registran los tokens de entrada del hilo antes (el contexto completo que se reenviaba) y
+    después (el resumen).
+    """
+
+    def __init__(self, max_turns: int = settings.COMPACTION_MAX_TURNS,
+                 max_tokens: int = settings.COMPACTION_MAX_TOKENS,
+                 model: Optional[str] = settings.COMPACTION_MODEL,
+                 timeout: float = settings.COMPACTION_TIMEOUT_SECONDS):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.model = model or settings.MODEL_LARGE
+        self.timeout = timeout
+
+        # Métricas
+        self.compactions = 0
+        self.failures = 0
+        self.triggers: dict = {}
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def trigger(self, state: Optional[dict]) -> Optional[str]:
+        """Motivo para compactar el hilo ("turns" o "tokens"), o None."""
+        if not state or not state.get("thread_id") or state.get("turns", 0) < 2:
+            return None
+        if self.max_turns > 0 and state["turns"] >= self.max_turns:
+            return "turns"
+        if self.max_tokens > 0 and state.get("tokens", 0) >= self.max_tokens:
+            return "tokens"
+        return None
+
+    async def summarize(self, thread_id: str) -> tuple:
+        """Pide el resumen de la cadena que termina en `thread_id`; devuelve (texto, response, segundos)."""
+        request = dict(model=self.model, previous_response_id=thread_id, temperature=0,
+                       input=[{"role": "developer", "content": COMPACTION_PROMPT}])
+        if settings.OPENAI_PROMPT_CACHE_KEY:
+            request["prompt_cache_key"] = settings.OPENAI_PROMPT_CACHE_KEY
+        start = time.monotonic()
+        response = await asyncio.wait_for(get_openai_service().create_response(**request), timeout=self.timeout)
+        return response.output_text.strip(), response, time.monotonic() - start
+
+    async def compact(self, phone: str, state: dict, memory, ledger=None) -> Optional[dict]:
+        """
+        Compacta el hilo de `phone` si corresponde. Devuelve el registro de la compactación (también
+        en `ledger.compaction`) o None. Si el resumen falla el hilo sigue como estaba.
+        """
+        reason = self.trigger(state)
+        if reason is None:
+            return None
+        try:
+            summary, response, seconds = await self.summarize(state["thread_id"])
+            if not summary:
+                raise ValueError("el resumen vino vacío")
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"⚠️ No se pudo compactar el hilo de {phone}: {e}")
+            return None
+
+        usage = response.usage
+        before = getattr(usage, "input_tokens", 0) or 0
+        after = getattr(usage, "output_tokens", 0) or len(summary) // 4
+        await memory.start_compacted_thread(phone, summary, state)
+        record = {"trigger": reason, "turns": state["turns"], "thread_tokens": state.get("tokens", 0),
+                  "tokens_before": before, "tokens_after": after, "seconds": round(seconds, 3)}
+        self.compactions += 1
+        self.triggers[reason] = self.triggers.get(reason, 0) + 1
+        self.tokens_before += before
+        self.tokens_after += after
+        if ledger is not None:
+            if usage is not None:
+                ledger.record_round(self.model, usage, seconds)
+            ledger.compaction = record
+        logger.info(f"🗜️ Hilo de {phone} compactado por {reason}: {before} -> {after} tokens de contexto "
+                    f"({state['turns']} turnos, {state.get('tokens', 0)} tokens acumulados)")
+        return record
+
+    def stats(self) -> dict:
+        return {
+            "max_turns": self.max_turns,
+            "max_tokens": self.max_tokens,
+            "compactions": self.compactions,
+            "failures": self.failures,
+            "triggers": self.triggers,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "avg_reduction": round(1 - self.tokens_after / self.tokens_before, 3) if self.tokens_before else 0.0,
+        }
+
+conversation_compactor = ConversationCompactor()
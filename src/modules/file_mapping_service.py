@@ -1,31 +1,83 @@
-from src.modules.redis_conexion import get_redis_client
+from src.modules.redis_conexion import get_async_redis_client
+from src.modules.local_cache import LocalCache, MISSING, file_link_cache
+from src.modules.redis_resilience import (
+    CircuitBreaker, FallbackStore, RedisUnavailable, redis_breaker, file_link_fallback)
+from src.utils.logger import get_logger
 from datetime import timedelta
 import uuid
 
+logger = get_logger(__name__)
+
 class FileMappingService:
+    """
+    IDs cortos (FILE_xxxx) para las URLs de SharePoint de los archivos recibidos, en `file_map:`.
+    Si Redis no responde los mappings se crean y resuelven en memoria (`file_link_fallback`) y se
+    guardan en Redis cuando vuelve.
+    """
     PREFIX = "file_map:"
     TTL = timedelta(hours=2)
-    
-    def __init__(self):
-        try:
-            self.redis = get_redis_client()
-        except Exception as e:
-            print(f"Error connecting to Redis: {e}")
-            self.redis = None
-        
-    def create_mapping(self, real_link: str) -> str | None:
-        if not self.redis:
-            return None
+
+    def __init__(self, redis_client=None, cache: LocalCache = file_link_cache,
+                 breaker: CircuitBreaker = redis_breaker, fallback: FallbackStore = file_link_fallback):
+        self._redis = redis_client
+        self.cache = cache
+        self.breaker = breaker
+        self.fallback = fallback
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    async def create_mapping(self, real_link: str) -> str | None:
         file_id = f"FILE_{uuid.uuid4().hex[:8]}"
-        self.redis.setex(
-            f"{self.PREFIX}{file_id}",
-            self.TTL,
-            real_link
-        )
+        key = f"{self.PREFIX}{file_id}"
+        token = None
+        try:
+            with self.breaker.guard():
+                await self.reconcile()
+                token = self.cache.begin(key, writes=True)
+                await self.redis_client.setex(key, self.TTL, real_link)
+        except RedisUnavailable:
+            self.cache.abort(token)
+            self.fallback.put(key, real_link, self.TTL.total_seconds(), dirty=True)
+            self.fallback.degraded_writes += 1
+            logger.warning(f"⚠️ Redis no disponible: el mapping {file_id} queda en memoria hasta que vuelva")
+            return file_id
+        except Exception:
+            self.cache.abort(token)
+            raise
+        self.cache.finish(token, real_link)
+        self.fallback.put(key, real_link, self.TTL.total_seconds())
         return file_id
-    
-    def get_link(self, file_id: str) -> str | None:
-        if not self.redis or not file_id:
+
+    async def get_link(self, file_id: str) -> str | None:
+        if not file_id:
             return None
-        link_bytes = self.redis.get(f"{self.PREFIX}{file_id}")
-        return link_bytes
\ No newline at end of file
+        key = f"{self.PREFIX}{file_id}"
+        cached = self.cache.get(key)
+        if cached is not MISSING:
+            return cached
+        token = None
+        try:
+            with self.breaker.guard():
+                await self.reconcile()
+                token = self.cache.begin(key)
+                link_bytes = await self.redis_client.get(key)
+        except RedisUnavailable:
+            self.cache.abort(token)
+            self.fallback.degraded_reads += 1
+            return self.fallback.get(key)
+        except Exception:
+            self.cache.abort(token)
+            raise
+        self.cache.finish(token, link_bytes)
+        self.fallback.put(key, link_bytes, self.TTL.total_seconds())
+        return link_bytes
+
+    async def reconcile(self):
+        """Guarda en Redis los mappings creados sin Redis, con lo que les queda de vida."""
+        for key, link, remaining in self.fallback.dirty_items():
+            await self.redis_client.set(key, link, px=max(int(remaining * 1000), 1), nx=True)
+            self.fallback.mark_clean(key)
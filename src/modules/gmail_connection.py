@@ -15,7 +15,8 @@ file_mapper = FileMappingService()
 class EmailConfig:
     def __init__(self):
         self.smtp_server = settings.SMTP_SERVER
-        self.smtp_port = 587
+        self.smtp_port = settings.SMTP_PORT
+        self.starttls = settings.SMTP_STARTTLS
         self.sender_email = settings.SENDER_EMAIL
         self.sender_password = settings.SENDER_PASSWORD
         
@@ -102,7 +103,8 @@ class EmailHandler:
             message.attach(MIMEText(body, "plain"))
 
             with smtplib.SMTP(self.config.smtp_server, self.config.smtp_port) as server:
-                server.starttls()
+                if self.config.starttls:
+                    server.starttls()
                 server.login(self.config.sender_email, self.config.sender_password)
                 server.send_message(message)
             return True
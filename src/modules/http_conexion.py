@@ -0,0 +1,39 @@
+import httpx
+from typing import Optional
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import h2  # noqa: F401  (httpx sólo habilita HTTP/2 si está instalado)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Cliente HTTP asíncrono compartido por todo el proceso (keep-alive, pool acotado).
+    Se crea en el lifespan de la app y se cierra con `close_http_client`.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(settings.HTTP_READ_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+        )
+        logger.info(f"🌐 Cliente HTTP compartido creado (HTTP/2: {HTTP2_AVAILABLE})")
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -0,0 +1,299 @@
+"""
+Caché en proceso de claves de Redis (sesiones y file mappings), coherente entre workers.
+
+Cada worker guarda las últimas claves leídas o escritas en un LRU acotado y las sirve sin ir a
+Redis. La coherencia la da el client-side caching de Redis en modo broadcast: una conexión
+dedicada (`CacheInvalidator`) pide `CLIENT TRACKING ... BCAST PREFIX session: PREFIX file_map:`
+redirigido a sí misma y queda suscripta a `__redis__:invalidate`; cada vez que alguien modifica,
+borra o deja vencer una clave con esos prefijos llega su nombre y se descarta la copia local.
+
+Redis también avisa de las escrituras propias (y de cada EXPIRE). Para no tirar lo que se acaba
+de escribir, cada operación propia que modifica la clave anota que espera una invalidación y la
+primera que llega se descuenta. Si mientras una operación está en vuelo llega una invalidación
+que no se esperaba, el valor que devuelva esa operación no se guarda.
+
+Sin la conexión de invalidaciones la caché no se usa (todo va a Redis); al reconectar arranca
+vacía. El TTL local acota cuánto podría durar una copia vieja si se perdiera un aviso.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+from src.modules.redis_conexion import get_async_redis_client
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+INVALIDATE_CHANNEL = "__redis__:invalidate"
+MISSING = object()
+
+
+class _Flight:
+    """Operaciones en curso sobre una clave."""
+    __slots__ = ("ops", "expected", "dirty")
+
+    def __init__(self):
+        self.ops = 0
+        self.expected = 0  # invalidaciones propias que todavía no llegaron
+        self.dirty = False  # hubo una invalidación ajena durante la operación
+
+
+class LocalCache:
+    """
+    LRU de claves con un prefijo de Redis. `get` devuelve MISSING si no hay copia (o si la caché
+    no está activa). Las lecturas y escrituras contra Redis se envuelven en `begin` / `finish`:
+
+        token = cache.begin(key, writes=True)
+        value = ...  # operación contra Redis
+        cache.finish(token, value)
+    """
+
+    def __init__(self, name: str, prefix: str, max_entries: int = settings.LOCAL_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = settings.LOCAL_CACHE_TTL_SECONDS):
+        self.name = name
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.active = False
+        self._entries: OrderedDict = OrderedDict()  # key -> (valor, vence)
+        self._flights: dict = {}
+        self._generation = 0
+
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.own_invalidations = 0
+        self.evictions = 0
+        self.flushes = 0
+
+    def get(self, key: str):
+        if not self.active:
+            return MISSING
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def begin(self, key: str, writes: bool = False) -> Optional[tuple]:
+        """Registra una operación sobre `key`; `writes` si va a modificarla (y Redis va a avisar)."""
+        if not self.active:
+            return None
+        flight = self._flights.setdefault(key, _Flight())
+        flight.ops += 1
+        flight.expected += int(writes)
+        return key, self._generation
+
+    def finish(self, token: Optional[tuple], value=MISSING, wrote: Optional[bool] = None):
+        """
+        Cierra la operación y guarda `value` si nada lo invalidó mientras tanto. `wrote=False`
+        avisa que la operación no modificó la clave (p. ej. un EXPIRE sobre una clave que no existe).
+        """
+        if token is None:
+            return
+        key, generation = token
+        flight = self._flights.get(key)
+        if generation != self._generation or flight is None:
+            return
+        if wrote is False and flight.expected > 0:
+            flight.expected -= 1
+        if not flight.dirty and value is not MISSING and value is not None:
+            self._store(key, value)
+        self._close(key, flight)
+
+    def abort(self, token: Optional[tuple]):
+        """La operación falló: no se sabe qué quedó en Redis, se descarta la copia."""
+        if token is None:
+            return
+        key, generation = token
+        self._entries.pop(key, None)
+        flight = self._flights.get(key)
+        if generation == self._generation and flight is not None:
+            flight.expected = 0
+            self._close(key, flight)
+
+    def invalidate(self, key: str):
+        """Aviso de Redis de que `key` cambió."""
+        flight = self._flights.get(key)
+        if flight is not None and flight.expected > 0:
+            flight.expected -= 1
+            self.own_invalidations += 1
+            if flight.ops == 0 and flight.expected == 0:
+                del self._flights[key]
+            return
+        if flight is not None:
+            flight.dirty = True
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def flush(self):
+        """Descarta todo (FLUSHDB o se perdió la conexión de invalidaciones)."""
+        self._entries.clear()
+        self._flights.clear()
+        self._generation += 1
+        self.flushes += 1
+
+    def _store(self, key: str, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _close(self, key: str, flight: _Flight):
+        flight.ops -= 1
+        if flight.ops <= 0:
+            flight.dirty = False
+            if flight.expected <= 0:
+                del self._flights[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "active": self.active,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "own_invalidations": self.own_invalidations,
+            "evictions": self.evictions,
+            "flushes": self.flushes,
+        }
+
+
+class CacheInvalidator:
+    """
+    Conexión dedicada que recibe las invalidaciones de Redis y las reparte entre las cachés por
+    prefijo. Se arranca y se detiene en el lifespan de la app; se reconecta sola.
+    """
+
+    def __init__(self, caches: list, redis_client=None, ping_seconds: float = settings.LOCAL_CACHE_PING_SECONDS,
+                 retry_seconds: float = 1.0):
+        self.caches = caches
+        self._redis = redis_client
+        self.ping_seconds = ping_seconds
+        self.retry_seconds = retry_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+
+        # Métricas
+        self.connects = 0
+        self.errors = 0
+        self.messages = 0
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def wait_connected(self, timeout: float = 5.0) -> bool:
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _set_active(self, active: bool):
+        for cache in self.caches:
+            if cache.active != active:
+                cache.flush()
+                cache.active = active
+        if active:
+            self._connected.set()
+        else:
+            self._connected.clear()
+
+    def dispatch(self, keys: Optional[list]):
+        if keys is None:
+            for cache in self.caches:
+                cache.flush()
+            return
+        for key in keys:
+            for cache in self.caches:
+                if key.startswith(cache.prefix):
+                    cache.invalidate(key)
+
+    async def _subscribe(self):
+        connection = self.redis_client.connection_pool.make_connection()
+        await connection.connect()
+        await connection.send_command("CLIENT", "ID")
+        client_id = await connection.read_response()
+        tracking = ["CLIENT", "TRACKING", "on", "REDIRECT", client_id, "BCAST"]
+        for cache in self.caches:
+            tracking += ["PREFIX", cache.prefix]
+        await connection.send_command(*tracking)
+        await connection.read_response()
+        await connection.send_command("SUBSCRIBE", INVALIDATE_CHANNEL)
+        await connection.read_response()
+        return connection
+
+    async def _run(self):
+        while True:
+            connection = None
+            try:
+                connection = await self._subscribe()
+                self.connects += 1
+                self._set_active(True)
+                logger.info(f"🔔 Caché local activa ({', '.join(c.prefix for c in self.caches)})")
+                awaiting_pong = False
+                while True:
+                    message = await connection.read_response(timeout=self.ping_seconds)
+                    if message is None:
+                        if awaiting_pong:
+                            raise ConnectionError("la conexión de invalidaciones no responde")
+                        await connection.send_command("PING")
+                        awaiting_pong = True
+                        continue
+                    awaiting_pong = False
+                    if message[0] == "message" and message[1] == INVALIDATE_CHANNEL:
+                        self.messages += 1
+                        self.dispatch(message[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"⚠️ Caché local desactivada, sin conexión de invalidaciones: {e}")
+            finally:
+                self._set_active(False)
+                if connection is not None:
+                    await connection.disconnect()
+            await asyncio.sleep(self.retry_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "connects": self.connects,
+            "errors": self.errors,
+            "messages": self.messages,
+            **{cache.name: cache.stats() for cache in self.caches},
+        }
+
+session_cache = LocalCache("sessions", "session:")
+file_link_cache = LocalCache("file_links", "file_map:")
+cache_invalidator = CacheInvalidator([session_cache, file_link_cache])
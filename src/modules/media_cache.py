@@ -0,0 +1,106 @@
+from typing import Optional
+from src.modules.redis_conexion import get_async_redis_client
+from src.modules.redis_resilience import CircuitBreaker, redis_breaker
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class MediaCache:
+    """
+    Índice por contenido de los archivos ya subidos a SharePoint: sha256 del archivo -> URL y file_id.
+
+    Cuando un cliente reenvía la misma foto o documento se reutiliza el archivo ya subido
+    (y su mapping FILE_xxxx) en lugar de subir otra copia a `staging`. La clave incluye el
+    número del remitente para no compartir archivos entre clientes distintos.
+
+    Usa el cliente asyncio detrás de `redis_breaker`: si Redis no responde, la consulta cuenta
+    como miss y el archivo se sube de nuevo.
+    """
+    PREFIX = "media_sha256:"
+    URL_PREFIX = "media_url:"
+
+    def __init__(self, ttl_seconds: int = settings.MEDIA_CACHE_TTL_SECONDS, redis_client=None,
+                 breaker: CircuitBreaker = redis_breaker):
+        self.ttl_seconds = ttl_seconds
+        self._redis = redis_client
+        self.breaker = breaker
+
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def _key(self, owner: str, digest: str) -> str:
+        return f"{self.PREFIX}{owner}:{digest}"
+
+    async def lookup(self, owner: str, digest: str) -> Optional[dict]:
+        """Devuelve {"url", "file_id"} del archivo ya subido con ese hash, o None."""
+        if not self.enabled:
+            return None
+        try:
+            with self.breaker.guard():
+                entry = await self.redis_client.hgetall(self._key(owner, digest))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ No se pudo consultar la caché de media: {e}")
+            return None
+        if not entry or not entry.get("url"):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    async def store(self, owner: str, digest: str, url: str, file_id: str):
+        """Registra (o actualiza) el archivo subido para ese hash y renueva el TTL."""
+        if not self.enabled:
+            return
+        key = self._key(owner, digest)
+        try:
+            with self.breaker.guard():
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.hset(key, mapping={"url": url, "file_id": file_id})
+                    pipe.expire(key, self.ttl_seconds)
+                    pipe.set(f"{self.URL_PREFIX}{url}", key, ex=self.ttl_seconds)
+                    await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ No se pudo guardar {digest} en la caché de media: {e}")
+
+    async def invalidate_url(self, url: Optional[str]):
+        """Olvida el hash asociado a una URL (p. ej. cuando el archivo se mueve fuera de `staging`)."""
+        if not self.enabled or not url:
+            return
+        try:
+            with self.breaker.guard():
+                key = await self.redis_client.get(f"{self.URL_PREFIX}{url}")
+                if key:
+                    await self.redis_client.delete(key, f"{self.URL_PREFIX}{url}")
+                    self.invalidations += 1
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ No se pudo invalidar {url} en la caché de media: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+media_cache = MediaCache()
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+from src.modules.redis_conexion import get_async_redis_client
+from src.modules.redis_resilience import CircuitBreaker, redis_breaker
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class MessageDeduplicator:
+    """
+    Descarta los mensajes de WhatsApp que Meta vuelve a entregar, usando su id (wamid).
+
+    Los ids procesados se registran en Redis con SET NX + TTL (atómico entre workers) y en
+    una caché local acotada, que resuelve la mayoría de los duplicados sin ir a la red.
+
+    La verificación corre en el webhook, antes del ack: usa el cliente asyncio detrás de
+    `redis_breaker` y, si Redis no contesta en `timeout_seconds` (o el circuito está abierto),
+    deja pasar el mensaje.
+    """
+    PREFIX = "wamid:"
+
+    def __init__(self, ttl_seconds: int = settings.DEDUP_TTL_SECONDS,
+                 local_size: int = settings.DEDUP_LOCAL_CACHE_SIZE, redis_client=None,
+                 breaker: CircuitBreaker = redis_breaker,
+                 timeout_seconds: float = settings.DEDUP_REDIS_TIMEOUT):
+        self.ttl_seconds = ttl_seconds
+        self.local_size = local_size
+        self.timeout_seconds = timeout_seconds
+        self._seen: OrderedDict = OrderedDict()
+        self._redis = redis_client
+        self.breaker = breaker
+
+        # Métricas
+        self.checked = 0
+        self.local_duplicates = 0
+        self.redis_duplicates = 0
+        self.failed_open = 0
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    def _remember(self, message_id: str, now: float):
+        self._seen[message_id] = now + self.ttl_seconds
+        self._seen.move_to_end(message_id)
+        while len(self._seen) > self.local_size:
+            self._seen.popitem(last=False)
+
+    async def is_duplicate(self, message_id: Optional[str]) -> bool:
+        """
+        Registra el id y devuelve True si ya había sido recibido.
+        Si Redis no responde se deja pasar el mensaje (fail-open).
+        """
+        if not message_id:
+            return False
+        self.checked += 1
+        now = time.monotonic()
+
+        expires_at = self._seen.get(message_id)
+        if expires_at is not None and expires_at > now:
+            self._seen.move_to_end(message_id)
+            self.local_duplicates += 1
+            return True
+
+        first_time = True
+        try:
+            with self.breaker.guard():
+                first_time = bool(await asyncio.wait_for(
+                    self.redis_client.set(f"{self.PREFIX}{message_id}", 1, nx=True, ex=self.ttl_seconds),
+                    self.timeout_seconds))
+        except Exception as e:
+            self.failed_open += 1
+            logger.warning(f"⚠️ No se pudo verificar duplicado de {message_id} en Redis: {e}")
+
+        self._remember(message_id, now)
+        if not first_time:
+            self.redis_duplicates += 1
+        return not first_time
+
+    async def forget(self, message_id: Optional[str]):
+        """Libera un id registrado (p. ej. si el mensaje no se pudo encolar y Meta lo reenviará)."""
+        if not message_id:
+            return
+        self._seen.pop(message_id, None)
+        try:
+            with self.breaker.guard():
+                await asyncio.wait_for(self.redis_client.delete(f"{self.PREFIX}{message_id}"), self.timeout_seconds)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo liberar el id {message_id} en Redis: {e}")
+
+    def stats(self) -> dict:
+        duplicates = self.local_duplicates + self.redis_duplicates
+        return {
+            "checked": self.checked,
+            "duplicates": duplicates,
+            "local_duplicates": self.local_duplicates,
+            "redis_duplicates": self.redis_duplicates,
+            "failed_open": self.failed_open,
+            "local_cache_size": len(self._seen),
+        }
+
+message_dedup = MessageDeduplicator()
@@ -0,0 +1,213 @@
+import json
+import re
+from typing import Optional
+from src.modules.answer_cache import normalize_question
+from src.modules.redis_conexion import get_async_redis_client
+from src.modules.redis_resilience import CircuitBreaker, RedisUnavailable, redis_breaker
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class MalformedToolCall(Exception):
+    """El modelo emitió una llamada a herramienta inválida (nombre desconocido, JSON roto o faltan argumentos)."""
+
+    def __init__(self, reason: str, response=None, model_seconds: float = 0.0):
+        super().__init__(reason)
+        self.response = response
+        self.model_seconds = model_seconds
+
+
+class ModelRoute:
+    """Modelo elegido para un turno (o un paso) y por qué; `escalate` lo pasa al modelo grande para el resto del turno."""
+    __slots__ = ("model", "tier", "reason", "escalated")
+
+    def __init__(self, model: str, tier: str, reason: str):
+        self.model = model
+        self.tier = tier
+        self.reason = reason
+        self.escalated = False
+
+    def as_dict(self) -> dict:
+        return {"model": self.model, "tier": self.tier, "reason": self.reason, "escalated": self.escalated}
+
+
+class ModelRouter:
+    """
+    Elige el modelo de cada turno con reglas locales y baratas:
+
+    - un override del hilo (`model_override:{número}`, fijado a mano por `/model/{número}` o por
+      una escalada anterior) manda sobre todo lo demás;
+    - con archivos adjuntos, mensajes de más de `max_chars` caracteres o palabras que anticipan
+      una herramienta (CUIT, pedidos, reclamos, números largos) va el modelo grande;
+    - el resto (saludos, agradecimientos, preguntas sobre el catálogo u horarios) va al chico.
+
+    Cada paso del loop de herramientas se vuelve a rutear con las salidas que recibe
+    (`choose_step`): si alguna herramienta falló o devolvió más de `max_tool_output_chars`
+    caracteres va el grande; si no, el chico. Un override o una escalada valen para todo el turno.
+    Si el modelo chico emite una llamada a herramienta inválida, el paso se repite con el grande
+    y, si `sticky` está activo, el hilo queda en el grande hasta que expire el override.
+
+    Los overrides se leen con el cliente asyncio detrás de `redis_breaker`; si Redis no responde
+    el turno se elige sólo con las reglas.
+    """
+    OVERRIDE_PREFIX = "model_override:"
+    LARGE = "large"
+    SMALL = "small"
+
+    def __init__(self, large_model: str = settings.MODEL_LARGE,
+                 small_model: Optional[str] = settings.MODEL_SMALL,
+                 max_chars: int = settings.MODEL_ROUTER_MAX_CHARS,
+                 max_tool_output_chars: int = settings.MODEL_ROUTER_MAX_TOOL_OUTPUT_CHARS,
+                 tool_keywords: Optional[list] = None,
+                 override_ttl_seconds: int = settings.MODEL_OVERRIDE_TTL_SECONDS,
+                 sticky: bool = settings.MODEL_ESCALATION_STICKY,
+                 redis_client=None, breaker: CircuitBreaker = redis_breaker):
+        self.large_model = large_model
+        self.small_model = small_model or None
+        self.max_chars = max_chars
+        self.max_tool_output_chars = max_tool_output_chars
+        keywords = settings.MODEL_ROUTER_TOOL_KEYWORDS if tool_keywords is None else tool_keywords
+        self._tool_pattern = re.compile(r"\b(" + "|".join(map(re.escape, keywords)) + r")|\d{7,}") \
+            if keywords else re.compile(r"\d{7,}")
+        self.override_ttl_seconds = override_ttl_seconds
+        self.sticky = sticky
+        self._redis = redis_client
+        self.breaker = breaker
+
+        # Métricas
+        self.routes: dict = {}
+        self.reasons: dict = {}
+        self.escalations = 0
+        self.turns: dict = {}
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    @property
+    def enabled(self) -> bool:
+        return self.small_model is not None and self.small_model != self.large_model
+
+    def tier_of(self, model: str) -> str:
+        return self.SMALL if model == self.small_model else self.LARGE
+
+    def _route(self, model: str, reason: str) -> ModelRoute:
+        route = ModelRoute(model, self.tier_of(model), reason)
+        self.routes[route.tier] = self.routes.get(route.tier, 0) + 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return route
+
+    def _key(self, phone: str) -> str:
+        return f"{self.OVERRIDE_PREFIX}{phone}"
+
+    async def get_override(self, phone: Optional[str]) -> Optional[dict]:
+        if not phone:
+            return None
+        try:
+            with self.breaker.guard():
+                raw = await self.redis_client.get(self._key(phone))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo leer el override de modelo de {phone}: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def set_override(self, phone: str, model: str, reason: str = "manual") -> Optional[dict]:
+        """Fija el modelo del hilo; devuelve None si Redis no responde y no quedó guardado."""
+        override = {"model": model, "reason": reason}
+        try:
+            with self.breaker.guard():
+                await self.redis_client.set(self._key(phone), json.dumps(override), ex=self.override_ttl_seconds)
+        except RedisUnavailable as e:
+            logger.warning(f"⚠️ No se pudo guardar el override de modelo de {phone}: {e}")
+            return None
+        return override
+
+    async def clear_override(self, phone: str) -> bool:
+        try:
+            with self.breaker.guard():
+                return bool(await self.redis_client.delete(self._key(phone)))
+        except RedisUnavailable as e:
+            logger.warning(f"⚠️ No se pudo borrar el override de modelo de {phone}: {e}")
+            return False
+
+    async def choose(self, user_message: str, files_id: Optional[list] = None,
+                     phone: Optional[str] = None) -> ModelRoute:
+        """Modelo para el turno según el override del hilo y las reglas de la clase."""
+        override = await self.get_override(phone)
+        if override:
+            return self._route(override["model"], f"override:{override.get('reason', 'manual')}")
+        if not self.enabled:
+            return self._route(self.large_model, "default")
+        if files_id:
+            return self._route(self.large_model, "files")
+        if len(user_message) > self.max_chars:
+            return self._route(self.large_model, "long_message")
+        if self._tool_pattern.search(normalize_question(user_message)):
+            return self._route(self.large_model, "tool_likely")
+        return self._route(self.small_model, "simple")
+
+    def choose_step(self, route: ModelRoute, tools_output: list) -> ModelRoute:
+        """Modelo para el paso que recibe `tools_output`, a partir de la ruta del paso anterior."""
+        if not self.enabled or route.escalated or route.reason.startswith("override"):
+            return route
+        outputs = [item.get("output", "") for item in tools_output]
+        if any(output.startswith('{"error"') for output in outputs):
+            model, reason = self.large_model, "step:tool_error"
+        elif sum(len(output) for output in outputs) > self.max_tool_output_chars:
+            model, reason = self.large_model, "step:long_tool_output"
+        else:
+            model, reason = self.small_model, "step:tool_output"
+        if model == route.model:
+            return route
+        return self._route(model, reason)
+
+    async def escalate(self, route: ModelRoute, phone: Optional[str], problem: str) -> bool:
+        """Pasa el turno al modelo grande; devuelve False si ya estaba en él."""
+        if route.model == self.large_model:
+            return False
+        logger.warning(f"⬆️ {route.model} emitió una llamada inválida ({problem}); se repite el paso con "
+                       f"{self.large_model}")
+        self.escalations += 1
+        route.model, route.tier, route.escalated = self.large_model, self.LARGE, True
+        if self.sticky and phone:
+            await self.set_override(phone, self.large_model, reason="escalation")
+        return True
+
+    def can_escalate(self, model: str) -> bool:
+        return self.enabled and model != self.large_model
+
+    def record_turn(self, entry: dict):
+        """Acumula latencia, tokens y costo por tier (de `TurnLedger.entry`) para compararlos en /metrics."""
+        route = entry.get("route")
+        if not route:
+            return
+        s = self.turns.setdefault(route["tier"], {"turns": 0, "seconds": 0.0, "tokens": 0, "cost_usd": 0.0})
+        s["turns"] += 1
+        s["seconds"] += entry["latency_seconds"]
+        s["tokens"] += entry["input_tokens"] + entry["output_tokens"]
+        s["cost_usd"] += entry["cost_usd"]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "large_model": self.large_model,
+            "small_model": self.small_model,
+            "routes": self.routes,
+            "reasons": self.reasons,
+            "escalations": self.escalations,
+            "turns": {
+                tier: {
+                    "turns": s["turns"],
+                    "avg_seconds": round(s["seconds"] / s["turns"], 3),
+                    "avg_tokens": round(s["tokens"] / s["turns"], 1),
+                    "avg_cost_usd": round(s["cost_usd"] / s["turns"], 6),
+                }
+                for tier, s in self.turns.items()
+            },
+        }
+
+model_router = ModelRouter()
@@ -1,16 +1,119 @@
+import asyncio
 import io
-from openai import AsyncOpenAI
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 api_key = settings.OPENAI_API_KEY
+base_url = settings.OPENAI_BASE_URL
+
+
+class LLMQueueTimeout(Exception):
+    """No se liberó un lugar para el modelo dentro de OPENAI_QUEUE_TIMEOUT."""
+
+
+class ModelLimiter:
+    """
+    Límite de llamadas simultáneas por modelo/endpoint. Las llamadas que exceden el límite
+    esperan en cola hasta `queue_timeout` segundos y luego fallan con LLMQueueTimeout.
+    """
+
+    def __init__(self, default_limit: int = settings.OPENAI_DEFAULT_CONCURRENCY,
+                 limits: Optional[dict] = None, queue_timeout: float = settings.OPENAI_QUEUE_TIMEOUT):
+        self.default_limit = default_limit
+        self.limits = dict(settings.OPENAI_CONCURRENCY_LIMITS if limits is None else limits)
+        self.queue_timeout = queue_timeout
+        self._semaphores: dict = {}
+        self._stats: dict = {}
+
+    def _entry(self, model: str):
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.limits.get(model, self.default_limit))
+            self._stats[model] = {"in_flight": 0, "queued": 0, "max_in_flight": 0, "completed": 0,
+                                  "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0}
+        return self._semaphores[model], self._stats[model]
+
+    @asynccontextmanager
+    async def slot(self, model: str):
+        semaphore, stats = self._entry(model)
+        start = time.monotonic()
+        stats["queued"] += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            raise LLMQueueTimeout(f"Sin lugar para '{model}' después de {self.queue_timeout}s en cola")
+        finally:
+            stats["queued"] -= 1
+
+        waited = time.monotonic() - start
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            yield
+        finally:
+            stats["in_flight"] -= 1
+            stats["completed"] += 1
+            semaphore.release()
+
+    def stats(self) -> dict:
+        report = {}
+        for model, s in self._stats.items():
+            acquired = s["completed"] + s["in_flight"]
+            report[model] = {
+                "limit": self.limits.get(model, self.default_limit),
+                "in_flight": s["in_flight"],
+                "queued": s["queued"],
+                "max_in_flight": s["max_in_flight"],
+                "completed": s["completed"],
+                "timeouts": s["timeouts"],
+                "avg_wait_seconds": s["wait_total"] / acquired if acquired else 0.0,
+                "max_wait_seconds": s["wait_max"],
+            }
+        return report
 
 
 class OpenAIService:
-    def __init__(self, api_key: str=api_key):
-        """Inicializa el servicio con la API Key de OpenAI."""
-        self.client = AsyncOpenAI(api_key=api_key)
-    
-    def transcribe_audio(self, audio_bytes, language="es", model="whisper-1"):
+    def __init__(self, api_key: str=api_key, base_url: str=base_url, limiter: Optional[ModelLimiter] = None):
+        """Inicializa el servicio con la API Key de OpenAI y un pool de conexiones propio y acotado."""
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=settings.OPENAI_TIMEOUT,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            )),
+        )
+        self.limiter = limiter or ModelLimiter()
+
+    async def create_response(self, **kwargs):
+        """`client.responses.create` respetando el límite de concurrencia del modelo."""
+        async with self.limiter.slot(kwargs.get("model", "default")):
+            return await self.client.responses.create(**kwargs)
+
+    async def stream_response(self, **kwargs):
+        """
+        `client.responses.create(stream=True)` respetando el límite de concurrencia del modelo:
+        devuelve los eventos a medida que llegan. El lugar se libera al terminar el stream.
+        """
+        async with self.limiter.slot(kwargs.get("model", "default")):
+            stream = await self.client.responses.create(stream=True, **kwargs)
+            async with stream:
+                async for event in stream:
+                    yield event
+
+    async def transcribe_audio(self, audio_bytes, language="es", model=settings.TRANSCRIPTION_MODEL,
+                               filename="audio.mp3", response_format=settings.TRANSCRIPTION_RESPONSE_FORMAT):
         """
         Transcribe un audio utilizando el modelo Whisper de OpenAI.
 
@@ -18,25 +121,60 @@ class OpenAIService:
         - audio_bytes: bytes del archivo de audio a transcribir.
         - language: idioma de la transcripción (por defecto, español).
         - model: modelo de OpenAI a utilizar.
+        - filename: nombre con la extensión del contenedor (OpenAI la usa para decodificar).
+        - response_format: "text", "json" o "verbose_json".
 
         Retorna:
-        - La transcripción como JSON, o un mensaje de error.
+        - La transcripción en el formato pedido ("text" devuelve un str), o un mensaje de error.
         """
-        filename = "audio.mp3"
         buff = io.BytesIO(audio_bytes)
         buff.name = filename  # OpenAI requiere un nombre de archivo
 
         try:
-            response = self.client.audio.transcriptions.create(
-                file=buff,
-                model=model,
-                language=language,
-                temperature=0.2,
-                response_format="verbose_json",
-                timestamp_granularities=["word"],
-            )
+            async with self.limiter.slot(model):
+                response = await self.client.audio.transcriptions.create(
+                    file=buff,
+                    model=model,
+                    language=language,
+                    temperature=0.2,
+                    response_format=response_format,
+                )
             return response
 
         except Exception as e:
-            print(f"Error en la transcripción: {str(e)}")
-            raise e
\ No newline at end of file
+            logger.error(f"Error en la transcripción: {str(e)}")
+            raise e
+
+    async def warm_up(self):
+        """Abre la conexión (TLS incluido) con la API antes del primer turno. Un fallo no es fatal."""
+        start = time.monotonic()
+        try:
+            await self.client.models.list()
+            logger.info(f"🔥 Conexión con OpenAI precalentada en {time.monotonic() - start:.2f}s")
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo precalentar la conexión con OpenAI: {e}")
+
+    async def close(self):
+        await self.client.close()
+
+    def stats(self) -> dict:
+        return self.limiter.stats()
+
+
+_openai_service: Optional[OpenAIService] = None
+
+def get_openai_service() -> OpenAIService:
+    """
+    Cliente de OpenAI compartido por todo el proceso (un solo pool de conexiones y un solo
+    límite de concurrencia por modelo). Se precalienta en el lifespan y se cierra con `close_openai_service`.
+    """
+    global _openai_service
+    if _openai_service is None:
+        _openai_service = OpenAIService()
+    return _openai_service
+
+async def close_openai_service():
+    global _openai_service
+    if _openai_service is not None:
+        await _openai_service.close()
+        _openai_service = None
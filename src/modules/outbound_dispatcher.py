@@ -0,0 +1,347 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Optional
+import httpx
+from src.modules.http_conexion import get_http_client
+from src.modules.redis_conexion import get_async_redis_client
+from src.modules.redis_resilience import CircuitBreaker, RedisUnavailable, redis_breaker
+from src.modules.turn_deadline import turn_timeout, turn_expired
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def split_message(text: str, limit: int = settings.WHATSAPP_MAX_TEXT_LENGTH) -> list:
+    """
+    Divide un texto en partes de a lo sumo `limit` caracteres, cortando preferentemente entre
+    párrafos, luego entre líneas, oraciones o palabras, y como último recurso en seco.
+    """
+    text = text.strip()
+    if len(text) <= limit:
+        return [text] if text else []
+
+    parts = []
+    while len(text) > limit:
+        window = text[:limit + 1]
+        cut = -1
+        for separator in ("\n\n", "\n", ". ", " "):
+            index = window.rfind(separator)
+            if index > 0:
+                cut = index + (1 if separator == ". " else 0)
+                break
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+class TokenBucket:
+    """Limitador token bucket: `rate` envíos por segundo con ráfagas de hasta `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Espera hasta tener un token disponible y devuelve los segundos esperados."""
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+
+class SendError(Exception):
+    def __init__(self, message: str, retryable: bool, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class OutboundDispatcher:
+    """
+    Envío de mensajes de texto por la Graph API.
+
+    - Un token bucket por phone_number_id para no superar el throughput de Meta.
+    - Reintentos con backoff exponencial y jitter ante 429, 5xx y errores de red (respeta Retry-After).
+    - Las respuestas más largas que WHATSAPP_MAX_TEXT_LENGTH se dividen por párrafos y se envían en orden.
+    - Si los reintentos se agotan por un error transitorio, las partes que faltan se guardan en
+      una cola persistente en Redis y se reenvían en segundo plano hasta OUTBOUND_RETRY_MAX_AGE,
+      para no perder una respuesta ya generada.
+    - La cola es por destinatario (`outbound:queue:{phone_number_id}:{número}`, en orden) y
+      `outbound:retry` agenda a cada destinatario por fecha de próximo intento. Mientras un
+      destinatario tiene mensajes pendientes, los siguientes se encolan detrás en vez de
+      enviarse, así no llegan antes que la respuesta anterior.
+    """
+    RETRY_KEY = "outbound:retry"
+    QUEUE_PREFIX = "outbound:queue:"
+
+    def __init__(self, phone_number_id: str = settings.PHONE_NUMBER_ID,
+                 rate: float = settings.OUTBOUND_RATE_PER_SECOND,
+                 burst: int = settings.OUTBOUND_BURST,
+                 max_attempts: int = settings.OUTBOUND_MAX_ATTEMPTS,
+                 retry_backoff: float = settings.OUTBOUND_RETRY_BACKOFF,
+                 retry_interval: float = settings.OUTBOUND_RETRY_INTERVAL,
+                 retry_max_age: int = settings.OUTBOUND_RETRY_MAX_AGE,
+                 max_length: int = settings.WHATSAPP_MAX_TEXT_LENGTH,
+                 redis_client=None, breaker: CircuitBreaker = redis_breaker):
+        self.phone_number_id = phone_number_id
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_interval = retry_interval
+        self.retry_max_age = retry_max_age
+        self.max_length = max_length
+        self._buckets: dict = {}
+        self._task: Optional[asyncio.Task] = None
+        self._redis = redis_client
+        self.breaker = breaker
+
+        # Métricas
+        self.sent = 0
+        self.split_messages = 0
+        self.retried = 0
+        self.failed = 0
+        self.persisted = 0
+        self.recovered = 0
+        self.expired = 0
+        self.held = 0
+        self.retry_queue = 0  # destinatarios con mensajes pendientes, según la última lectura
+        self.throttled_seconds = 0.0
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    def _queue_key(self, recipient: str) -> str:
+        return f"{self.QUEUE_PREFIX}{recipient}"
+
+    def _bucket(self, phone_number_id: str) -> TokenBucket:
+        bucket = self._buckets.get(phone_number_id)
+        if bucket is None:
+            bucket = self._buckets[phone_number_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def _post(self, phone_number_id: str, to: str, body: str) -> dict:
+        url = f"{settings.GRAPH_API_BASE_URL}/{settings.WHATSAPP_API_VERSION}/{phone_number_id}/messages"
+        headers = {"Authorization": f"Bearer {settings.WHATSAPP_ACCESS_TOKEN}", "Content-Type": "application/json"}
+        payload = {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": body}}
+        self.throttled_seconds += await self._bucket(phone_number_id).acquire()
+        try:
+            timeout = turn_timeout(settings.GRAPH_SEND_TIMEOUT, floor=settings.TURN_SEND_MIN_SECONDS)
+            resp = await get_http_client().post(url, headers=headers, json=payload, timeout=timeout)
+        except httpx.HTTPError as e:
+            raise SendError(f"{type(e).__name__}: {e}", retryable=True)
+        if resp.is_error:
+            retry_after = resp.headers.get("Retry-After")
+            raise SendError(f"{resp.status_code}: {resp.text}", retryable=resp.status_code in RETRYABLE_STATUS,
+                            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+        try:
+            return resp.json()
+        except ValueError:
+            return {}
+
+    async def _deliver(self, phone_number_id: str, to: str, body: str) -> dict:
+        """
+        Envía una parte con reintentos inmediatos. Lanza SendError si no se pudo.
+        Si el plazo del turno ya venció no se reintenta acá: la parte pasa a la cola persistente.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await self._post(phone_number_id, to, body)
+            except SendError as e:
+                if not e.retryable or attempt == self.max_attempts or turn_expired():
+                    raise
+                delay = e.retry_after or self.retry_backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                self.retried += 1
+                logger.warning(f"⚠️ Envío a {to} falló ({e}), reintento {attempt}/{self.max_attempts - 1} en {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _deliver_parts(self, phone_number_id: str, to: str, parts: list) -> tuple:
+        """Envía las partes en orden. Devuelve (última respuesta, partes pendientes, error)."""
+        response = None
+        for index, part in enumerate(parts):
+            try:
+                response = await self._deliver(phone_number_id, to, part)
+                self.sent += 1
+            except SendError as e:
+                return response, parts[index:], e
+        return response, [], None
+
+    async def send_text(self, to: str, message: str, phone_number_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Envía un mensaje (dividido si hace falta) y devuelve la respuesta de la Graph API
+        para la última parte, o None si no se pudo enviar completo.
+        """
+        phone_number_id = phone_number_id or self.phone_number_id
+        parts = split_message(message, self.max_length)
+        if len(parts) > 1:
+            self.split_messages += 1
+            logger.info(f"✂️ Respuesta a {to} dividida en {len(parts)} partes")
+
+        recipient = f"{phone_number_id}:{to}"
+        if await self._has_pending(recipient):
+            if await self._persist(phone_number_id, to, parts, created_at=time.time(), attempts=0):
+                self.held += 1
+                logger.info(f"📥 {to} tiene mensajes pendientes: la respuesta se encola detrás de ellos")
+                return None
+
+        response, pending, error = await self._deliver_parts(phone_number_id, to, parts)
+        if error is None:
+            return response
+        if error.retryable and await self._persist(phone_number_id, to, pending, created_at=time.time(), attempts=0):
+            logger.warning(f"📥 No se pudo enviar a {to} ({error}); {len(pending)} partes quedan en la cola de reintentos")
+        else:
+            self.failed += 1
+            logger.error(f"❌ La Graph API rechazó el mensaje a {to}: {error}")
+        return None
+
+    async def _has_pending(self, recipient: str) -> bool:
+        try:
+            with self.breaker.guard():
+                return bool(await self.redis_client.exists(self._queue_key(recipient)))
+        except RedisUnavailable:
+            return False
+
+    async def _persist(self, phone_number_id: str, to: str, parts: list, created_at: float, attempts: int) -> bool:
+        """Agrega el mensaje al final de la cola del destinatario y lo agenda si no lo estaba."""
+        recipient = f"{phone_number_id}:{to}"
+        entry = {"id": uuid.uuid4().hex, "phone_number_id": phone_number_id, "to": to, "parts": parts,
+                 "created_at": created_at, "attempts": attempts}
+        next_attempt = time.time() + self.retry_interval * 2 ** min(attempts, 6)
+        try:
+            with self.breaker.guard():
+                async with self.redis_client.pipeline(transaction=True) as pipe:
+                    pipe.rpush(self._queue_key(recipient), json.dumps(entry))
+                    pipe.expire(self._queue_key(recipient), self.retry_max_age)
+                    pipe.zadd(self.RETRY_KEY, {recipient: next_attempt}, nx=True)
+                    pipe.zcard(self.RETRY_KEY)
+                    *_, self.retry_queue = await pipe.execute()
+        except RedisUnavailable as e:
+            logger.error(f"Error al guardar el mensaje a {to} en la cola de reintentos: {e}")
+            return False
+        self.persisted += 1
+        return True
+
+    async def retry_pending(self, limit: int = 50) -> int:
+        """Reenvía las colas de los destinatarios vencidos. Devuelve cuántas se procesaron."""
+        now = time.time()
+        try:
+            with self.breaker.guard():
+                due = await self.redis_client.zrangebyscore(self.RETRY_KEY, 0, now, start=0, num=limit)
+        except RedisUnavailable as e:
+            logger.warning(f"⚠️ No se pudo leer la cola de reintentos: {e}")
+            return 0
+
+        processed = 0
+        for recipient in due:
+            try:
+                with self.breaker.guard():
+                    # ZREM es atómico: si otro worker ya tomó al destinatario, se saltea
+                    if not await self.redis_client.zrem(self.RETRY_KEY, recipient):
+                        continue
+                processed += 1
+                await self._drain(recipient, now)
+            except RedisUnavailable as e:
+                logger.warning(f"⚠️ Cola de reintentos interrumpida en {recipient}: {e}")
+                break
+        return processed
+
+    async def _drain(self, recipient: str, now: float):
+        """
+        Envía en orden los mensajes pendientes de un destinatario hasta el primero que vuelve a
+        fallar, que queda a la cabeza de la cola con su próximo intento.
+        """
+        key = self._queue_key(recipient)
+        with self.breaker.guard():
+            entries = [json.loads(raw) for raw in await self.redis_client.lrange(key, 0, -1)]
+
+        done, retry = 0, None
+        for entry in entries:
+            if now - entry["created_at"] > self.retry_max_age:
+                self.expired += 1
+                logger.error(f"❌ Se descarta el mensaje a {entry['to']}: venció la ventana de reintentos")
+            else:
+                _, pending, error = await self._deliver_parts(entry["phone_number_id"], entry["to"], entry["parts"])
+                if error is None:
+                    self.recovered += 1
+                    logger.info(f"📤 Mensaje pendiente a {entry['to']} enviado en el intento {entry['attempts'] + 1}")
+                elif error.retryable:
+                    retry = dict(entry, parts=pending, attempts=entry["attempts"] + 1)
+                    break
+                else:
+                    self.failed += 1
+                    logger.error(f"❌ No se pudo enviar el mensaje pendiente a {entry['to']}: {error}")
+            done += 1
+
+        with self.breaker.guard():
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.ltrim(key, done, -1)
+                if retry is not None:
+                    pipe.lset(key, 0, json.dumps(retry))
+                pipe.llen(key)
+                remaining = (await pipe.execute())[-1]
+            if remaining:
+                # Lo encolado mientras tanto sale en la próxima vuelta, sin esperar backoff
+                next_attempt = time.time()
+                if retry is not None:
+                    next_attempt += self.retry_interval * 2 ** min(retry["attempts"], 6)
+                await self.redis_client.zadd(self.RETRY_KEY, {recipient: next_attempt})
+            self.retry_queue = await self.redis_client.zcard(self.RETRY_KEY)
+
+    async def _retry_loop(self):
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            try:
+                await self.retry_pending()
+            except Exception as e:
+                logger.error(f"Error en la cola de reintentos de envío: {e}", exc_info=True)
+
+    def start(self):
+        """Lanza la revisión periódica de la cola persistente. Debe llamarse dentro del event loop (lifespan)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._retry_loop(), name="outbound-retry")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "split_messages": self.split_messages,
+            "retried": self.retried,
+            "failed": self.failed,
+            "persisted": self.persisted,
+            "recovered": self.recovered,
+            "expired": self.expired,
+            "held": self.held,
+            "retry_queue": self.retry_queue,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+        }
+
+outbound_dispatcher = OutboundDispatcher()
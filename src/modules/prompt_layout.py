@@ -0,0 +1,83 @@
+"""
+Armado del prompt de un hilo nuevo pensado para el caché de prompts del proveedor.
+
+El caché sólo reutiliza el prefijo idéntico byte a byte de una llamada anterior, así que el
+input se ordena de lo más estable a lo más variable:
+
+    1. system: instrucciones del agente (tools/system_message.txt)
+    2. developer: catálogo de productos como tabla compacta y determinística
+    3. developer: datos del cliente o número no registrado
+    4. user: el mensaje (y los ids de archivos adjuntos)
+
+Los puntos 1 y 2 son iguales para todos los clientes mientras no cambie el catálogo. Cada
+parte estática lleva una versión (hash del contenido) para poder detectar cambios.
+"""
+import hashlib
+import math
+from typing import Optional
+
+
+def content_version(text: str) -> str:
+    """Versión corta y estable de un contenido (primeros 12 hex del sha256)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+
+
+def _cell(value) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).replace("|", "/").replace("\n", " ").strip()
+
+
+def encode_catalog(products: list) -> tuple:
+    """
+    Serializa la lista de productos (registros de la hoja `products`) como una tabla separada
+    por `|`: una línea de encabezado y una fila por producto, ordenadas por id.
+    Devuelve (tabla, versión). El mismo catálogo produce siempre los mismos bytes.
+    """
+    if not products:
+        return "", content_version("")
+    columns = list(products[0].keys())
+    for product in products[1:]:
+        columns += [key for key in product if key not in columns]
+    rows = sorted(("|".join(_cell(product.get(column)) for column in columns) for product in products),
+                  key=lambda row: (row.split("|", 1)[0], row))
+    table = "\n".join(["|".join(columns), *rows])
+    return table, content_version(table)
+
+
+def catalog_message(products) -> Optional[dict]:
+    """Mensaje developer con el catálogo versionado (acepta la lista de productos o un texto ya armado)."""
+    if products is None:
+        return None
+    if isinstance(products, str):
+        table, version = products, content_version(products)
+    else:
+        table, version = encode_catalog(products)
+    return {"role": "developer",
+            "content": f"Catálogo de productos disponibles (versión {version}, columnas separadas por |):\n{table}"}
+
+
+def build_new_thread_input(system_message: str, products, user_message: str,
+                           user_information: Optional[str] = None, client_phone: Optional[str] = None,
+                           files_id: Optional[list] = None, history: Optional[list] = None) -> list:
+    """
+    Input del primer turno de un hilo: prefijo estático primero y lo propio del cliente al final.
+    `history` son mensajes user/assistant previos al hilo (p. ej. respuestas servidas desde la caché).
+    """
+    input_messages = [{"role": "system", "content": system_message}]
+    catalog = catalog_message(products)
+    if catalog is not None:
+        input_messages.append(catalog)
+
+    if user_information is not None:
+        input_messages.append({"role": "developer", "content": f"La información del usuario es: {user_information}"})
+    else:
+        input_messages.append({"role": "developer",
+                               "content": f"El cliente se ha contactado con un numero no registrado: {client_phone}"})
+    input_messages.extend(history or [])
+    input_messages.append({"role": "user", "content": user_message})
+    if files_id:
+        input_messages.append({"role": "developer", "content": f"Id de los archivos adjuntos: {str(files_id)}"})
+    return input_messages
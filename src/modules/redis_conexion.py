@@ -1,17 +1,43 @@
-from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.backoff import ExponentialBackoff
+from redis.asyncio.retry import Retry as AsyncRetry
 from typing import Optional
 from src.utils.settings import settings
 
-_redis_client: Optional[Redis] = None
+_async_redis_client: Optional[AsyncRedis] = None
 
-def get_redis_client() -> Redis:
-    global _redis_client
-    if _redis_client is None:
-        _redis_client = Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            decode_responses=True,
-            username=settings.REDIS_USERNAME,
-            password=settings.REDIS_PASSWORD
-        )
-    return _redis_client
\ No newline at end of file
+def _connection_options() -> dict:
+    """
+    Timeouts, health check y reintentos del cliente. Sin timeouts un Redis que no responde deja
+    colgado el turno; los reintentos son pocos y cortos porque después decide el circuit breaker
+    (`redis_resilience`). El cliente reconecta solo en el siguiente comando.
+    """
+    return dict(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        decode_responses=True,
+        username=settings.REDIS_USERNAME,
+        password=settings.REDIS_PASSWORD,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_SECONDS,
+        retry=AsyncRetry(ExponentialBackoff(cap=0.5, base=0.05), settings.REDIS_RETRIES),
+    )
+
+def get_async_redis_client() -> AsyncRedis:
+    """
+    Cliente asyncio compartido, con un pool de hasta REDIS_MAX_CONNECTIONS conexiones. Todo el
+    acceso a Redis pasa por acá (y por `redis_breaker`): nada bloquea el event loop.
+    Las conexiones quedan atadas al event loop donde se abren: se usa desde la app y se
+    cierra con `close_async_redis_client` en el lifespan.
+    """
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = AsyncRedis(**_connection_options(), max_connections=settings.REDIS_MAX_CONNECTIONS)
+    return _async_redis_client
+
+async def close_async_redis_client():
+    global _async_redis_client
+    if _async_redis_client is not None:
+        await _async_redis_client.aclose()
+        _async_redis_client = None
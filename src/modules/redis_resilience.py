@@ -0,0 +1,204 @@
+"""
+Acceso a Redis tolerante a caídas.
+
+`redis_breaker` es un circuit breaker compartido por todos los usos de Redis: después de
+`failures` errores de conexión o timeouts seguidos deja de intentar durante `reset_seconds`
+(las llamadas fallan al instante con `RedisUnavailable`), después deja pasar una sola llamada de
+prueba y, si anda, vuelve a cerrarse.
+
+Mientras está abierto, sesiones y file mappings siguen en un `FallbackStore`: memoria local
+acotada y con TTL, con la última copia conocida de cada clave y lo escrito durante la caída
+(marcado como pendiente). Cuando Redis vuelve, lo pendiente se reconcilia antes de la siguiente
+operación sobre esas claves.
+"""
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+REDIS_ERRORS = (RedisConnectionError, RedisTimeoutError, OSError)
+
+
+class RedisUnavailable(Exception):
+    """Redis no responde (o el circuito está abierto)."""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failures: int = settings.REDIS_BREAKER_FAILURES,
+                 reset_seconds: float = settings.REDIS_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+        # Métricas
+        self.trips = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self._consecutive = 0
+        self._probing = False
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            logger.info("✅ Redis volvió a responder, circuito cerrado")
+
+    def record_failure(self, error: Exception):
+        self.errors += 1
+        self._consecutive += 1
+        self._probing = False
+        self.last_error = str(error)
+        if self.state == self.HALF_OPEN or self._consecutive >= self.failures:
+            if self.state != self.OPEN:
+                self.trips += 1
+                logger.warning(f"🔌 Redis no responde ({error}), circuito abierto por {self.reset_seconds}s")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    @contextmanager
+    def guard(self):
+        """
+        Envuelve una operación contra Redis: falla con `RedisUnavailable` si el circuito está
+        abierto o si la operación no pudo conectarse; cualquier otra respuesta cuenta como éxito.
+        """
+        if not self.allow():
+            raise RedisUnavailable("circuito abierto")
+        try:
+            yield
+        except REDIS_ERRORS as e:
+            self.record_failure(e)
+            raise RedisUnavailable(str(e)) from e
+        except Exception:
+            self.record_success()
+            raise
+        except BaseException:
+            self._probing = False  # cancelada: no dice nada de Redis
+            raise
+        else:
+            self.record_success()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+
+class FallbackStore:
+    """
+    Memoria de respaldo de un tipo de clave: LRU acotado con TTL. Guarda la última copia conocida
+    (`put`) y lo escrito sin Redis (`put(..., dirty=True)`), que `dirty_items` devuelve para
+    reconciliar. Si se llena, se pierden primero las claves menos usadas, pendientes incluidas.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int = settings.REDIS_FALLBACK_MAX_ENTRIES):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()  # key -> (valor, vence)
+        self._dirty: set = set()
+
+        # Métricas
+        self.degraded_reads = 0
+        self.degraded_writes = 0
+        self.reconciled = 0
+        self.conflicts = 0
+        self.dropped = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, value, ttl_seconds: Optional[float] = None, dirty: bool = False):
+        if value is None:
+            self._remove(key)
+            return
+        self._entries[key] = (value, time.monotonic() + (ttl_seconds or self.ttl_seconds))
+        self._entries.move_to_end(key)
+        if dirty:
+            self._dirty.add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self.dropped += int(oldest in self._dirty)
+            self._remove(oldest)
+
+    @property
+    def has_dirty(self) -> bool:
+        return bool(self._dirty)
+
+    def dirty_items(self) -> list:
+        """(key, valor, segundos de vida restantes) de lo escrito durante la caída."""
+        now = time.monotonic()
+        items = []
+        for key in list(self._dirty):
+            value, expires = self._entries[key]
+            if expires > now:
+                items.append((key, value, expires - now))
+            else:
+                self._remove(key)
+        return items
+
+    def mark_clean(self, key: str, conflict: bool = False):
+        self._dirty.discard(key)
+        if conflict:
+            self.conflicts += 1
+        else:
+            self.reconciled += 1
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        self._dirty.discard(key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "pending": len(self._dirty),
+            "degraded_reads": self.degraded_reads,
+            "degraded_writes": self.degraded_writes,
+            "reconciled": self.reconciled,
+            "conflicts": self.conflicts,
+            "dropped": self.dropped,
+        }
+
+redis_breaker = CircuitBreaker()
+session_fallback = FallbackStore("sessions", settings.SESSION_TTL_SECONDS)
+file_link_fallback = FallbackStore("file_links", 2 * 3600)  # lo que dura un mapping FILE_xxxx
+
+
+def resilience_stats() -> dict:
+    return {
+        "breaker": redis_breaker.stats(),
+        "fallback": {store.name: store.stats() for store in (session_fallback, file_link_fallback)},
+    }
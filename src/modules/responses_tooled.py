@@ -1,16 +1,24 @@
-import json, os, asyncio
-from src.modules.openai_client import OpenAIService
+import json, os, asyncio, time
+from typing import Optional
+from src.modules.openai_client import get_openai_service
+from src.modules.prompt_layout import build_new_thread_input, content_version
+from src.modules.usage_ledger import usage_ledger, current_turn
+from src.modules.model_router import model_router, MalformedToolCall
+from src.modules.tool_output import tool_output_encoder, dumps
+from src.modules.turn_deadline import current_deadline, turn_timeout, record_stage, TurnDeadlineExceeded, MIN_TIMEOUT
 from src.modules.gmail_connection import send_notification
 from src.utils.config import config
 from fastapi import APIRouter, HTTPException, Depends
 from src.utils.config import config
+from src.utils.settings import settings
 from src.schemas.schemas import NotificacionSchema
 from tools.query_handler import (
     handle_get_client, 
     handle_link_phone_to_client,
     handle_create_purchase,
     handle_get_client_orders,
-    handle_contact_company)
+    handle_contact_company,
+    ORDERS_OUTPUT)
 import logging
 
 
@@ -27,6 +35,7 @@ instructions_path_path = os.path.normpath(instructions_path)
 # Leemos el contenido del archivo y lo guardamos en la variable
 with open(instructions_path, 'r', encoding='utf-8') as file:
     system_message = file.read()
+SYSTEM_MESSAGE_VERSION = content_version(system_message)
 
 
 tools_path = os.path.join(current_dir, '..', '..', 'tools', 'tool_definition.json')
@@ -35,6 +44,7 @@ tools_path = os.path.normpath(tools_path)
 # Leemos el contenido del archivo y lo guardamos en la variable
 with open(tools_path, 'r', encoding='utf-8') as file:
     TOOLS = json.load(file)
+REQUIRED_ARGUMENTS = {tool["name"]: tool["parameters"].get("required", []) for tool in TOOLS}
 
 
 
@@ -48,6 +58,11 @@ TOOL_HANDLERS = {
     "get_client": handle_get_client,
 }
 
+# Cómo se codifica la salida de cada herramienta (las que no están van como JSON compacto)
+TOOL_OUTPUTS = {
+    "get_client_orders": ORDERS_OUTPUT,
+}
+
 
 async def required_query(tool_call: dict, client_phone: str):
 
@@ -71,16 +86,304 @@ async def required_query(tool_call: dict, client_phone: str):
 
     logging.info(f"Resultados de la herramienta {function_name}: {query_results}")    
     
-    # Formato de respuesta (sin cambios)
     results ={
         "type": "function_call_output",
         "call_id": tool_call_id,
-        "output": str(query_results)
+        "output": tool_output_encoder.encode(function_name, query_results, arguments,
+                                             TOOL_OUTPUTS.get(function_name))
     }
     
     return results
 
 
+def tool_call_problem(tool_call) -> Optional[str]:
+    """Motivo por el que una llamada a herramienta es inválida, o None si se puede ejecutar."""
+    if tool_call.name not in TOOL_HANDLERS:
+        return f"herramienta desconocida '{tool_call.name}'"
+    try:
+        arguments = json.loads(tool_call.arguments or "{}")
+    except json.JSONDecodeError:
+        return f"argumentos de {tool_call.name} no son JSON válido"
+    if not isinstance(arguments, dict):
+        return f"argumentos de {tool_call.name} no son un objeto"
+    missing = [name for name in REQUIRED_ARGUMENTS.get(tool_call.name, []) if name not in arguments]
+    if missing:
+        return f"faltan argumentos de {tool_call.name}: {', '.join(missing)}"
+    return None
+
+
+class ToolMetrics:
+    """Latencia por herramienta, para ver qué handlers de tools/query_handler.py dominan el turno."""
+
+    def __init__(self):
+        self._stats = {}
+
+    def record(self, name: str, seconds: float, error: bool = False, timeout: bool = False):
+        s = self._stats.setdefault(name, {"calls": 0, "errors": 0, "timeouts": 0, "total": 0.0, "max": 0.0})
+        s["calls"] += 1
+        s["errors"] += int(error)
+        s["timeouts"] += int(timeout)
+        s["total"] += seconds
+        s["max"] = max(s["max"], seconds)
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "calls": s["calls"],
+                "errors": s["errors"],
+                "timeouts": s["timeouts"],
+                "total_seconds": round(s["total"], 3),
+                "avg_seconds": round(s["total"] / s["calls"], 3),
+                "max_seconds": round(s["max"], 3),
+            }
+            for name, s in sorted(self._stats.items(), key=lambda kv: kv[1]["total"], reverse=True)
+        }
+
+tool_metrics = ToolMetrics()
+
+
+class PromptCacheMetrics:
+    """Tokens de entrada servidos desde el caché de prompts del proveedor (usage.input_tokens_details.cached_tokens)."""
+
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, usage) -> int:
+        details = getattr(usage, "input_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        self.calls += 1
+        self.input_tokens += usage.input_tokens
+        self.cached_tokens += cached
+        return cached
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_ratio": self.cached_tokens / self.input_tokens if self.input_tokens else 0.0,
+            "system_message_version": SYSTEM_MESSAGE_VERSION,
+        }
+
+prompt_cache_metrics = PromptCacheMetrics()
+
+
+async def _timed_tool_call(tool_call, client_phone: str) -> dict:
+    """
+    Ejecuta una llamada con su propio timeout (acotado por el plazo del turno); un error o
+    timeout se devuelve como salida de esa llamada.
+    """
+    timeout = turn_timeout(settings.TOOL_CALL_TIMEOUTS.get(tool_call.name, settings.TOOL_CALL_TIMEOUT))
+    ledger = current_turn.get()
+    if ledger is not None:
+        # Desde acá el turno ya no se reintenta: la herramienta puede haber escrito o enviado algo
+        ledger.record_side_effect(f"tool:{tool_call.name}")
+    start = time.monotonic()
+    error = timed_out = False
+    try:
+        output = await asyncio.wait_for(required_query(tool_call, client_phone), timeout=timeout)
+        error = output["output"].startswith('{"error"')
+    except asyncio.TimeoutError:
+        timed_out = True
+        logging.error(f"La herramienta {tool_call.name} no respondió en {timeout}s")
+        output = {"type": "function_call_output", "call_id": tool_call.call_id,
+                  "output": dumps({"error": f"La herramienta no respondió a tiempo ({timeout:.1f}s)."})}
+    except Exception as e:
+        error = True
+        logging.error(f"Error al ejecutar la herramienta {tool_call.name}: {e}")
+        output = {"type": "function_call_output", "call_id": tool_call.call_id,
+                  "output": dumps({"error": f"No se pudo ejecutar la herramienta. Detalle: {e}"})}
+    elapsed = time.monotonic() - start
+    tool_metrics.record(tool_call.name, elapsed, error=error, timeout=timed_out)
+    record_stage(f"tool:{tool_call.name}", elapsed)
+    if ledger is not None:
+        ledger.record_tool(tool_call.name, elapsed, error=error, timeout=timed_out)
+    logging.info(f"Herramienta {tool_call.name} ({tool_call.call_id}) terminó en {elapsed:.2f}s")
+    return output
+
+
+async def run_tool_calls(tool_calls: list, client_phone: str) -> list:
+    """
+    Ejecuta en paralelo las llamadas a herramientas de un mismo paso del modelo.
+    Las salidas se devuelven en el mismo orden (call_id) en que el modelo emitió las llamadas,
+    y una herramienta que falla o vence no cancela a las demás.
+    """
+    return list(await asyncio.gather(*(_timed_tool_call(call, client_phone) for call in tool_calls)))
+
+
+async def _blocking_step(openai, client_phone: str, **request) -> tuple:
+    start = time.monotonic()
+    response = await openai.create_response(**request)
+    model_seconds = time.monotonic() - start
+    tool_calls = [item for item in response.output if item.type == "function_call"]
+    if model_router.can_escalate(request["model"]):
+        for call in tool_calls:
+            problem = tool_call_problem(call)
+            if problem:
+                raise MalformedToolCall(problem, response, model_seconds)
+    tools_output = []
+    if tool_calls:
+        logging.info(f"Ejecutando {len(tool_calls)} herramientas: {[call.name for call in tool_calls]}")
+        tools_output = await run_tool_calls(tool_calls, client_phone)
+    return response, tools_output, response.output_text, model_seconds
+
+
+async def _streaming_step(openai, client_phone: str, **request) -> tuple:
+    """
+    Consume los eventos de la Responses API a medida que llegan. Cada function_call se lanza
+    apenas sus argumentos están completos, mientras el modelo sigue emitiendo el resto, y el
+    texto final se arma con los deltas.
+
+    Si el modelo se puede escalar, una llamada inválida hace repetir todo el paso con el modelo
+    grande: por eso las llamadas no se lanzan antes de tiempo sino al final del stream, una vez
+    validadas todas, y ante una inválida no se ejecuta ninguna (MalformedToolCall).
+    """
+    validate = model_router.can_escalate(request["model"])
+    malformed = None
+    pending_calls = {}   # item_id -> function_call en curso
+    ready = []           # llamadas completas que esperan al fin del stream (si se valida)
+    tasks = []
+    text_parts = []
+    response = None
+    start = time.monotonic()
+
+    def dispatch(tool_call):
+        nonlocal malformed
+        if validate:
+            malformed = malformed or tool_call_problem(tool_call)
+            ready.append(tool_call)
+        else:
+            logging.info(f"Lanzando {tool_call.name} ({tool_call.call_id}) antes del fin del stream")
+            tasks.append(asyncio.create_task(_timed_tool_call(tool_call, client_phone)))
+
+    try:
+        async for event in openai.stream_response(**request):
+            if event.type == "response.output_item.added" and event.item.type == "function_call":
+                pending_calls[event.item.id] = event.item
+            elif event.type == "response.function_call_arguments.done" and event.item_id in pending_calls:
+                tool_call = pending_calls.pop(event.item_id)
+                tool_call.arguments = event.arguments
+                dispatch(tool_call)
+            elif event.type == "response.output_item.done" and event.item.id in pending_calls:
+                # Sin evento arguments.done: se lanza con el item completo
+                pending_calls.pop(event.item.id)
+                dispatch(event.item)
+            elif event.type == "response.output_text.delta":
+                text_parts.append(event.delta)
+            elif event.type in ("response.completed", "response.incomplete"):
+                response = event.response
+                model_seconds = time.monotonic() - start
+            elif event.type == "response.failed":
+                raise RuntimeError(f"La respuesta del modelo falló: {event.response.error}")
+        if response is None:
+            raise RuntimeError("El stream de la Responses API terminó sin response.completed")
+        if malformed:
+            raise MalformedToolCall(malformed, response, model_seconds)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    if ready:
+        logging.info(f"Ejecutando {len(ready)} herramientas validadas: {[call.name for call in ready]}")
+        tasks.extend(asyncio.create_task(_timed_tool_call(call, client_phone)) for call in ready)
+    # Las tareas se crearon en el orden en que el modelo emitió las llamadas
+    tools_output = list(await asyncio.gather(*tasks))
+    return response, tools_output, "".join(text_parts) or response.output_text, model_seconds
+
+
+async def model_step(openai, client_phone: str, **request) -> tuple:
+    """
+    Una llamada al modelo más la ejecución de las herramientas que pida.
+    Devuelve (response, salidas de herramientas para el próximo paso, texto de la respuesta).
+    Antes de llamar al modelo verifica el presupuesto diario del número (TokenBudgetExceeded).
+    """
+    ledger = current_turn.get()
+    if ledger is not None:
+        await usage_ledger.ensure_budget(ledger)
+    step = _streaming_step if settings.OPENAI_STREAMING else _blocking_step
+    try:
+        response, tools_output, text, model_seconds = await step(openai, client_phone, **request)
+    except MalformedToolCall as e:
+        # La llamada descartada también consumió tokens
+        _record_round(ledger, request["model"], e.response, e.model_seconds)
+        raise
+    _record_round(ledger, request["model"], response, model_seconds)
+    return response, tools_output, text
+
+
+def _record_round(ledger, model: str, response, model_seconds: float):
+    record_stage("llm", model_seconds)
+    if response.usage is not None:
+        cached = prompt_cache_metrics.record(response.usage)
+        logging.info(f"Tokens de entrada: {response.usage.input_tokens} (en caché: {cached})")
+        if ledger is not None:
+            ledger.system_version = SYSTEM_MESSAGE_VERSION
+            ledger.record_round(model, response.usage, model_seconds)
+
+
+async def bounded_step(openai, client_phone: str, **request) -> tuple:
+    """
+    model_step con lo que queda del plazo del turno menos TURN_ANSWER_RESERVE_SECONDS, que se
+    guardan para la respuesta final. Lanza TurnDeadlineExceeded si no alcanza.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return await model_step(openai, client_phone, **request)
+    budget = deadline.remaining() - settings.TURN_ANSWER_RESERVE_SECONDS
+    if budget <= 0:
+        raise TurnDeadlineExceeded(f"Quedan {deadline.remaining():.1f}s, no alcanza para otro paso con herramientas")
+    try:
+        return await asyncio.wait_for(model_step(openai, client_phone, **request), timeout=budget)
+    except asyncio.TimeoutError:
+        record_stage("cancelled_step", budget)
+        raise TurnDeadlineExceeded(f"El paso del modelo no terminó en {budget:.1f}s")
+
+
+WRAP_UP_MESSAGE = ("Se agotó el tiempo disponible para este turno. No llames más herramientas: respondé al "
+                   "cliente ahora con la información que ya tenés y, si falta algo, decile que un asesor "
+                   "lo va a completar.")
+
+
+async def wrap_up_step(openai, client_phone: str, step_input: list, previous_response_id: str, **request) -> tuple:
+    """
+    Última llamada sin herramientas, con el mismo input que el paso que no llegó a terminar,
+    para que el modelo responda con lo que tiene. Usa todo lo que queda del plazo.
+    """
+    deadline = current_deadline.get()
+    timeout = deadline.remaining() if deadline is not None else None
+    if timeout is not None and timeout < MIN_TIMEOUT:
+        raise TurnDeadlineExceeded("No queda tiempo ni para pedir una respuesta parcial")
+    request = dict(request, tool_choice="none")
+    wrap_up_input = list(step_input) + [{"role": "developer", "content": WRAP_UP_MESSAGE}]
+    try:
+        response, _, text = await asyncio.wait_for(
+            model_step(openai, client_phone, input=wrap_up_input, previous_response_id=previous_response_id,
+                       **request),
+            timeout=timeout)
+    except asyncio.TimeoutError:
+        record_stage("cancelled_wrap_up", timeout)
+        raise TurnDeadlineExceeded(f"La respuesta parcial no llegó en {timeout:.1f}s")
+    return response, text
+
+
+async def routed_step(openai, client_phone: str, route, **request) -> tuple:
+    """
+    bounded_step con el modelo de `route`. Si el modelo chico emite una llamada inválida, el
+    paso se repite con el grande (mismo input) y `route` queda escalada para el resto del turno.
+    """
+    try:
+        return await bounded_step(openai, client_phone, model=route.model, **request)
+    except MalformedToolCall as e:
+        await model_router.escalate(route, client_phone, str(e))
+        ledger = current_turn.get()
+        if ledger is not None:
+            ledger.route = route.as_dict()
+        return await bounded_step(openai, client_phone, model=route.model, **request)
+
+
 #################################################################################################
 
 
@@ -89,24 +392,16 @@ async def responses_tooled(user_message: str,  thread_id:str=None,
                            system_message: str = system_message, 
                            user_information: str = None,
                            client_phone:str = None,
-                           files_id: list = None):
-    openai = OpenAIService()
+                           files_id: list = None,
+                           history: list = None):
+    openai = get_openai_service()
     print(f"Starting to process message: {user_message}, with files_id: {files_id}")
     if thread_id is None:
-        if user_information is not None:
-            input_messages = [{"role":"system", "content": system_message}, 
-                            {"role" : "developer", "content": f"Los productos disponibles son: {products}"},
-                            {"role": "developer", "content": f"La información del usuario es: {user_information}"},
-                            {"role": "user", "content": user_message}]
-        else:
-            input_messages = [{"role":"system", "content": system_message}, 
-                            {"role" : "developer", "content": f"Los productos disponibles son: {products}"},
-                            {"role": "developer", "content": f"El cliente se ha contactado con un numero no registrado: {client_phone}"},
-                            {"role": "user", "content": user_message}]
+        input_messages = build_new_thread_input(system_message, products, user_message,
+                                                user_information=user_information, client_phone=client_phone,
+                                                files_id=files_id, history=history)
         if files_id:
             print(f"Files ID provided: {files_id}")
-            input_messages.append({"role":"developer", "content":f"Id de los archivos adjuntos: {str(files_id)}"})
-            
 
     elif files_id:
         print(f"Files ID provided: {files_id}")
@@ -116,44 +411,39 @@ async def responses_tooled(user_message: str,  thread_id:str=None,
 
     else:
         input_messages = [{"role":"user", "content":user_message}]
-        
-    response = await openai.client.responses.create(
-                model="gpt-4o",
-                input=input_messages,
-                temperature=0.1,
-                tools=TOOLS,
-                tool_choice="auto",
-                previous_response_id=thread_id,
-                )
-         
-    print(f"Response: {response.output_text}")
-    tool_call_needed = True
-    while tool_call_needed:
-        tools_output = []
-        tool_call_needed = False
-        for tool_call in response.output:
-            print(f"Processing tool call: {tool_call}")
-            if tool_call.type != "function_call":
-                continue
-            tool_call_needed = True
-            output = await required_query(tool_call, client_phone)
-            if isinstance(output, dict):
-                tools_output.append(output)
-            else:
-                raise HTTPException(status_code=500, detail="Error executing tool call")
-
-        if tool_call_needed:
-            response = await openai.client.responses.create(
-                model="gpt-4o",
-                input=tools_output,
-                temperature=0.1,
-                tools=TOOLS,
-                tool_choice="auto",
-                previous_response_id=response.id,
-            )
-
-    response_message = response.output_text
-    print(f"Total tokens used: {response.usage.total_tokens}")
-    print(response.usage)
+
+    route = await model_router.choose(user_message, files_id=files_id, phone=client_phone)
+    ledger = current_turn.get()
+    if ledger is not None:
+        ledger.route = route.as_dict()
+    logging.info(f"Modelo para el turno de {client_phone}: {route.model} ({route.reason})")
+
+    request = dict(temperature=0.1, tools=TOOLS, tool_choice="auto")
+    if settings.OPENAI_PROMPT_CACHE_KEY:
+        request["prompt_cache_key"] = settings.OPENAI_PROMPT_CACHE_KEY
+    step_input, previous_id = input_messages, thread_id
+    model_calls = 1
+    try:
+        response, tools_output, response_message = await routed_step(
+            openai, client_phone, route, input=step_input, previous_response_id=previous_id, **request)
+        while tools_output:
+            step_input, previous_id = tools_output, response.id
+            if model_calls >= settings.TURN_MAX_MODEL_CALLS:
+                raise TurnDeadlineExceeded(f"Se alcanzó el máximo de {model_calls} llamadas al modelo")
+            model_calls += 1
+            step_route = model_router.choose_step(route, tools_output)
+            if step_route is not route:
+                logging.info(f"Modelo para el paso {model_calls} de {client_phone}: {step_route.model} "
+                             f"({step_route.reason})")
+                route = step_route
+            response, tools_output, response_message = await routed_step(
+                openai, client_phone, route, input=step_input, previous_response_id=previous_id, **request)
+    except TurnDeadlineExceeded as e:
+        logging.warning(f"Turno de {client_phone} sin tiempo para más herramientas ({e}); se pide una respuesta parcial")
+        if ledger is not None:
+            ledger.outcome = "deadline_wrap_up"
+        response, response_message = await wrap_up_step(openai, client_phone, step_input, previous_id,
+                                                         model=route.model, **request)
+
     print(f"Final response message: {response_message}")
     return response_message, response.id
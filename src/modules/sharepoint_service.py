@@ -1,16 +1,31 @@
 import asyncio
 import json
 import os, uuid
+import functools
+import threading
 from office365.sharepoint.client_context import ClientContext
 from office365.runtime.auth.client_credential import ClientCredential
+from office365.runtime.auth.token_response import TokenResponse
+from src.modules.turn_deadline import turn_timeout
 from src.utils.settings import settings
 from src.utils.logger import get_logger
 import io, base64
+from typing import IO
 import pandas as pd
 from urllib.parse import urlparse, unquote
 
 logger = get_logger(__name__)
 
+
+def _with_ctx_lock(method):
+    """Runs the method holding the service's ClientContext lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._ctx_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class SharePointService:
     """
     A service for interacting with SharePoint, configured for multiple clients.
@@ -26,6 +41,11 @@ class SharePointService:
     def __init__(self, client_name: str):
         if not hasattr(self, '_db_lock'):
             self._db_lock = asyncio.Lock()
+            # The ClientContext keeps a single pending-query queue, so calls made from different
+            # worker threads must not interleave. Every ctx-locked method blocks on the network:
+            # callers on the event loop run them with asyncio.to_thread.
+            self._ctx_lock = threading.RLock()
+            self._inflight_reads = {}
         if hasattr(self, '_initialized') and self._initialized:
             return
             
@@ -35,7 +55,7 @@ class SharePointService:
         self._initialized = True
 
     def _load_config(self):
-        config_path = os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'sharepoint_config.json')
+        config_path = settings.SHAREPOINT_CONFIG_PATH or os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'sharepoint_config.json')
         with open(config_path, 'r') as f:
             full_config = json.load(f)
             if self.client_name not in full_config:
@@ -43,16 +63,23 @@ class SharePointService:
             self.config = full_config[self.client_name]
 
     def _authenticate(self):
+        site_url = self.config.get("site_url")
+        if not site_url:
+            raise ValueError(f"'site_url' not configured for client '{self.client_name}'")
+
+        if settings.SHAREPOINT_ACCESS_TOKEN:
+            # Token estático (p. ej. el entorno de pruebas de carga): no se contacta a Azure AD.
+            token = TokenResponse(access_token=settings.SHAREPOINT_ACCESS_TOKEN, token_type="Bearer", expiresIn=3600)
+            self.ctx = ClientContext(site_url).with_access_token(lambda: token)
+            logger.info(f"Using static access token for SharePoint client '{self.client_name}'.")
+            return
+
         cert_creds = {
             "tenant": settings.AZURE_TENANT_ID,
             "client_id": settings.AZURE_CLIENT_ID,
             "thumbprint": settings.THUMBPRINT,
             "private_key": base64.b64decode(settings.CERT_KEY_BASE64).decode('utf-8'),
         }
-        
-        site_url = self.config.get("site_url")
-        if not site_url:
-            raise ValueError(f"'site_url' not configured for client '{self.client_name}'")
 
         try:
             self.ctx = ClientContext(site_url).with_client_certificate(**cert_creds)
@@ -90,6 +117,7 @@ class SharePointService:
             # If creation fails, return None.
             return None
 
+    @_with_ctx_lock
     def read_file(self, folder_key: str, file_name: str) -> io.BytesIO:
         folder_path = self.config["libraries"]["documents"]["folders"].get(folder_key)
         if not folder_path:
@@ -107,6 +135,35 @@ class SharePointService:
             logger.error(f"Failed to read file '{file_name}' from '{folder_path}': {e}")
             raise
 
+    def _resolve_upload_folder(self, folder_key: str, file_name: str):
+        """Returns the configured folder for `folder_key`, or the fallback folder if it can't be ensured."""
+        folder_path = self.config["libraries"]["documents"]["folders"].get(folder_key)
+        target_folder = self._ensure_folder_exists(folder_path)
+
+        if not target_folder:
+            fallback_folder_name = self.config.get("fallback_folder", "Error_Handling")
+            logger.warning(f"Folder '{folder_path}' missing. Saving '{file_name}' in fallback folder '{fallback_folder_name}'")
+            fallback_folder_path = f"Shared Documents/{fallback_folder_name}"
+            target_folder = self._ensure_folder_exists(fallback_folder_path)
+            if not target_folder:
+                logger.error(f"Failed to find or create even the fallback folder. Aborting upload.")
+                raise IOError("Could not ensure SharePoint folder existence.")
+        return target_folder
+
+    def _full_url(self, target_file) -> str:
+        # The ServerRelativeUrl property gives a path like:
+        # /sites/Desarrollo/Documentos compartidos/BOT Whatsapp/Staging/file.jpg
+        relative_url = target_file.properties['ServerRelativeUrl']
+
+        # The site_url from config is https://tenant.sharepoint.com/sites/Desarrollo
+        # We need to get just the base part: https://tenant.sharepoint.com
+        parsed_site_url = urlparse(self.config.get("site_url", ""))
+        base_url = f"{parsed_site_url.scheme}://{parsed_site_url.netloc}"
+
+        # By combining the base URL and the server-relative URL, we get the correct full path.
+        return f"{base_url}{relative_url}"
+
+    @_with_ctx_lock
     def upload_file(self, folder_key: str, file_name: str, file_content: bytes) -> str:
         """
         Uploads a file to a specified folder in SharePoint.
@@ -119,33 +176,12 @@ class SharePointService:
         Returns:
             The full URL of the uploaded file.
         """
-        folder_path = self.config["libraries"]["documents"]["folders"].get(folder_key)
-        target_folder = self._ensure_folder_exists(folder_path)
-
-        if not target_folder:
-            fallback_folder_name = self.config.get("fallback_folder", "Error_Handling")
-            logger.warning(f"Folder '{folder_path}' missing. Saving '{file_name}' in fallback folder '{fallback_folder_name}'")
-            fallback_folder_path = f"Shared Documents/{fallback_folder_name}"
-            target_folder = self._ensure_folder_exists(fallback_folder_path)
-            if not target_folder:
-                logger.error(f"Failed to find or create even the fallback folder. Aborting upload.")
-                raise IOError("Could not ensure SharePoint folder existence.")
+        target_folder = self._resolve_upload_folder(folder_key, file_name)
 
         try:
             target_file = target_folder.upload_file(file_name, file_content)
             self.ctx.execute_query()
-            
-            # The ServerRelativeUrl property gives a path like:
-            # /sites/Desarrollo/Documentos compartidos/BOT Whatsapp/Staging/file.jpg
-            relative_url = target_file.properties['ServerRelativeUrl']
-
-            # The site_url from config is https://tenant.sharepoint.com/sites/Desarrollo
-            # We need to get just the base part: https://tenant.sharepoint.com
-            parsed_site_url = urlparse(self.config.get("site_url", ""))
-            base_url = f"{parsed_site_url.scheme}://{parsed_site_url.netloc}"
-
-            # By combining the base URL and the server-relative URL, we get the correct full path.
-            full_url = f"{base_url}{relative_url}"
+            full_url = self._full_url(target_file)
 
             logger.info(f"Successfully uploaded '{file_name}'.")
             logger.info(f"The final URL to be stored is: {full_url}")
@@ -154,6 +190,96 @@ class SharePointService:
             logger.error(f"Failed to upload file '{file_name}': {e}")
             raise
 
+    @_with_ctx_lock
+    def upload_stream(self, folder_key: str, file_name: str, stream: IO[bytes], file_size: int,
+                      chunk_size: int = settings.SHAREPOINT_UPLOAD_CHUNK_SIZE,
+                      chunk_retries: int = settings.SHAREPOINT_UPLOAD_CHUNK_RETRIES) -> str:
+        """
+        Uploads a file from a seekable stream using a chunked upload session, so that at most
+        `chunk_size` bytes are held in memory. Small files fall back to a single `upload_file` call.
+
+        A failed chunk is retried up to `chunk_retries` times, resuming from the offset the
+        server reports for the session instead of restarting the whole upload.
+
+        Args:
+            folder_key: The key for the folder path in the config.
+            file_name: The name of the file to upload.
+            stream: A seekable binary stream positioned anywhere (it is rewound).
+            file_size: Total size of the stream in bytes.
+
+        Returns:
+            The full URL of the uploaded file.
+        """
+        stream.seek(0)
+        if file_size <= chunk_size:
+            return self.upload_file(folder_key, file_name, stream.read())
+
+        target_folder = self._resolve_upload_folder(folder_key, file_name)
+        upload_id = str(uuid.uuid4())
+        target_file = None
+        try:
+            target_file = target_folder.files.add(file_name, None, True)
+            self.ctx.execute_query()
+
+            offset = 0
+            while offset < file_size:
+                stream.seek(offset)
+                chunk = stream.read(chunk_size)
+                is_last = offset + len(chunk) >= file_size
+                for attempt in range(1, chunk_retries + 1):
+                    try:
+                        if is_last:
+                            target_file.finish_upload(upload_id, offset, chunk)
+                            self.ctx.execute_query()
+                            offset = file_size
+                        else:
+                            if offset == 0:
+                                result = target_file.start_upload(upload_id, chunk)
+                            else:
+                                result = target_file.continue_upload(upload_id, offset, chunk)
+                            self.ctx.execute_query()
+                            offset = int(result.value or offset + len(chunk))
+                        break
+                    except Exception as e:
+                        if attempt == chunk_retries:
+                            raise
+                        logger.warning(f"Chunk at offset {offset} of '{file_name}' failed (attempt {attempt}): {e}")
+                        self.ctx.clear()
+                        resumed = self._upload_session_offset(target_file, upload_id)
+                        if resumed is not None and resumed != offset:
+                            logger.info(f"Resuming '{file_name}' upload from server offset {resumed}.")
+                            offset = resumed
+                            break
+                logger.debug(f"Uploaded {offset}/{file_size} bytes of '{file_name}'.")
+
+            self.ctx.load(target_file, ["ServerRelativeUrl"])
+            self.ctx.execute_query()
+            full_url = self._full_url(target_file)
+            logger.info(f"Successfully uploaded '{file_name}' ({file_size} bytes) in chunks of {chunk_size}.")
+            return full_url
+        except Exception as e:
+            logger.error(f"Failed to upload file '{file_name}' in chunks: {e}")
+            if target_file is not None:
+                try:
+                    target_file.cancel_upload(upload_id)
+                    self.ctx.execute_query()
+                except Exception:
+                    self.ctx.clear()
+            raise
+
+    def _upload_session_offset(self, target_file, upload_id: str):
+        """Asks SharePoint how many bytes of the upload session it already has (None if unknown)."""
+        try:
+            status = target_file.get_upload_status(upload_id)
+            self.ctx.execute_query()
+            expected = status.expected_content_range
+            return int(expected.split("-")[0]) if expected else None
+        except Exception as e:
+            self.ctx.clear()
+            logger.warning(f"Could not read upload session status: {e}")
+            return None
+
+    @_with_ctx_lock
     def move_file(self, source_file_url: str, dest_folder_key: str, file_name: str) -> str:
         """
         Moves a file from a source URL to a destination folder.
@@ -196,6 +322,21 @@ class SharePointService:
             # depending on how the caller should handle it.
             return None
 
+    async def _read_file_shared(self, folder_key: str, file_name: str) -> bytes:
+        """
+        Downloads a file in a worker thread. Concurrent reads of the same file (e.g. two tool
+        calls in the same model step) share a single download.
+        """
+        key = (folder_key, file_name)
+        download = self._inflight_reads.get(key)
+        if download is None:
+            download = asyncio.ensure_future(
+                asyncio.to_thread(lambda: self.read_file(folder_key=folder_key, file_name=file_name).getvalue()))
+            self._inflight_reads[key] = download
+            download.add_done_callback(lambda _: self._inflight_reads.pop(key, None))
+        # shield: a caller that times out must not cancel the download other callers are waiting on
+        return await asyncio.shield(download)
+
     async def read_worksheet_as_df(self, folder_key: str, file_name: str, worksheet_name: str) -> pd.DataFrame:
         """
         Reads a specific worksheet from an Excel file in SharePoint and returns it as a pandas DataFrame.
@@ -210,8 +351,9 @@ class SharePointService:
         """
         logger.info(f"Reading worksheet '{worksheet_name}' from '{file_name}'...")
         try:
-            file_content_stream = self.read_file(folder_key=folder_key, file_name=file_name)
-            df = pd.read_excel(file_content_stream, sheet_name=worksheet_name, engine='openpyxl')
+            # Inside a turn, wait at most for what is left of its deadline (the shared download keeps going)
+            content = await asyncio.wait_for(self._read_file_shared(folder_key, file_name), timeout=turn_timeout())
+            df = await asyncio.to_thread(pd.read_excel, io.BytesIO(content), sheet_name=worksheet_name, engine='openpyxl')
             logger.info(f"Successfully read worksheet '{worksheet_name}'.")
             return df
         except Exception as e:
@@ -237,35 +379,43 @@ class SharePointService:
 
         async with self._db_lock:
             logger.info(f"Acquired lock to write to '{file_name}'. Adding row to '{worksheet_name}'.")
+            # Download, rewrite and upload run in a worker thread: they hold the ClientContext lock
+            write = asyncio.ensure_future(
+                asyncio.to_thread(self._append_row, folder_key, file_name, worksheet_name, row_data))
             try:
-                # 1. Read the entire Excel file
-                file_content_stream = self.read_file(folder_key=folder_key, file_name=file_name)
-                all_sheets = pd.read_excel(file_content_stream, engine='openpyxl', sheet_name=None)
-
-                if worksheet_name not in all_sheets:
-                    raise ValueError(f"Worksheet '{worksheet_name}' not found in '{file_name}'.")
-
-                # 2. Modify the target worksheet
-                target_df = all_sheets[worksheet_name]
-                new_row_df = pd.DataFrame([row_data])
-                updated_df = pd.concat([target_df, new_row_df], ignore_index=True)
-                all_sheets[worksheet_name] = updated_df
-
-                # 3. Write all sheets back to an in-memory file
-                output_stream = io.BytesIO()
-                with pd.ExcelWriter(output_stream, engine='openpyxl') as writer:
-                    for sheet_name, sheet_df in all_sheets.items():
-                        sheet_df.to_excel(writer, index=False, sheet_name=sheet_name)
-                
-                updated_file_content = output_stream.getvalue()
-
-                # 4. Upload the modified file, overwriting the old one
-                self.upload_file(folder_key, file_name, updated_file_content)
-                
+                await asyncio.shield(write)
                 logger.info(f"Successfully added row and uploaded updated '{file_name}'.")
                 return row_data
+            except asyncio.CancelledError:
+                # The thread keeps writing: the lock is not released until it is done
+                await asyncio.wait([write])
+                raise
             except Exception as e:
                 logger.error(f"An error occurred during the locked write operation: {e}")
                 raise
             finally:
-                logger.info(f"Released lock for '{file_name}'.")
\ No newline at end of file
+                logger.info(f"Released lock for '{file_name}'.")
+
+    def _append_row(self, folder_key: str, file_name: str, worksheet_name: str, row_data: dict):
+        """Blocking read-modify-write of the workbook behind `add_row_to_worksheet`."""
+        # 1. Read the entire Excel file
+        file_content_stream = self.read_file(folder_key=folder_key, file_name=file_name)
+        all_sheets = pd.read_excel(file_content_stream, engine='openpyxl', sheet_name=None)
+
+        if worksheet_name not in all_sheets:
+            raise ValueError(f"Worksheet '{worksheet_name}' not found in '{file_name}'.")
+
+        # 2. Modify the target worksheet
+        target_df = all_sheets[worksheet_name]
+        new_row_df = pd.DataFrame([row_data])
+        updated_df = pd.concat([target_df, new_row_df], ignore_index=True)
+        all_sheets[worksheet_name] = updated_df
+
+        # 3. Write all sheets back to an in-memory file
+        output_stream = io.BytesIO()
+        with pd.ExcelWriter(output_stream, engine='openpyxl') as writer:
+            for sheet_name, sheet_df in all_sheets.items():
+                sheet_df.to_excel(writer, index=False, sheet_name=sheet_name)
+
+        # 4. Upload the modified file, overwriting the old one
+        self.upload_file(folder_key, file_name, output_stream.getvalue())
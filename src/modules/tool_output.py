@@ -0,0 +1,146 @@
+"""
+Codificación de las salidas de herramientas que se le devuelven al modelo.
+
+En lugar de `str(resultado)` (repr de Python con todos los campos de todas las filas) se manda
+JSON compacto: sin espacios, sin valores vacíos y, si la herramienta declara un `OutputSpec`,
+sólo con los campos relevantes. Las listas largas se paginan (los más recientes primero, con un
+resumen en la primera página) y toda salida respeta un techo de tokens; si hay que cortar, la
+salida dice cómo pedir la página siguiente (`next_offset`).
+"""
+import json
+import math
+from typing import Callable, Optional
+from src.utils.settings import settings
+
+CHARS_PER_TOKEN = 4  # estimación gruesa, alcanza para acotar
+
+
+class OutputSpec:
+    """
+    Lo que una herramienta declara sobre su salida:
+
+    - `fields`: campos a conservar por clave, p. ej. {"orders": ["id", "fecha"], "details": [...]}
+      se aplica a los objetos que cuelgan de esa clave (en cualquier nivel);
+    - `list_key`: lista a paginar; `sort_by` la ordena de mayor a menor (más recientes primero);
+    - `summary`: función que resume la lista completa, se agrega en la primera página.
+    """
+
+    def __init__(self, fields: Optional[dict] = None, list_key: Optional[str] = None,
+                 sort_by: Optional[str] = None, page_size: Optional[int] = None,
+                 summary: Optional[Callable[[list], dict]] = None):
+        self.fields = fields or {}
+        self.list_key = list_key
+        self.sort_by = sort_by
+        self.page_size = page_size
+        self.summary = summary
+
+
+def _empty(value) -> bool:
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+
+def compact(value, fields: Optional[dict] = None, key: Optional[str] = None):
+    """Copia de `value` sin valores vacíos, con los campos de `fields` y tipos de numpy/pandas convertidos."""
+    fields = fields or {}
+    if isinstance(value, dict):
+        keep = fields.get(key)
+        return {k: compact(v, fields, k) for k, v in value.items()
+                if (keep is None or k in keep) and not _empty(v)}
+    if isinstance(value, (list, tuple)):
+        return [compact(v, fields, key) for v in value]
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        value = value.item()  # escalares de numpy
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class ToolOutputEncoder:
+    """Convierte el resultado de un handler en el texto que recibe el modelo, con métricas por herramienta."""
+
+    def __init__(self, max_tokens: int = settings.TOOL_OUTPUT_MAX_TOKENS,
+                 max_tokens_per_tool: Optional[dict] = None,
+                 page_size: int = settings.TOOL_OUTPUT_PAGE_SIZE):
+        self.max_tokens = max_tokens
+        self.max_tokens_per_tool = dict(settings.TOOL_OUTPUT_MAX_TOKENS_PER_TOOL
+                                        if max_tokens_per_tool is None else max_tokens_per_tool)
+        self.page_size = page_size
+        self._stats = {}
+
+    def limit_for(self, name: str) -> int:
+        return self.max_tokens_per_tool.get(name, self.max_tokens) * CHARS_PER_TOKEN
+
+    def encode(self, name: str, results, arguments: Optional[dict] = None, spec: Optional[OutputSpec] = None) -> str:
+        limit = self.limit_for(name)
+        paged = isinstance(results, dict) and spec is not None and spec.list_key \
+            and isinstance(results.get(spec.list_key), list)
+        if paged:
+            text, cut = self._page(name, results, arguments or {}, spec, limit)
+        else:
+            text = dumps(compact(results, spec.fields if spec else None))
+            cut = False
+        if len(text) > limit:
+            text = dumps({"partial": text[:limit],
+                          "truncated": f"La salida de {name} se cortó en {limit} de {len(text)} caracteres."})
+            cut = True
+        self._record(name, len(str(results)), len(text), cut, paged)
+        return text
+
+    def _page(self, name: str, results: dict, arguments: dict, spec: OutputSpec, limit: int) -> tuple:
+        """Página de la lista desde `offset` (resumen incluido si es la primera), achicada hasta entrar en `limit`."""
+        items = results[spec.list_key]
+        if spec.sort_by:
+            items = sorted(items, key=lambda item: str(item.get(spec.sort_by, "")), reverse=True)
+        offset = max(int(arguments.get("offset") or 0), 0)
+        size = spec.page_size or self.page_size
+        page = [compact(item, spec.fields, spec.list_key) for item in items[offset:offset + size]]
+        rest = {k: v for k, v in results.items() if k != spec.list_key}
+        base = compact(rest, spec.fields)
+        base["total"] = len(items)
+        base["offset"] = offset
+        if offset == 0 and spec.summary is not None:
+            base["summary"] = compact(spec.summary(items))
+
+        cut = False
+        while True:
+            payload = dict(base, **{spec.list_key: page})
+            shown = offset + len(page)
+            if shown < len(items):
+                payload["next_offset"] = shown
+                payload["truncated"] = (f"Se muestran {len(page)} de {len(items)} {spec.list_key} "
+                                        f"(desde {offset}). Para ver más llamá a {name} con offset={shown}.")
+            text = dumps(payload)
+            if len(text) <= limit or len(page) <= 1:
+                return text, cut
+            page = page[:-1]
+            cut = True
+
+    def _record(self, name: str, raw_chars: int, chars: int, truncated: bool, paged: bool):
+        s = self._stats.setdefault(name, {"outputs": 0, "truncated": 0, "paged": 0, "raw_chars": 0, "chars": 0,
+                                          "max_chars": 0})
+        s["outputs"] += 1
+        s["truncated"] += int(truncated)
+        s["paged"] += int(bool(paged))
+        s["raw_chars"] += raw_chars
+        s["chars"] += chars
+        s["max_chars"] = max(s["max_chars"], chars)
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "outputs": s["outputs"],
+                "truncated": s["truncated"],
+                "paged": s["paged"],
+                "avg_tokens": round(s["chars"] / s["outputs"] / CHARS_PER_TOKEN, 1),
+                "max_tokens": s["max_chars"] // CHARS_PER_TOKEN,
+                # Contra el repr de Python que se mandaba antes
+                "tokens_saved": (s["raw_chars"] - s["chars"]) // CHARS_PER_TOKEN,
+            }
+            for name, s in sorted(self._stats.items())
+        }
+
+tool_output_encoder = ToolOutputEncoder()
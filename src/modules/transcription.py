@@ -0,0 +1,207 @@
+import asyncio
+import functools
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from src.modules import audio_processing
+from src.modules.openai_client import get_openai_service
+from src.modules.redis_conexion import get_async_redis_client
+from src.modules.redis_resilience import CircuitBreaker, redis_breaker
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Transcript:
+    """Texto de una nota de voz, su duración (si se conoce) y cómo se obtuvo."""
+    __slots__ = ("text", "duration", "segments", "cached")
+
+    def __init__(self, text: str, duration: Optional[float] = None, segments: int = 1, cached: bool = False):
+        self.text = text
+        self.duration = duration
+        self.segments = segments
+        self.cached = cached
+
+
+class Transcriber:
+    """
+    Transcripción de notas de voz.
+
+    - Antes de transcribir, cada nota pasa por `audio_processing.prepare` en un pool de threads
+      propio (AUDIO_PREPROCESS_WORKERS): contenedor real, mono 16 kHz, sin silencios en los
+      extremos y en OGG/Opus si eso la achica.
+    - Las notas de más de 1.5x `segment_seconds` se cortan en los silencios, los segmentos se
+      transcriben en paralelo (respetando el límite de concurrencia del modelo) y el texto se
+      une en orden.
+    - Las transcripciones se guardan en Redis por sha256 del audio: una nota reenviada o
+      reentregada no se vuelve a transcribir. Si Redis no responde (`redis_breaker`) se
+      transcribe igual, sin caché.
+    - `response_format` define qué se le pide a la API ("text" es lo más liviano).
+    """
+    PREFIX = "transcript:"
+
+    def __init__(self, model: str = settings.TRANSCRIPTION_MODEL,
+                 response_format: str = settings.TRANSCRIPTION_RESPONSE_FORMAT,
+                 segment_seconds: float = settings.TRANSCRIPTION_SEGMENT_SECONDS,
+                 min_silence: float = settings.TRANSCRIPTION_MIN_SILENCE,
+                 silence_db: float = settings.TRANSCRIPTION_SILENCE_DB,
+                 cache_ttl_seconds: int = settings.TRANSCRIPTION_CACHE_TTL_SECONDS,
+                 trim_padding: float = settings.TRANSCRIPTION_TRIM_PADDING,
+                 bit_rate: int = settings.TRANSCRIPTION_OPUS_BITRATE,
+                 workers: int = settings.AUDIO_PREPROCESS_WORKERS,
+                 redis_client=None, breaker: CircuitBreaker = redis_breaker):
+        self.model = model
+        self.response_format = response_format
+        self.segment_seconds = segment_seconds
+        self.min_silence = min_silence
+        self.silence_db = silence_db
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.trim_padding = trim_padding
+        self.bit_rate = bit_rate
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._redis = redis_client
+        self.breaker = breaker
+
+        # Métricas
+        self.transcribed = 0
+        self.cache_hits = 0
+        self.split_notes = 0
+        self.segments = 0
+        self.audio_seconds = 0.0
+        self.preprocessed = 0
+        self.transcoded = 0
+        self.preprocess_errors = 0
+        self.preprocess_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.trimmed_seconds = 0.0
+        self.containers: dict = {}
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    def _key(self, digest: str, language: str) -> str:
+        return f"{self.PREFIX}{self.model}:{language}:{digest}"
+
+    async def _lookup(self, key: str) -> Optional[Transcript]:
+        if self.cache_ttl_seconds <= 0:
+            return None
+        try:
+            with self.breaker.guard():
+                raw = await self.redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo consultar la caché de transcripciones: {e}")
+            return None
+        if not raw:
+            return None
+        entry = json.loads(raw)
+        return Transcript(entry["text"], entry.get("duration"), entry.get("segments", 1), cached=True)
+
+    async def _store(self, key: str, transcript: Transcript):
+        if self.cache_ttl_seconds <= 0:
+            return
+        entry = {"text": transcript.text, "duration": transcript.duration, "segments": transcript.segments}
+        try:
+            with self.breaker.guard():
+                await self.redis_client.set(key, json.dumps(entry, ensure_ascii=False), ex=self.cache_ttl_seconds)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar la transcripción en la caché: {e}")
+
+    async def _prepare(self, audio_bytes: bytes) -> audio_processing.PreparedAudio:
+        """`audio_processing.prepare` en el pool de preprocesamiento; si falla, la nota va entera."""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="audio")
+        job = functools.partial(audio_processing.prepare, audio_bytes, self.segment_seconds, self.min_silence,
+                                self.silence_db, trim_padding=self.trim_padding, bit_rate=self.bit_rate)
+        try:
+            prepared = await asyncio.get_running_loop().run_in_executor(self._pool, job)
+        except Exception as e:
+            self.preprocess_errors += 1
+            logger.warning(f"⚠️ No se pudo procesar el audio, se transcribe tal como llegó: {e}")
+            container = audio_processing.detect_container(audio_bytes)
+            filename = f"audio.{container if container in audio_processing.ACCEPTED_CONTAINERS else 'ogg'}"
+            return audio_processing.PreparedAudio([(audio_bytes, filename)], container, None, None,
+                                                  len(audio_bytes), False, 0.0)
+
+        self.preprocessed += 1
+        self.transcoded += int(prepared.transcoded)
+        self.preprocess_seconds += prepared.seconds
+        self.bytes_in += prepared.original_bytes
+        self.bytes_out += prepared.prepared_bytes
+        self.trimmed_seconds += prepared.trimmed_seconds
+        container = prepared.container or "unknown"
+        self.containers[container] = self.containers.get(container, 0) + 1
+        logger.info(f"🎛️ Audio {container} de {prepared.original_bytes} bytes -> {prepared.prepared_bytes} bytes "
+                    f"en {prepared.segments} partes ({prepared.trimmed_seconds:.1f}s de silencio recortado, "
+                    f"{prepared.seconds:.2f}s)")
+        return prepared
+
+    async def _transcribe_one(self, audio_bytes: bytes, language: str, filename: str) -> tuple:
+        response = await get_openai_service().transcribe_audio(
+            audio_bytes=audio_bytes, language=language, model=self.model, filename=filename,
+            response_format=self.response_format)
+        if isinstance(response, str):
+            return response.strip(), None
+        return response.text.strip(), getattr(response, "duration", None)
+
+    async def transcribe(self, audio_bytes: bytes, language: str = "es") -> Transcript:
+        key = self._key(hashlib.sha256(audio_bytes).hexdigest(), language)
+        cached = await self._lookup(key)
+        if cached is not None:
+            self.cache_hits += 1
+            logger.info(f"♻️ Transcripción reutilizada ({len(audio_bytes)} bytes)")
+            return cached
+
+        prepared = await self._prepare(audio_bytes)
+        if prepared.segments > 1:
+            self.split_notes += 1
+            logger.info(f"✂️ Nota de voz de {prepared.duration:.0f}s dividida en {prepared.segments} segmentos")
+        parts = await asyncio.gather(*(self._transcribe_one(data, language, filename)
+                                       for data, filename in prepared.parts))
+        text = " ".join(part for part, _ in parts if part)
+        duration = prepared.duration if prepared.duration is not None else parts[0][1]
+
+        transcript = Transcript(text, duration, segments=prepared.segments)
+        self.transcribed += 1
+        self.segments += transcript.segments
+        self.audio_seconds += duration or 0.0
+        await self._store(key, transcript)
+        return transcript
+
+    def stats(self) -> dict:
+        requests = self.transcribed + self.cache_hits
+        return {
+            "model": self.model,
+            "response_format": self.response_format,
+            "transcribed": self.transcribed,
+            "cache_hits": self.cache_hits,
+            "cache_hit_ratio": self.cache_hits / requests if requests else 0.0,
+            "split_notes": self.split_notes,
+            "segments": self.segments,
+            "audio_seconds": round(self.audio_seconds, 3),
+            "preprocessing": {
+                "workers": self.workers,
+                "notes": self.preprocessed,
+                "transcoded": self.transcoded,
+                "errors": self.preprocess_errors,
+                "seconds": round(self.preprocess_seconds, 3),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "trimmed_seconds": round(self.trimmed_seconds, 3),
+                "containers": self.containers,
+            },
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+transcriber = Transcriber()
@@ -0,0 +1,115 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Ningún stage recibe menos que esto aunque el plazo esté vencido (evita timeouts de 0)
+MIN_TIMEOUT = 0.5
+
+
+class TurnDeadlineExceeded(Exception):
+    """El turno se quedó sin tiempo (o sin llamadas al modelo) antes de tener una respuesta."""
+
+
+class TurnDeadline:
+    """
+    Plazo de un turno, contado desde que el mensaje entró por el webhook.
+
+    Cada etapa (descarga de media, transcripción, lecturas de SharePoint, llamadas al modelo,
+    herramientas, envíos por la Graph API) pide su timeout con `timeout()` y recibe lo que
+    quede del plazo. El tiempo de cada etapa se acumula para loguear el desglose si hay exceso.
+    """
+
+    def __init__(self, budget: float, started_at: Optional[float] = None):
+        self.budget = budget
+        self.started_at = started_at if started_at is not None else time.monotonic()
+        self.expires_at = self.started_at + budget
+        self.stages: dict = {}
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def timeout(self, default: Optional[float] = None, floor: float = MIN_TIMEOUT) -> float:
+        """Lo que queda del plazo, acotado por el timeout propio de la etapa (`default`)."""
+        remaining = self.remaining()
+        if default is not None:
+            remaining = min(default, remaining)
+        return max(remaining, floor)
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def breakdown(self) -> dict:
+        return {stage: round(seconds, 3) for stage, seconds in sorted(self.stages.items(), key=lambda kv: -kv[1])}
+
+
+# Plazo del turno en curso: lo fija process_turn y lo heredan las tareas que crea
+current_deadline: ContextVar[Optional[TurnDeadline]] = ContextVar("current_deadline", default=None)
+
+
+def turn_timeout(default: Optional[float] = None, floor: float = MIN_TIMEOUT) -> Optional[float]:
+    """Timeout para una etapa: el propio (`default`) fuera de un turno, o lo que quede del plazo."""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    return deadline.timeout(default, floor)
+
+
+def turn_expired() -> bool:
+    deadline = current_deadline.get()
+    return deadline is not None and deadline.expired
+
+
+def record_stage(stage: str, seconds: float):
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.add(stage, seconds)
+
+
+@contextmanager
+def turn_stage(name: str):
+    """Acumula el tiempo del bloque en la etapa `name` del turno en curso (si lo hay)."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record_stage(name, time.monotonic() - start)
+
+
+class DeadlineMetrics:
+    """Turnos que se quedaron sin tiempo y en qué etapas lo gastaron."""
+
+    def __init__(self):
+        self.turns = 0
+        self.wrap_ups = 0
+        self.fallbacks = 0
+        self.overruns = 0
+        self._stages: dict = {}
+
+    def record(self, deadline: TurnDeadline, outcome: str):
+        self.turns += 1
+        self.wrap_ups += int(outcome == "deadline_wrap_up")
+        self.fallbacks += int(outcome == "deadline_fallback")
+        if deadline.expired or outcome.startswith("deadline"):
+            self.overruns += 1
+            for stage, seconds in deadline.stages.items():
+                self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    def stats(self) -> dict:
+        return {
+            "turns": self.turns,
+            "overruns": self.overruns,
+            "wrap_ups": self.wrap_ups,
+            "fallbacks": self.fallbacks,
+            "overrun_stage_seconds": {stage: round(seconds, 3) for stage, seconds in
+                                      sorted(self._stages.items(), key=lambda kv: -kv[1])},
+        }
+
+deadline_metrics = DeadlineMetrics()
@@ -0,0 +1,229 @@
+import asyncio
+import heapq
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class TurnNotRetryable(Exception):
+    """El turno falló después de tener efectos (respuestas, herramientas): reintentarlo los repetiría."""
+
+
+class TurnQueue:
+    """
+    Planificador de turnos con una casilla (mailbox) por remitente.
+
+    El webhook sólo encola y responde. Los turnos de un mismo remitente se procesan
+    estrictamente en orden (nunca dos a la vez), mientras que remitentes distintos se
+    procesan en paralelo hasta `workers` turnos simultáneos.
+
+    Agrupamiento de ráfagas: con `debounce` > 0, los mensajes que llegan a la casilla de un
+    remitente con menos de `debounce` segundos entre sí se entregan juntos al handler como
+    un único turno (como máximo `max_batch` mensajes y `max_debounce_wait` segundos de espera).
+
+    Semántica at-least-once: un turno sólo sale de su casilla cuando el handler terminó
+    sin error; si falla se reintenta (manteniendo el orden) hasta `max_attempts` veces,
+    esperando `retry_backoff` por intento sin ocupar un worker.
+    Salvo que falle con `TurnNotRetryable`: el handler ya respondió o ejecutó herramientas y
+    repetirlo duplicaría respuestas, pedidos o correos, así que se descarta sin reintentar.
+    """
+
+    def __init__(self, handler: Callable[[list], Awaitable[Any]],
+                 maxsize: int = settings.TURN_QUEUE_MAXSIZE,
+                 workers: int = settings.TURN_WORKERS,
+                 drain_timeout: float = settings.TURN_DRAIN_TIMEOUT,
+                 max_attempts: int = settings.TURN_MAX_ATTEMPTS,
+                 retry_backoff: float = settings.TURN_RETRY_BACKOFF,
+                 debounce: float = settings.TURN_DEBOUNCE_SECONDS,
+                 max_debounce_wait: float = settings.TURN_DEBOUNCE_MAX_WAIT,
+                 max_batch: int = settings.TURN_MAX_BATCH):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.debounce = debounce
+        self.max_debounce_wait = max_debounce_wait
+        self.max_batch = max_batch
+        self._mailboxes: dict = {}
+        self._last_arrival: dict = {}
+        self._scheduled: set = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._drained: Optional[asyncio.Event] = None
+        self._pending = 0
+        self._in_flight = 0
+        self._tasks: list = []
+        self._accepting = False
+
+        # Métricas
+        self.enqueued = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.not_retried = 0
+        self.messages = 0
+        self.coalesced_turns = 0
+        self.coalesced_messages = 0
+        self._wait_total = 0.0
+        self._wait_count = 0
+        self._wait_max = 0.0
+
+    def start(self):
+        """Crea las estructuras y lanza los workers. Debe llamarse dentro del event loop (lifespan)."""
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._tasks = [asyncio.create_task(self._worker(n), name=f"turn-worker-{n}") for n in range(self.workers)]
+        self._accepting = True
+        logger.info(f"🚀 Cola de turnos iniciada: {self.workers} remitentes en paralelo (capacidad {self.maxsize})")
+
+    def enqueue(self, key: str, item: Any) -> bool:
+        """
+        Encola un turno en la casilla del remitente `key` sin bloquear.
+        Devuelve False si la cola está llena o detenida.
+        """
+        if not self._accepting:
+            self.rejected += 1
+            return False
+        if self._pending >= self.maxsize:
+            self.rejected += 1
+            logger.warning(f"⚠️ Cola de turnos llena ({self.maxsize}). Turno de {key} rechazado.")
+            return False
+
+        now = time.monotonic()
+        self._mailboxes.setdefault(key, deque()).append([now, item, 0])
+        self._last_arrival[key] = now
+        self._pending += 1
+        self._drained.clear()
+        self.enqueued += 1
+        if key not in self._scheduled:
+            # Cada remitente está a lo sumo una vez en la cola de listos: eso garantiza el orden.
+            self._scheduled.add(key)
+            self._schedule(key, self.debounce)
+        return True
+
+    def _schedule(self, key: str, delay: float):
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, key)
+        else:
+            self._ready.put_nowait(key)
+
+    def _debounce_remaining(self, key: str, mailbox: deque) -> float:
+        """Segundos que faltan para cerrar la ráfaga del remitente (0 si ya se puede procesar)."""
+        if self.debounce <= 0 or len(mailbox) >= self.max_batch or mailbox[0][2] > 0:
+            return 0.0
+        now = time.monotonic()
+        quiet_until = self._last_arrival[key] + self.debounce
+        deadline = mailbox[0][0] + self.max_debounce_wait
+        return max(0.0, min(quiet_until, deadline) - now)
+
+    async def _worker(self, n: int):
+        while True:
+            key = await self._ready.get()
+            mailbox = self._mailboxes[key]
+            remaining = self._debounce_remaining(key, mailbox)
+            if remaining > 0:
+                # Siguen llegando mensajes: se posterga sin ocupar el worker.
+                self._schedule(key, remaining)
+                continue
+
+            batch_size = self.max_batch if self.debounce > 0 else 1
+            batch = [mailbox[i] for i in range(min(len(mailbox), batch_size))]
+            now = time.monotonic()
+            for entry in batch:
+                if entry[2] == 0:
+                    wait = now - entry[0]
+                    self._wait_total += wait
+                    self._wait_count += 1
+                    self._wait_max = max(self._wait_max, wait)
+
+            self._in_flight += 1
+            backoff = 0.0
+            try:
+                await self.handler([entry[1] for entry in batch])
+                self.processed += 1
+                self.messages += len(batch)
+                if len(batch) > 1:
+                    self.coalesced_turns += 1
+                    self.coalesced_messages += len(batch) - 1
+                done = True
+            except TurnNotRetryable as e:
+                self.failed += 1
+                self.not_retried += 1
+                done = True
+                logger.error(f"❌ Turno de {key} falló después de responder o ejecutar herramientas, "
+                             f"no se reintenta: {e}", exc_info=True)
+            except Exception as e:
+                attempts = batch[0][2] + 1
+                for entry in batch:
+                    entry[2] = attempts
+                done = attempts >= self.max_attempts
+                if done:
+                    self.failed += 1
+                    logger.error(f"❌ Turno de {key} descartado tras {attempts} intentos: {e}", exc_info=True)
+                else:
+                    self.retried += 1
+                    logger.warning(f"🔁 Error procesando turno de {key} (intento {attempts}), se reintenta: {e}")
+                    backoff = self.retry_backoff * attempts
+            finally:
+                self._in_flight -= 1
+
+            if done:
+                for _ in batch:
+                    mailbox.popleft()
+                self._pending -= len(batch)
+            if mailbox:
+                # Se vuelve a encolar al final para no acaparar un worker con un solo remitente;
+                # un reintento espera su backoff fuera de la cola, sin ocupar el worker.
+                self._schedule(key, backoff)
+            else:
+                del self._mailboxes[key]
+                del self._last_arrival[key]
+                self._scheduled.discard(key)
+                if self._pending == 0:
+                    self._drained.set()
+
+    async def stop(self):
+        """Deja de aceptar turnos, espera a que se vacíen las casillas (hasta drain_timeout) y detiene los workers."""
+        self._accepting = False
+        if self._drained is not None:
+            try:
+                await asyncio.wait_for(self._drained.wait(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⏱️ Drenado incompleto: quedaron {self._pending} turnos de "
+                               f"{len(self._mailboxes)} remitentes sin procesar.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("🛑 Cola de turnos detenida.")
+
+    def stats(self, top: int = 10) -> dict:
+        deepest = heapq.nlargest(top, self._mailboxes.items(), key=lambda kv: len(kv[1]))
+        return {
+            "depth": self._pending,
+            "capacity": self.maxsize,
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "active_senders": len(self._mailboxes),
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "not_retried": self.not_retried,
+            "messages": self.messages,
+            "coalesced_turns": self.coalesced_turns,
+            "coalesced_messages": self.coalesced_messages,
+            "avg_wait_seconds": self._wait_total / self._wait_count if self._wait_count else 0.0,
+            "max_wait_seconds": self._wait_max,
+            "mailboxes": {key: len(mailbox) for key, mailbox in deepest},
+        }
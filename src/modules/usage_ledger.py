@@ -0,0 +1,310 @@
+import json
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+import pytz
+from src.modules.redis_conexion import get_async_redis_client
+from src.modules.redis_resilience import CircuitBreaker, RedisUnavailable, redis_breaker
+from src.utils.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class TokenBudgetExceeded(Exception):
+    """El número ya consumió su presupuesto diario de tokens."""
+
+
+class TurnLedger:
+    """
+    Consumo de un turno: cada llamada al modelo (tokens y latencia), cada herramienta con su
+    duración y la transcripción de audios. Se completa durante el turno y se guarda al final
+    con `UsageLedger.commit`.
+    """
+
+    def __init__(self, phone: str):
+        self.phone = phone
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self.rounds = []
+        self.tools = []
+        self.transcriptions = []
+        self.system_version: Optional[str] = None
+        self.route: Optional[dict] = None  # modelo elegido por model_router para el turno
+        self.compaction: Optional[dict] = None  # si el turno compactó el hilo: disparador y tokens antes/después
+        self.outcome = "ok"
+        self.latency_seconds: Optional[float] = None
+        self.side_effects = []  # lo que el turno ya hizo afuera (respuestas, herramientas): no se repite
+
+    def record_side_effect(self, kind: str):
+        self.side_effects.append(kind)
+
+    def record_round(self, model: str, usage, seconds: float):
+        details = getattr(usage, "input_tokens_details", None)
+        self.rounds.append({
+            "model": model,
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+            "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+            "seconds": round(seconds, 3),
+        })
+
+    def record_tool(self, name: str, seconds: float, error: bool = False, timeout: bool = False):
+        self.tools.append({"name": name, "seconds": round(seconds, 3), "error": error, "timeout": timeout})
+
+    def record_transcription(self, model: str, audio_seconds: float, seconds: float):
+        self.transcriptions.append({"model": model, "audio_seconds": round(audio_seconds or 0.0, 3),
+                                    "seconds": round(seconds, 3)})
+
+    @property
+    def tool_calls(self) -> int:
+        return len(self.tools)
+
+    @property
+    def input_tokens(self) -> int:
+        return sum(r["input_tokens"] for r in self.rounds)
+
+    @property
+    def cached_tokens(self) -> int:
+        return sum(r["cached_tokens"] for r in self.rounds)
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(r["output_tokens"] for r in self.rounds)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def cost(self, prices: dict) -> float:
+        """Costo estimado en USD según OPENAI_PRICES (modelos sin precio cuentan 0)."""
+        total = 0.0
+        for r in self.rounds:
+            price = prices.get(r["model"], {})
+            total += ((r["input_tokens"] - r["cached_tokens"]) * price.get("input", 0.0)
+                      + r["cached_tokens"] * price.get("cached_input", price.get("input", 0.0))
+                      + r["output_tokens"] * price.get("output", 0.0)) / 1_000_000
+        for t in self.transcriptions:
+            total += t["audio_seconds"] / 60 * prices.get(t["model"], {}).get("audio_minute", 0.0)
+        return total
+
+    def finish(self):
+        if self.latency_seconds is None:
+            self.latency_seconds = time.monotonic() - self._start
+
+    def entry(self, prices: dict) -> dict:
+        self.finish()
+        return {
+            "phone": self.phone,
+            "started_at": round(self.started_at, 3),
+            "outcome": self.outcome,
+            "model": self.rounds[-1]["model"] if self.rounds else None,
+            "route": self.route,
+            "compaction": self.compaction,
+            "system_version": self.system_version,
+            "model_calls": len(self.rounds),
+            "rounds": self.rounds,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "tools": self.tools,
+            "side_effects": len(self.side_effects),
+            "transcription_seconds": round(sum(t["audio_seconds"] for t in self.transcriptions), 3),
+            "latency_seconds": round(self.latency_seconds, 3),
+            "cost_usd": round(self.cost(prices), 6),
+        }
+
+
+# Turno en curso: lo fijan process_turn y las tareas que crea (create_task copia el contexto)
+current_turn: ContextVar[Optional[TurnLedger]] = ContextVar("current_turn", default=None)
+
+
+class UsageLedger:
+    """
+    Acumula el consumo de OpenAI por número y por día en Redis:
+
+    - `usage:{día}:{número}`: hash con turnos, llamadas al modelo, tokens, costo, latencia,
+      segundos de audio y llamadas/milisegundos por herramienta y por modelo.
+    - `usage:{día}`: sorted set número -> tokens del día, para ver quién más consume.
+    - `usage_turns:{número}`: últimos USAGE_RECENT_TURNS turnos completos (JSON).
+
+    También aplica el presupuesto diario de tokens (DAILY_TOKEN_BUDGET / DAILY_TOKEN_BUDGETS)
+    antes de cada llamada al modelo. Usa el cliente asyncio detrás de `redis_breaker`: si Redis
+    no responde el presupuesto no se aplica, el turno no queda registrado y las consultas
+    devuelven lo que haya (marcadas como `degraded`).
+    """
+    PREFIX = "usage:"
+    TURNS_PREFIX = "usage_turns:"
+
+    def __init__(self, timezone: str = settings.USAGE_TIMEZONE,
+                 retention_days: int = settings.USAGE_RETENTION_DAYS,
+                 recent_turns: int = settings.USAGE_RECENT_TURNS,
+                 budget: int = settings.DAILY_TOKEN_BUDGET,
+                 budgets: Optional[dict] = None, prices: Optional[dict] = None,
+                 redis_client=None, breaker: CircuitBreaker = redis_breaker):
+        self.timezone = pytz.timezone(timezone)
+        self.retention_seconds = retention_days * 86400
+        self.recent_turns = recent_turns
+        self.budget = budget
+        self.budgets = dict(settings.DAILY_TOKEN_BUDGETS if budgets is None else budgets)
+        self.prices = settings.OPENAI_PRICES if prices is None else prices
+        self._redis = redis_client
+        self.breaker = breaker
+
+        # Métricas
+        self.committed = 0
+        self.budget_blocks = 0
+        self.errors = 0
+
+    @property
+    def redis_client(self):
+        if self._redis is None:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    def day(self, timestamp: Optional[float] = None) -> str:
+        moment = datetime.fromtimestamp(timestamp if timestamp is not None else time.time(), self.timezone)
+        return moment.strftime("%Y-%m-%d")
+
+    def _key(self, phone: str, day: str) -> str:
+        return f"{self.PREFIX}{day}:{phone}"
+
+    async def commit(self, ledger: TurnLedger) -> dict:
+        """Registra el turno en los acumulados del día y en el historial del número; devuelve la entrada."""
+        entry = ledger.entry(self.prices)
+        logger.info(f"📒 Consumo del turno: {json.dumps(entry, ensure_ascii=False)}")
+        day = self.day(ledger.started_at)
+        key = self._key(ledger.phone, day)
+        tokens = entry["input_tokens"] + entry["output_tokens"]
+        try:
+            with self.breaker.guard():
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.hincrby(key, "turns", 1)
+                    pipe.hincrby(key, "model_calls", entry["model_calls"])
+                    pipe.hincrby(key, "input_tokens", entry["input_tokens"])
+                    pipe.hincrby(key, "cached_tokens", entry["cached_tokens"])
+                    pipe.hincrby(key, "output_tokens", entry["output_tokens"])
+                    pipe.hincrby(key, "total_tokens", tokens)
+                    pipe.hincrby(key, "tool_calls", len(entry["tools"]))
+                    pipe.hincrby(key, "latency_ms", int(entry["latency_seconds"] * 1000))
+                    pipe.hincrby(key, "transcription_ms", int(entry["transcription_seconds"] * 1000))
+                    pipe.hincrbyfloat(key, "cost_usd", entry["cost_usd"])
+                    pipe.hincrby(key, f"outcome:{entry['outcome']}", 1)
+                    for r in entry["rounds"]:
+                        pipe.hincrby(key, f"model:{r['model']}:calls", 1)
+                    if entry["route"]:
+                        pipe.hincrby(key, f"route:{entry['route']['tier']}", 1)
+                        pipe.hincrby(key, "route:escalated", int(entry["route"]["escalated"]))
+                    if entry["compaction"]:
+                        pipe.hincrby(key, "compactions", 1)
+                        pipe.hincrby(key, "compaction_tokens_saved",
+                                     entry["compaction"]["tokens_before"] - entry["compaction"]["tokens_after"])
+                    for t in entry["tools"]:
+                        pipe.hincrby(key, f"tool:{t['name']}:calls", 1)
+                        pipe.hincrby(key, f"tool:{t['name']}:ms", int(t["seconds"] * 1000))
+                    pipe.expire(key, self.retention_seconds)
+                    pipe.zincrby(f"{self.PREFIX}{day}", tokens, ledger.phone)
+                    pipe.expire(f"{self.PREFIX}{day}", self.retention_seconds)
+                    turns_key = f"{self.TURNS_PREFIX}{ledger.phone}"
+                    pipe.lpush(turns_key, json.dumps(entry))
+                    pipe.ltrim(turns_key, 0, self.recent_turns - 1)
+                    pipe.expire(turns_key, self.retention_seconds)
+                    await pipe.execute()
+            self.committed += 1
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ No se pudo registrar el consumo del turno de {ledger.phone}: {e}")
+        return entry
+
+    def budget_for(self, phone: str) -> int:
+        return self.budgets.get(phone, self.budget)
+
+    async def tokens_used(self, phone: str, day: Optional[str] = None) -> int:
+        with self.breaker.guard():
+            value = await self.redis_client.hget(self._key(phone, day or self.day()), "total_tokens")
+        return int(value or 0)
+
+    async def ensure_budget(self, ledger: TurnLedger):
+        """Lanza TokenBudgetExceeded si el número ya gastó su presupuesto (contando el turno en curso)."""
+        budget = self.budget_for(ledger.phone)
+        if budget <= 0:
+            return
+        try:
+            used = await self.tokens_used(ledger.phone) + ledger.total_tokens
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ No se pudo consultar el consumo de {ledger.phone}, no se aplica el presupuesto: {e}")
+            return
+        if used >= budget:
+            self.budget_blocks += 1
+            raise TokenBudgetExceeded(f"{ledger.phone} consumió {used} de {budget} tokens hoy")
+
+    async def query(self, phone: str, day: Optional[str] = None) -> dict:
+        """Acumulados de un número en un día (hoy por defecto) y sus últimos turnos de ese día."""
+        day = day or self.day()
+        raw, history, degraded = {}, [], False
+        try:
+            with self.breaker.guard():
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.hgetall(self._key(phone, day))
+                    pipe.lrange(f"{self.TURNS_PREFIX}{phone}", 0, -1)
+                    raw, history = await pipe.execute()
+        except RedisUnavailable as e:
+            self.errors += 1
+            degraded = True
+            logger.warning(f"⚠️ No se pudo consultar el consumo de {phone}: {e}")
+        totals, tools, models, outcomes, routes = {}, {}, {}, {}, {}
+        for field, value in raw.items():
+            kind, _, rest = field.partition(":")
+            if kind == "tool":
+                name, _, metric = rest.rpartition(":")
+                tools.setdefault(name, {})[metric] = int(value)
+            elif kind == "model":
+                models[rest.rpartition(":")[0]] = int(value)
+            elif kind == "outcome":
+                outcomes[rest] = int(value)
+            elif kind == "route":
+                routes[rest] = int(value)
+            else:
+                totals[field] = float(value) if field == "cost_usd" else int(value)
+        recent = []
+        for item in history:
+            turn = json.loads(item)
+            if self.day(turn["started_at"]) == day:
+                recent.append(turn)
+        budget = self.budget_for(phone)
+        return {
+            "phone": phone,
+            "day": day,
+            "totals": totals,
+            "tools": tools,
+            "models": models,
+            "outcomes": outcomes,
+            "routes": routes,
+            "budget": budget or None,
+            "budget_remaining": max(budget - totals.get("total_tokens", 0), 0) if budget else None,
+            "recent_turns": recent,
+            "degraded": degraded,
+        }
+
+    async def top(self, day: Optional[str] = None, limit: int = 20) -> Optional[list]:
+        """Números con más tokens consumidos en el día (None si Redis no responde)."""
+        try:
+            with self.breaker.guard():
+                ranking = await self.redis_client.zrevrange(f"{self.PREFIX}{day or self.day()}", 0, limit - 1,
+                                                            withscores=True)
+        except RedisUnavailable as e:
+            self.errors += 1
+            logger.warning(f"⚠️ No se pudo consultar el ranking de consumo: {e}")
+            return None
+        return [{"phone": phone, "total_tokens": int(tokens)} for phone, tokens in ranking]
+
+    def stats(self) -> dict:
+        return {
+            "committed": self.committed,
+            "budget_blocks": self.budget_blocks,
+            "errors": self.errors,
+        }
+
+usage_ledger = UsageLedger()
@@ -1,19 +1,33 @@
-import os, requests, mimetypes
+import asyncio, os, re, json, httpx, mimetypes, hashlib, time
 from src.modules.file_mapping_service import FileMappingService
+from src.modules.http_conexion import get_http_client
+from src.modules.media_cache import media_cache
+from src.modules.outbound_dispatcher import outbound_dispatcher
 from src.modules.sharepoint_service import SharePointService
+from src.modules.turn_deadline import turn_timeout
 import tempfile
 from typing import Optional
 from src.utils.settings import settings
 from src.utils.logger import get_logger
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # orjson es opcional: se usa el decoder estándar
+    _json_loads = json.loads
+
 logger = get_logger(__name__)
 
+# Clave "messages" (no el valor de "field": "messages" que traen también los payloads de estados)
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+
 file_mapper = FileMappingService()
 sp_service = SharePointService(client_name="Celula")
 
 ACCESS_TOKEN = settings.WHATSAPP_ACCESS_TOKEN
 PHONE_NUMBER_ID = settings.PHONE_NUMBER_ID
 API_VERSION = settings.WHATSAPP_API_VERSION
+GRAPH_API_BASE_URL = settings.GRAPH_API_BASE_URL
 logger.debug(f"Access Token: {ACCESS_TOKEN}")
 
 def verify_signature(body_bytes, signature):
@@ -25,33 +39,62 @@ async def download_media(media_id: str, media_type: str, from_number: str, times
     Descarga un archivo multimedia de Meta.
     - Si es audio, devuelve los bytes.
     - Si es imagen o documento, lo sube a SharePoint y devuelve un file_id.
+      Si el remitente ya había enviado el mismo archivo (mismo sha256), se reutiliza la subida anterior.
     """
-    url = f"https://graph.facebook.com/{API_VERSION}/{media_id}"
+    url = f"{GRAPH_API_BASE_URL}/{API_VERSION}/{media_id}"
     headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
+    client = get_http_client()
     try:
-        resp = requests.get(url, headers=headers, timeout=15)
+        resp = await client.get(url, headers=headers, timeout=turn_timeout(settings.GRAPH_METADATA_TIMEOUT))
         resp.raise_for_status()
         media_info = resp.json()
         media_url = media_info.get("url")
         if not media_url:
             logger.error(f"No se encontró URL para media_id {media_id}")
             return None
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Error al solicitar metadata del media_id {media_id}: {e}", exc_info=True)
         return None
 
+    # La descarga se lee por bloques: queda en memoria hasta MEDIA_SPOOL_THRESHOLD y luego pasa a disco.
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.MEDIA_SPOOL_THRESHOLD)
+    hasher = hashlib.sha256()
+    size = 0
     try:
-        media_resp = requests.get(media_url, headers=headers, timeout=30)
-        media_resp.raise_for_status()
-        content = media_resp.content
-    except requests.exceptions.RequestException as e:
+        async with client.stream("GET", media_url, headers=headers, timeout=turn_timeout(settings.GRAPH_MEDIA_TIMEOUT)) as media_resp:
+            media_resp.raise_for_status()
+            async for chunk in media_resp.aiter_bytes(settings.MEDIA_DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.MEDIA_MAX_BYTES:
+                    logger.error(f"Media {media_id} supera el máximo de {settings.MEDIA_MAX_BYTES} bytes.")
+                    spool.close()
+                    return None
+                spool.write(chunk)
+                hasher.update(chunk)
+    except httpx.HTTPError as e:
         logger.error(f"Error al descargar media {media_id}: {e}", exc_info=True)
+        spool.close()
         return None
 
     if media_type == "audio":
-        return content
+        with spool:
+            spool.seek(0)
+            return spool.read()
 
     # Para imágenes y documentos
+    digest = hasher.hexdigest()
+    cached = await media_cache.lookup(from_number, digest)
+    if cached:
+        spool.close()
+        file_id = cached.get("file_id")
+        if not file_id or await file_mapper.get_link(file_id) != cached["url"]:
+            # El mapping FILE_xxxx vence antes que la caché: se crea uno nuevo para la misma URL
+            file_id = await file_mapper.create_mapping(cached["url"])
+            if file_id:
+                await media_cache.store(from_number, digest, cached["url"], file_id)
+        logger.info(f"♻️ Archivo repetido ({digest[:12]}), se reutiliza {cached['url']} con ID: {file_id}")
+        return file_id
+
     extension = mimetypes.guess_extension(mime_type) if mime_type else ''
     if media_type == 'document' and original_filename:
         filename = f"{timestamp}_{from_number}_{original_filename}"
@@ -59,61 +102,97 @@ async def download_media(media_id: str, media_type: str, from_number: str, times
         filename = f"{from_number}_{media_type}_{timestamp}{extension or '.dat'}"
 
     try:
-        sharepoint_url = sp_service.upload_file(
-            folder_key="staging", 
-            file_name=filename, 
-            file_content=content
+        # La subida por bloques es bloqueante (ClientContext): va en un thread para no frenar el loop
+        sharepoint_url = await asyncio.to_thread(
+            sp_service.upload_stream,
+            folder_key="staging",
+            file_name=filename,
+            stream=spool,
+            file_size=size
         )
         if sharepoint_url:
-            file_id = file_mapper.create_mapping(sharepoint_url)
+            file_id = await file_mapper.create_mapping(sharepoint_url)
             logger.info(f"Archivo subido a SharePoint y mapeado con ID: {file_id}")
+            if file_id:
+                await media_cache.store(from_number, digest, sharepoint_url, file_id)
             return file_id
     except Exception as e:
         logger.error(f"Error al subir archivo a SharePoint para media_id {media_id}: {e}", exc_info=True)
+    finally:
+        spool.close()
     
     return None
 
 async def send_text_message(to: str, message: str):
-    """Enviar un mensaje de texto usando la API de WhatsApp Cloud"""
-    url = f"https://graph.facebook.com/{API_VERSION}/{PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": to,
-        "type": "text",
-        "text": {
-            "body": message
-        }
-    }
-    resp = requests.post(url, headers=headers, json=payload)
-    # Podés manejar errores aquí (logs, reintentos, etc.)
-    # Por ahora:
-    return resp.json()
-
-def parse_whatsapp_message(data: dict):
-    """Extrae los datos relevantes del webhook de WhatsApp."""
+    """
+    Enviar un mensaje de texto usando la API de WhatsApp Cloud.
+    El envío (límite de tasa, reintentos y división de mensajes largos) lo hace `outbound_dispatcher`.
+    """
+    return await outbound_dispatcher.send_text(to, message, phone_number_id=PHONE_NUMBER_ID)
+
+class WhatsAppMessage:
+    """
+    Mensaje entrante de WhatsApp con sólo los campos que usa el bot.
+    `received_at` (reloj monotónico) marca la llegada al webhook: desde ahí corre el plazo del turno.
+    """
+    __slots__ = ("id", "sender", "type", "timestamp", "text", "media_id", "mime_type", "filename", "received_at")
+
+    MEDIA_TYPES = ("audio", "image", "document", "video", "sticker")
+
+    def __init__(self, id: str, sender: str, type: str, timestamp: str = None, text: str = None,
+                 media_id: str = None, mime_type: str = None, filename: str = None,
+                 received_at: Optional[float] = None):
+        self.id = id
+        self.sender = sender
+        self.type = type
+        self.timestamp = timestamp
+        self.text = text
+        self.media_id = media_id
+        self.mime_type = mime_type
+        self.filename = filename
+        self.received_at = received_at if received_at is not None else time.monotonic()
+
+    @classmethod
+    def from_payload(cls, msg: dict) -> "WhatsAppMessage":
+        msg_type = msg.get("type")
+        text = media_id = mime_type = filename = None
+        if msg_type == "text":
+            text = msg["text"].get("body") if "text" in msg else None
+        elif msg_type in cls.MEDIA_TYPES and msg_type in msg:
+            media = msg[msg_type]
+            media_id = media.get("id")
+            mime_type = media.get("mime_type")
+            if msg_type == "document":
+                filename = media.get("filename", "archivo")
+        return cls(msg.get("id"), msg.get("from"), msg_type, msg.get("timestamp"),
+                   text, media_id, mime_type, filename)
+
+    def __repr__(self):
+        return f"WhatsAppMessage(id={self.id!r}, sender={self.sender!r}, type={self.type!r})"
+
+
+def parse_whatsapp_message(data: dict) -> list:
+    """Extrae los mensajes entrantes del webhook de WhatsApp."""
     messages_data = []
 
-    for entry in data.get("entry", []):
-        for change in entry.get("changes", []):
-            value = change.get("value", {})
-            messages = value.get("messages", [])
-            for msg in messages:
-                message_info = {
-                    "from": msg.get("from"),
-                    "type": msg.get("type"),
-                    "id": msg.get("id"),
-                    "timestamp": msg.get("timestamp"),
-                    "audio_id": msg.get("audio", {}).get("id"),
-                    "image_id": msg.get("image", {}).get("id"),
-                    "document_id": msg.get("document", {}).get("id"),
-                    "filename": msg.get("document", {}).get("filename", "archivo"),
-                    "mime_type": msg.get(msg.get("type"), {}).get("mime_type"),
-                    "text": msg.get("text", {}).get("body"),
-                }
-                messages_data.append(message_info)
+    for entry in data.get("entry", ()):
+        for change in entry.get("changes", ()):
+            value = change.get("value")
+            if not value or "messages" not in value:
+                continue
+            for msg in value["messages"]:
+                messages_data.append(WhatsAppMessage.from_payload(msg))
 
     return messages_data
+
+
+def decode_webhook(body: bytes) -> list:
+    """
+    Decodifica el cuerpo crudo del webhook (una sola vez) y devuelve los mensajes entrantes.
+
+    Los payloads que sólo traen estados (entregado/leído) no tienen la clave "messages":
+    se descartan sin decodificar el JSON.
+    """
+    if not _MESSAGES_KEY.search(body):
+        return []
+    return parse_whatsapp_message(_json_loads(body))
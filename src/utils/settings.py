@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     # Sheet
@@ -11,10 +11,100 @@ class Settings(BaseSettings):
     REDIS_PORT: int 
     REDIS_USERNAME: Optional[str] = None
     REDIS_PASSWORD: Optional[str] = None
+    REDIS_MAX_CONNECTIONS: int = 50  # pool del cliente asyncio
+    REDIS_CONNECT_TIMEOUT: float = 2.0
+    REDIS_SOCKET_TIMEOUT: float = 2.0  # por comando; sin esto una caída cuelga el turno
+    REDIS_HEALTH_CHECK_SECONDS: int = 30  # PING antes de usar una conexión ociosa
+    REDIS_RETRIES: int = 2  # reintentos por comando ante errores de conexión, con backoff corto
+    REDIS_BREAKER_FAILURES: int = 3  # errores seguidos que abren el circuito
+    REDIS_BREAKER_RESET_SECONDS: float = 5.0  # espera antes de volver a probar
+    REDIS_FALLBACK_MAX_ENTRIES: int = 5000  # memoria de respaldo por tipo de clave
+    SESSION_TTL_SECONDS: int = 86400  # vida de un hilo sin actividad
+    LOCAL_CACHE_ENABLED: bool = True  # caché en proceso de sesiones y file mappings (invalidada por Redis)
+    LOCAL_CACHE_MAX_ENTRIES: int = 5000  # por tipo de clave
+    LOCAL_CACHE_TTL_SECONDS: float = 300.0  # red de seguridad por si se pierde una invalidación
+    LOCAL_CACHE_PING_SECONDS: float = 15.0  # chequeo de la conexión de invalidaciones
     
     # OpenAI
     OPENAI_API_KEY: str
-    
+    OPENAI_BASE_URL: Optional[str] = None
+    OPENAI_MAX_CONNECTIONS: int = 50
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_TIMEOUT: float = 60.0
+    OPENAI_DEFAULT_CONCURRENCY: int = 16  # llamadas simultáneas por modelo
+    OPENAI_CONCURRENCY_LIMITS: Dict[str, int] = {}  # p. ej. {"gpt-4o": 24, "whisper-1": 4}
+    OPENAI_QUEUE_TIMEOUT: float = 30.0  # espera máxima por un lugar antes de fallar el turno
+    OPENAI_WARMUP: bool = True
+    OPENAI_STREAMING: bool = True  # consumir la Responses API como stream y lanzar las herramientas apenas llegan
+    OPENAI_PROMPT_CACHE_KEY: Optional[str] = "agente-celula"  # agrupa las llamadas con el mismo prefijo
+
+    # Selección de modelo por turno
+    MODEL_LARGE: str = "gpt-4o"
+    MODEL_SMALL: Optional[str] = "gpt-4o-mini"  # vacío desactiva el ruteo (todo va a MODEL_LARGE)
+    MODEL_ROUTER_MAX_CHARS: int = 160  # mensajes más largos van al modelo grande
+    MODEL_ROUTER_MAX_TOOL_OUTPUT_CHARS: int = 2000  # pasos con salidas de herramientas más largas van al grande
+    MODEL_ROUTER_TOOL_KEYWORDS: List[str] = [
+        "cuit", "pedido", "compra", "comprar", "orden", "factura", "reclamo", "devolucion",
+        "historial", "asesor", "vincular", "cliente",
+    ]
+    MODEL_OVERRIDE_TTL_SECONDS: int = 86400  # lo que dura un hilo
+    MODEL_ESCALATION_STICKY: bool = True  # tras una llamada inválida el hilo sigue en el modelo grande
+
+    # Transcripción de notas de voz
+    TRANSCRIPTION_MODEL: str = "whisper-1"
+    TRANSCRIPTION_RESPONSE_FORMAT: str = "json"  # "text", "json" o "verbose_json" (trae segmentos con tiempos)
+    TRANSCRIPTION_SEGMENT_SECONDS: float = 30.0  # notas de más de 1.5x se cortan en silencios y se transcriben en paralelo
+    TRANSCRIPTION_MIN_SILENCE: float = 0.4
+    TRANSCRIPTION_SILENCE_DB: float = -40.0
+    TRANSCRIPTION_CACHE_TTL_SECONDS: int = 30 * 86400  # 0 desactiva la caché de transcripciones
+    TRANSCRIPTION_TRIM_PADDING: float = 0.2  # margen que se deja al recortar el silencio de los extremos
+    TRANSCRIPTION_OPUS_BITRATE: int = 16000
+    AUDIO_PREPROCESS_WORKERS: int = 2  # threads para decodificar/recodificar audio fuera del event loop
+
+    # Compactación de hilos largos (0 desactiva cada disparador)
+    COMPACTION_MAX_TURNS: int = 15
+    COMPACTION_MAX_TOKENS: int = 120000  # tokens acumulados por los turnos del hilo
+    COMPACTION_MODEL: Optional[str] = None  # None usa MODEL_LARGE
+    COMPACTION_TIMEOUT_SECONDS: float = 30.0
+
+    # Caché de respuestas a preguntas frecuentes (hilos nuevos sin herramientas)
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_TTL_SECONDS: int = 6 * 3600
+    ANSWER_CACHE_MAX_ENTRIES: int = 500
+    ANSWER_CACHE_MAX_CHARS: int = 200  # mensajes más largos no son preguntas frecuentes
+    ANSWER_CACHE_INTENTS: Dict[str, List[str]] = {
+        "horarios": ["horario", "hora", "atienden", "abren", "cierran"],
+        "envios": ["envio", "envian", "entrega", "zona", "reparto"],
+        "mayorista": ["mayorista", "por mayor", "minimo", "requisito"],
+        "productos": ["producto", "catalogo", "venden", "precios"],
+        "pedidos": ["pedido", "compra", "comprar"],
+        "reclamos": ["reclamo", "problema", "factura", "devolucion"],
+    }
+    ANSWER_CACHE_ALLOW: List[str] = ["horarios", "envios", "mayorista", "productos"]
+    ANSWER_CACHE_DENY: List[str] = ["pedidos", "reclamos"]
+
+    # Herramientas del agente
+    TOOL_CALL_TIMEOUT: float = 30.0
+    TOOL_CALL_TIMEOUTS: Dict[str, float] = {}  # por herramienta, p. ej. {"contact_company": 60}
+    TOOL_OUTPUT_MAX_TOKENS: int = 1500  # techo por salida de herramienta que vuelve al modelo
+    TOOL_OUTPUT_MAX_TOKENS_PER_TOOL: Dict[str, int] = {}  # p. ej. {"get_client_orders": 2500}
+    TOOL_OUTPUT_PAGE_SIZE: int = 5  # elementos por página en las salidas paginadas (p. ej. pedidos)
+
+    # Registro de consumo por turno
+    USAGE_TIMEZONE: str = "America/Argentina/Buenos_Aires"  # define el corte del día
+    USAGE_RETENTION_DAYS: int = 90
+    USAGE_RECENT_TURNS: int = 50  # turnos detallados que se guardan por número
+    # USD por millón de tokens (o por minuto de audio para la transcripción)
+    OPENAI_PRICES: Dict[str, Dict[str, float]] = {
+        "gpt-4o": {"input": 2.5, "cached_input": 1.25, "output": 10.0},
+        "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.6},
+        "whisper-1": {"audio_minute": 0.006},
+    }
+    DAILY_TOKEN_BUDGET: int = 0  # tokens por número y por día; 0 = sin límite
+    DAILY_TOKEN_BUDGETS: Dict[str, int] = {}  # por número, p. ej. {"5491100000000": 200000}
+    TOKEN_BUDGET_MESSAGE: str = ("Por hoy alcanzaste el límite de consultas automáticas. "
+                                 "Un asesor te va a responder a la brevedad.")
+
     
     # Google
     GOOGLE_CREDENTIALS_BASE64: str
@@ -24,6 +114,8 @@ class Settings(BaseSettings):
     SENDER_EMAIL: str
     SENDER_PASSWORD: str
     SMTP_SERVER: str  
+    SMTP_PORT: int = 587
+    SMTP_STARTTLS: bool = True
     SALES_EMAIL: str
     PROCUREMENT_EMAIL: str
     HR_EMAIL: str
@@ -34,9 +126,62 @@ class Settings(BaseSettings):
     # Whatsapp
     WHATSAPP_VERIFY_TOKEN: str = "abcd"
     APP_SECRET: Optional[str] = None
+    # Token para /metrics, /usage y /model (header "Authorization: Bearer ..."); sin token quedan cerrados
+    ADMIN_TOKEN: Optional[str] = None
     WHATSAPP_ACCESS_TOKEN: str
     PHONE_NUMBER_ID: str
     WHATSAPP_API_VERSION: str = "v24.0"
+    GRAPH_API_BASE_URL: str = "https://graph.facebook.com"
+    GRAPH_METADATA_TIMEOUT: float = 15.0
+    GRAPH_MEDIA_TIMEOUT: float = 30.0
+    GRAPH_SEND_TIMEOUT: float = 15.0
+
+    # Envío de mensajes salientes
+    WHATSAPP_MAX_TEXT_LENGTH: int = 4096
+    OUTBOUND_RATE_PER_SECOND: float = 20.0  # por phone_number_id
+    OUTBOUND_BURST: int = 20
+    OUTBOUND_MAX_ATTEMPTS: int = 4
+    OUTBOUND_RETRY_BACKOFF: float = 0.5
+    OUTBOUND_RETRY_INTERVAL: float = 15.0  # frecuencia de revisión de la cola persistente
+    OUTBOUND_RETRY_MAX_AGE: int = 86400  # fuera de la ventana de 24 h WhatsApp no permite responder
+
+    # Media
+    MEDIA_DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+    MEDIA_SPOOL_THRESHOLD: int = 2 * 1024 * 1024  # a partir de este tamaño la descarga pasa a disco
+    MEDIA_MAX_BYTES: int = 100 * 1024 * 1024
+    MEDIA_CACHE_TTL_SECONDS: int = 7 * 86400  # hash del archivo -> URL en SharePoint; 0 desactiva
+
+    # Cliente HTTP compartido
+    HTTP_MAX_CONNECTIONS: int = 50
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_READ_TIMEOUT: float = 30.0
+
+    # Procesamiento de turnos
+    TURN_QUEUE_MAXSIZE: int = 1000
+    TURN_WORKERS: int = 8  # remitentes procesados en paralelo
+    TURN_DRAIN_TIMEOUT: float = 30.0
+    TURN_MAX_ATTEMPTS: int = 3
+    TURN_RETRY_BACKOFF: float = 1.0
+    TURN_DEBOUNCE_SECONDS: float = 2.0  # 0 desactiva el agrupamiento de ráfagas
+    TURN_DEBOUNCE_MAX_WAIT: float = 8.0
+    TURN_MAX_BATCH: int = 10
+    # Plazo del turno desde que llega el último mensaje al webhook; 0 lo desactiva
+    TURN_DEADLINE_SECONDS: float = 60.0
+    TURN_ANSWER_RESERVE_SECONDS: float = 10.0  # se guarda para pedirle al modelo que responda con lo que tiene
+    TURN_MAX_MODEL_CALLS: int = 8
+    TURN_SEND_MIN_SECONDS: float = 5.0  # el envío de la respuesta siempre tiene al menos esto
+    TURN_FALLBACK_MESSAGE: str = ("Perdón, estoy tardando más de lo normal en responderte. "
+                                  "Un asesor va a revisar tu consulta a la brevedad.")
+    # Si un turno falla después de ejecutar herramientas pero antes de responder (no se reintenta)
+    TURN_ERROR_MESSAGE: str = ("Perdón, tuve un problema al terminar de responderte. "
+                               "Si no ves lo que pediste, escribime de nuevo.")
+
+    # Deduplicación de mensajes
+    DEDUP_TTL_SECONDS: int = 86400
+    DEDUP_LOCAL_CACHE_SIZE: int = 10000
+    DEDUP_REDIS_TIMEOUT: float = 0.3  # si Redis no contesta en este plazo el mensaje pasa (fail-open)
 
     # Azure
     AZURE_TENANT_ID: str
@@ -46,6 +191,10 @@ class Settings(BaseSettings):
     SHAREPOINT_SITE_URL: str
     CERT_KEY_BASE64: str
     THUMBPRINT: str
+    SHAREPOINT_CONFIG_PATH: Optional[str] = None
+    SHAREPOINT_ACCESS_TOKEN: Optional[str] = None  # si está definido reemplaza la autenticación por certificado
+    SHAREPOINT_UPLOAD_CHUNK_SIZE: int = 4 * 1024 * 1024
+    SHAREPOINT_UPLOAD_CHUNK_RETRIES: int = 3
 
     # Logging
     LOG_LEVEL: str = "INFO"
@@ -0,0 +1,60 @@
+import os
+import shutil
+import socket
+import subprocess
+import time
+import pytest
+import pytest_asyncio
+from redis.asyncio import Redis
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def redis_server():
+    """
+    Ephemeral local redis-server for the whole session, found in PATH or at REDIS_SERVER_BIN;
+    tests that need it are skipped without one.
+    """
+    binary = os.environ.get("REDIS_SERVER_BIN") or shutil.which("redis-server")
+    if not binary:
+        pytest.skip("redis-server no está instalado")
+    port = _free_port()
+    process = subprocess.Popen([binary, "--port", str(port), "--save", "", "--appendonly", "no"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.kill()
+                pytest.skip("redis-server no arrancó")
+            time.sleep(0.05)
+    yield "127.0.0.1", port
+    process.terminate()
+    process.wait()
+
+
+@pytest_asyncio.fixture
+async def redis_client(redis_server):
+    """Async client on an empty database of the local server."""
+    host, port = redis_server
+    client = Redis(host=host, port=port, decode_responses=True)
+    await client.flushdb()
+    yield client
+    await client.aclose()
+
+
+@pytest.fixture
+def dead_redis_client():
+    """Async client pointed at a port where nothing listens (connection refused, no retries)."""
+    return Redis(host="127.0.0.1", port=_free_port(), decode_responses=True,
+                 socket_connect_timeout=0.2, retry=Retry(NoBackoff(), 0))
@@ -0,0 +1,79 @@
+import httpx
+import pytest
+import whatsapp
+from src.utils.settings import settings
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    """Client for the app without running its lifespan, with ADMIN_TOKEN set to "secret"."""
+    monkeypatch.setattr(whatsapp, "ADMIN_TOKEN", "secret")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=whatsapp.app), base_url="http://app")
+
+
+@pytest.mark.parametrize("method, path", [
+    ("GET", "/metrics"), ("GET", "/usage"), ("GET", "/usage/5411"),
+    ("GET", "/model/5411"), ("PUT", "/model/5411?model=gpt-4o"), ("DELETE", "/model/5411"),
+])
+async def test_operational_endpoints_require_the_admin_token(admin, method, path):
+    """
+    Tests that the metrics, usage and model override endpoints reject requests without the
+    admin token or with a wrong one.
+    """
+    async with admin:
+        missing = await admin.request(method, path)
+        wrong = await admin.request(method, path, headers={"Authorization": "Bearer nope"})
+
+    assert missing.status_code == wrong.status_code == 401
+
+async def test_operational_endpoints_are_closed_without_a_configured_token(admin, monkeypatch):
+    """
+    Tests that with no ADMIN_TOKEN configured the endpoints are closed rather than open.
+    """
+    monkeypatch.setattr(whatsapp, "ADMIN_TOKEN", None)
+
+    async with admin:
+        response = await admin.get("/metrics", headers={"Authorization": "Bearer "})
+
+    assert response.status_code == 403
+
+async def test_unknown_model_override_is_rejected(admin, monkeypatch):
+    """
+    Tests that pinning a model other than MODEL_LARGE or MODEL_SMALL answers 422 and stores nothing.
+    """
+    # 1. Arrange
+    stored = []
+
+    async def set_override(phone, model):
+        stored.append(model)
+        return {"model": model, "reason": "manual"}
+
+    monkeypatch.setattr(whatsapp.model_router, "set_override", set_override)
+    headers = {"Authorization": "Bearer secret"}
+
+    # 2. Act
+    async with admin:
+        typo = await admin.put("/model/5411", params={"model": "gpt-4o-mimi"}, headers=headers)
+        valid = await admin.put("/model/5411", params={"model": settings.MODEL_LARGE}, headers=headers)
+
+    # 3. Assert
+    assert typo.status_code == 422
+    assert valid.status_code == 200
+    assert stored == [settings.MODEL_LARGE]
+
+async def test_override_not_stored_answers_503(admin, monkeypatch):
+    """
+    Tests that when the override could not be stored (Redis down) the endpoint does not report success.
+    """
+    async def set_override(phone, model):
+        return None
+
+    monkeypatch.setattr(whatsapp.model_router, "set_override", set_override)
+
+    async with admin:
+        response = await admin.put("/model/5411", params={"model": settings.MODEL_LARGE},
+                                   headers={"Authorization": "Bearer secret"})
+
+    assert response.status_code == 503
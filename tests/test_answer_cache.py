@@ -0,0 +1,111 @@
+import time
+import pytest
+from src.modules.answer_cache import AnswerCache, normalize_question
+from src.modules.redis_resilience import CircuitBreaker
+
+
+def make_cache(**kwargs):
+    options = dict(enabled=True, ttl_seconds=60, max_entries=10, max_chars=200, breaker=CircuitBreaker())
+    options.update(kwargs)
+    return AnswerCache(**options)
+
+def test_normalization_ignores_case_accents_punctuation_and_greetings():
+    """
+    Tests that trivially different phrasings of a question share the same key text.
+    """
+    assert normalize_question("Hola! ¿Qué HORARIOS tienen? 😊") == normalize_question("que horarios tienen")
+
+def test_hit_after_put():
+    """
+    Tests that an answer stored for a FAQ is returned for the same question and counted.
+    """
+    # 1. Arrange
+    cache = make_cache()
+
+    # 2. Act
+    miss = cache.get("¿Qué horarios tienen?", "unregistered", "sys1", "cat1")
+    cache.put("¿Qué horarios tienen?", "unregistered", "sys1", "cat1", "De 9 a 18 hs.")
+    hit = cache.get("que horarios tienen", "unregistered", "sys1", "cat1")
+
+    # 3. Assert
+    assert miss is None
+    assert hit == "De 9 a 18 hs."
+    assert cache.stats()["hit_ratio"] == 0.5
+
+def test_key_includes_prompt_and_catalog_versions():
+    """
+    Tests that changing the system message or the catalog invalidates cached answers.
+    """
+    cache = make_cache()
+    cache.put("¿Qué productos venden?", "unregistered", "sys1", "cat1", "Frutos secos.")
+
+    assert cache.get("¿Qué productos venden?", "unregistered", "sys1", "cat2") is None
+    assert cache.get("¿Qué productos venden?", "unregistered", "sys2", "cat1") is None
+    assert cache.get("¿Qué productos venden?", "registered", "sys1", "cat1") is None
+
+@pytest.mark.parametrize("question", [
+    "Quiero hacer un pedido, ¿qué horarios tienen?",  # denied intent wins
+    "Me llegó mal la factura",                          # not an allowed intent
+    "¿Hacen envíos? " * 30,                             # too long for a FAQ
+])
+def test_non_faq_questions_bypass_the_cache(question):
+    """
+    Tests that denied, unknown or long questions are never stored nor served.
+    """
+    cache = make_cache()
+
+    assert cache.put(question, "unregistered", "sys1", "cat1", "respuesta") is False
+    assert cache.get(question, "unregistered", "sys1", "cat1") is None
+    assert cache.stats()["bypassed"] == 1
+
+def test_answers_with_customer_data_are_not_stored():
+    """
+    Tests that a reply mentioning the customer's name is never shared with others.
+    """
+    cache = make_cache()
+
+    stored = cache.put("¿Hacen envíos?", "registered", "sys1", "cat1", "Hola Almacén Sol, sí enviamos.",
+                       private_values=("5411", "Almacén Sol"))
+
+    assert stored is False
+    assert cache.stats()["rejected_private"] == 1
+
+def test_ttl_and_lru_eviction():
+    """
+    Tests that expired entries are dropped and the least recently used entry is evicted first.
+    """
+    cache = make_cache(max_entries=2)
+    cache.put("¿Hacen envíos?", "unregistered", "s", "c", "Sí")
+    cache.put("¿Qué horarios tienen?", "unregistered", "s", "c", "9 a 18")
+    cache.get("¿Hacen envíos?", "unregistered", "s", "c")
+    cache.put("¿Qué productos venden?", "unregistered", "s", "c", "Frutos secos")
+
+    assert cache.get("¿Qué horarios tienen?", "unregistered", "s", "c") is None
+    assert cache.stats()["evicted"] == 1
+
+    short = make_cache(ttl_seconds=0.01)
+    short.put("¿Hacen envíos?", "unregistered", "s", "c", "Sí")
+    time.sleep(0.02)
+    assert short.get("¿Hacen envíos?", "unregistered", "s", "c") is None
+    assert short.stats()["expired"] == 1
+
+@pytest.mark.asyncio
+async def test_served_answers_become_history(redis_client):
+    """
+    Tests that answers served from the cache are handed to the next LLM turn once.
+    """
+    cache = make_cache(redis_client=redis_client)
+    await cache.remember_served("5411", "¿Horarios?", "9 a 18")
+
+    assert await cache.pop_served("5411") == [{"role": "user", "content": "¿Horarios?"},
+                                              {"role": "assistant", "content": "9 a 18"}]
+    assert await cache.pop_served("5411") == []
+
+def test_disabled_cache_is_inert():
+    """
+    Tests that nothing is stored or served unless the cache is enabled.
+    """
+    cache = make_cache(enabled=False)
+    cache.put("¿Hacen envíos?", "unregistered", "s", "c", "Sí")
+
+    assert cache.get("¿Hacen envíos?", "unregistered", "s", "c") is None
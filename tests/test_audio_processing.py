@@ -0,0 +1,83 @@
+import io
+import numpy as np
+import pytest
+from src.modules import audio_processing
+
+requires_av = pytest.mark.skipif(not audio_processing.available(), reason="PyAV no está instalado")
+
+RATE = 44100
+
+
+def speech(seconds: float, rate: int = RATE) -> np.ndarray:
+    """Tone bursts with short gaps, loud enough to count as voice."""
+    t = np.arange(int(seconds * rate)) / rate
+    return (np.sin(2 * np.pi * 220 * t) * (np.sin(2 * np.pi * 3 * t) > -0.5) * 9000).astype(np.int16)
+
+
+def wav_stereo(samples: np.ndarray, rate: int = RATE) -> bytes:
+    """Encodes mono samples as a 16-bit stereo WAV, the way some forwarded notes arrive."""
+    import av
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="wav") as container:
+        stream = container.add_stream("pcm_s16le", rate=rate)
+        stream.layout = "stereo"
+        frame = av.AudioFrame.from_ndarray(np.repeat(samples, 2).reshape(1, -1), format="s16", layout="stereo")
+        frame.sample_rate = rate
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("head, container", [
+    (b"OggS\x00\x02", "ogg"),
+    (b"RIFF\x24\x00\x00\x00WAVEfmt ", "wav"),
+    (b"\x00\x00\x00\x20ftypM4A ", "m4a"),
+    (b"ID3\x04\x00", "mp3"),
+    (b"\xff\xfb\x90\x00", "mp3"),
+    (b"#!AMR\n", "amr"),
+    (b"\x1a\x45\xdf\xa3\x01", "webm"),
+    (b"hello world", None),
+])
+def test_container_is_detected_from_its_signature(head, container):
+    """
+    Tests that the real container is recognised from the first bytes, whatever the file is called.
+    """
+    assert audio_processing.detect_container(head + b"\x00" * 16) == container
+
+@requires_av
+def test_stereo_wav_is_downmixed_trimmed_and_shrunk():
+    """
+    Tests that a stereo 44.1 kHz WAV with silence at both ends becomes a much smaller mono
+    OGG/Opus without the silence.
+    """
+    # 1. Arrange
+    silence = np.zeros(2 * RATE, dtype=np.int16)
+    data = wav_stereo(np.concatenate([silence, speech(6), silence]))
+
+    # 2. Act
+    prepared = audio_processing.prepare(data, segment_seconds=30, min_silence=0.4, silence_db=-40, trim_padding=0.2)
+
+    # 3. Assert
+    assert prepared.container == "wav" and prepared.transcoded
+    assert [name for _, name in prepared.parts] == ["audio.ogg"]
+    assert audio_processing.detect_container(prepared.parts[0][0]) == "ogg"
+    assert prepared.original_duration == pytest.approx(10, abs=0.05)
+    assert prepared.duration == pytest.approx(6.4, abs=0.3)
+    assert prepared.prepared_bytes < prepared.original_bytes / 20
+
+@requires_av
+def test_small_accepted_note_is_sent_as_is():
+    """
+    Tests that a note already smaller than its re-encoding keeps its bytes and gets the right extension.
+    """
+    # 1. Arrange
+    data = audio_processing.encode_opus(speech(5, rate=16000), bit_rate=8000)
+
+    # 2. Act
+    prepared = audio_processing.prepare(data, segment_seconds=30, min_silence=0.4, silence_db=-40, bit_rate=32000)
+
+    # 3. Assert
+    assert not prepared.transcoded
+    assert prepared.parts == [(data, "audio.ogg")]
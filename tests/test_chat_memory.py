@@ -0,0 +1,98 @@
+import asyncio
+from datetime import timedelta
+import pytest
+from src.modules.chat_memory import MemoryHandler
+
+pytestmark = pytest.mark.asyncio
+
+
+class CountingClient:
+    """Wraps the async client and counts the round trips (commands or pipelines) sent to Redis."""
+
+    def __init__(self, client):
+        self.client = client
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        self.round_trips += 1
+        return self.client.pipeline(transaction=transaction)
+
+
+async def test_session_is_a_hash_with_a_native_ttl(redis_client):
+    """
+    Tests that a turn stores the thread in one hash per number with the session TTL, and
+    accumulates turns and tokens atomically.
+    """
+    # 1. Arrange
+    memory = MemoryHandler(expiration_time=timedelta(hours=24), redis_client=redis_client)
+
+    # 2. Act
+    await memory.update_thread_activity("5411", "resp_1", tokens=1200)
+    state = await memory.update_thread_activity("5411", "resp_2", tokens=800)
+
+    # 3. Assert
+    assert await redis_client.type("session:5411") == "hash"
+    assert await redis_client.hget("session:5411", "thread_id") == "resp_2"
+    assert 86390 < await redis_client.ttl("session:5411") <= 86400
+    assert (state["thread_id"], state["turns"], state["tokens"]) == ("resp_2", 2, 2000)
+
+async def test_read_renews_the_ttl_in_one_round_trip(redis_client):
+    """
+    Tests that reading the thread also slides its expiry, using a single pipelined round trip.
+    """
+    # 1. Arrange
+    counting = CountingClient(redis_client)
+    memory = MemoryHandler(expiration_time=timedelta(seconds=100), redis_client=counting)
+    await memory.update_thread_activity("5411", "resp_1")
+    await redis_client.expire("session:5411", 5)
+    counting.round_trips = 0
+
+    # 2. Act
+    thread_id = await memory.get_or_create_thread("5411")
+
+    # 3. Assert
+    assert thread_id == "resp_1"
+    assert counting.round_trips == 1
+    assert await redis_client.ttl("session:5411") > 90
+
+async def test_idle_session_expires_on_its_own(redis_client):
+    """
+    Tests that a session without activity disappears through the Redis TTL, without a delete.
+    """
+    memory = MemoryHandler(expiration_time=timedelta(seconds=1), redis_client=redis_client)
+    await memory.update_thread_activity("5411", "resp_1")
+
+    await asyncio.sleep(1.2)
+
+    assert await memory.get_thread_state("5411") is None
+    assert await memory.get_or_create_thread("5411") is None
+
+async def test_compacted_thread_restarts_with_its_summary(redis_client):
+    """
+    Tests that a compacted thread has no chain but a summary, until the next turn stores a new chain.
+    """
+    # 1. Arrange
+    memory = MemoryHandler(redis_client=redis_client)
+    state = await memory.update_thread_activity("5411", "resp_1", tokens=500)
+
+    # 2. Act
+    await memory.start_compacted_thread("5411", "Cliente user_id 1", state)
+    compacted = await memory.get_thread_state("5411")
+    resumed = await memory.update_thread_activity("5411", "resp_new", tokens=100)
+
+    # 3. Assert
+    assert compacted["thread_id"] is None and compacted["summary"] == "Cliente user_id 1"
+    assert (compacted["turns"], compacted["tokens"], compacted["compactions"]) == (0, 0, 1)
+    assert resumed["summary"] is None
+    assert (resumed["thread_id"], resumed["turns"], resumed["compactions"]) == ("resp_new", 1, 1)
+
+async def test_concurrent_turns_share_the_pool(redis_client):
+    """
+    Tests that many numbers can be updated concurrently over the pooled async client.
+    """
+    memory = MemoryHandler(redis_client=redis_client)
+
+    await asyncio.gather(*(memory.update_thread_activity(f"54{n}", f"resp_{n}") for n in range(50)))
+
+    states = await asyncio.gather(*(memory.get_thread_state(f"54{n}") for n in range(50)))
+    assert [s["thread_id"] for s in states] == [f"resp_{n}" for n in range(50)]
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+import pytest
+from src.modules import conversation_compaction as cc
+from src.modules.chat_memory import MemoryHandler
+from src.modules.conversation_compaction import ConversationCompactor, COMPACTION_PROMPT
+from src.modules.prompt_layout import build_new_thread_input
+from src.modules.usage_ledger import TurnLedger
+
+pytestmark = pytest.mark.asyncio
+
+SUMMARY = "Cliente user_id 1 (CUIT 20123456789). Pedido en armado: 3 x P1, falta confirmar la dirección."
+
+
+class FakeOpenAI:
+    def __init__(self, text: str = SUMMARY):
+        self.text = text
+        self.requests = []
+
+    async def create_response(self, **request):
+        self.requests.append(request)
+        usage = SimpleNamespace(input_tokens=48000, output_tokens=60, input_tokens_details=None)
+        return SimpleNamespace(id="resp_summary", output=[], output_text=self.text, usage=usage)
+
+
+@pytest.fixture
+def memory(redis_client):
+    return MemoryHandler(redis_client=redis_client)
+
+
+@pytest.mark.parametrize("state, trigger", [
+    ({"thread_id": "resp_9", "turns": 15, "tokens": 1000}, "turns"),
+    ({"thread_id": "resp_9", "turns": 4, "tokens": 130000}, "tokens"),
+    ({"thread_id": "resp_9", "turns": 4, "tokens": 1000}, None),
+    ({"thread_id": None, "summary": SUMMARY, "turns": 0, "tokens": 0}, None),
+    (None, None),
+])
+async def test_compaction_triggers_on_turns_or_tokens(state, trigger):
+    """
+    Tests that a thread is compacted once it reaches the turn count or the cumulative token limit.
+    """
+    compactor = ConversationCompactor(max_turns=15, max_tokens=120000, model="gpt-4o", timeout=5)
+
+    assert compactor.trigger(state) == trigger
+
+async def test_long_thread_is_summarized_into_a_fresh_chain(memory, monkeypatch):
+    """
+    Tests that compaction summarizes the chain, closes it, records the before/after tokens, and
+    that the next turn starts a new chain with the summary as a developer message.
+    """
+    # 1. Arrange
+    openai = FakeOpenAI()
+    monkeypatch.setattr(cc, "get_openai_service", lambda: openai)
+    compactor = ConversationCompactor(max_turns=3, max_tokens=0, model="gpt-4o", timeout=5)
+    for n in range(3):
+        state = await memory.update_thread_activity("5411", f"resp_{n}", tokens=1000)
+    ledger = TurnLedger("5411")
+
+    # 2. Act
+    record = await compactor.compact("5411", state, memory, ledger)
+    next_state = await memory.get_thread_state("5411")
+
+    # 3. Assert
+    request = openai.requests[0]
+    assert request["previous_response_id"] == "resp_2"
+    assert request["input"] == [{"role": "developer", "content": COMPACTION_PROMPT}]
+    assert "tools" not in request
+    assert record == {"trigger": "turns", "turns": 3, "thread_tokens": 3000, "tokens_before": 48000,
+                      "tokens_after": 60, "seconds": record["seconds"]}
+    assert ledger.compaction == record and ledger.rounds[0]["input_tokens"] == 48000
+    assert next_state["thread_id"] is None and next_state["summary"] == SUMMARY
+    assert next_state["compactions"] == 1
+    assert await memory.get_or_create_thread("5411") is None
+
+    first_input = build_new_thread_input("system", None, "¿me confirmás el pedido?", client_phone="5411",
+                                         history=[cc.summary_message(next_state["summary"])])
+    assert SUMMARY in first_input[-2]["content"] and first_input[-2]["role"] == "developer"
+    assert (await memory.update_thread_activity("5411", "resp_new"))["turns"] == 1
+    assert (await memory.get_thread_state("5411"))["summary"] is None
+
+async def test_failed_summary_keeps_the_thread(memory, monkeypatch):
+    """
+    Tests that an empty or failed summary leaves the chain untouched.
+    """
+    monkeypatch.setattr(cc, "get_openai_service", lambda: FakeOpenAI(text=""))
+    compactor = ConversationCompactor(max_turns=2, max_tokens=0, model="gpt-4o", timeout=5)
+    await memory.update_thread_activity("5411", "resp_0")
+    state = await memory.update_thread_activity("5411", "resp_1")
+
+    assert await compactor.compact("5411", state, memory) is None
+    assert await memory.get_or_create_thread("5411") == "resp_1"
+    assert compactor.stats()["failures"] == 1
@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from redis import Redis
+from src.modules.chat_memory import MemoryHandler
+from src.modules.file_mapping_service import FileMappingService
+from src.modules.local_cache import CacheInvalidator, LocalCache
+from src.modules.redis_resilience import CircuitBreaker
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def invalidator(redis_client):
+    invalidator = CacheInvalidator([LocalCache("sessions", "session:"), LocalCache("file_links", "file_map:")],
+                                   redis_client=redis_client, retry_seconds=0.05)
+    invalidator.start()
+    assert await invalidator.wait_connected()
+    yield invalidator
+    await invalidator.stop()
+
+
+async def settle(invalidator, messages: int):
+    """Waits until the listener has received `messages` invalidations."""
+    for _ in range(100):
+        if invalidator.messages >= messages:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"llegaron {invalidator.messages} invalidaciones de {messages}")
+
+
+async def test_own_write_is_served_locally(redis_client, invalidator):
+    """
+    Tests that after saving a turn the next read of the thread is a local hit, even once Redis
+    has announced the worker's own write.
+    """
+    # 1. Arrange
+    cache = invalidator.caches[0]
+    memory = MemoryHandler(redis_client=redis_client, cache=cache)
+
+    # 2. Act
+    await memory.update_thread_activity("5411", "resp_1", tokens=100)
+    await settle(invalidator, 1)
+    state = await memory.get_thread_state("5411")
+
+    # 3. Assert
+    assert state["thread_id"] == "resp_1" and state["turns"] == 1
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 0 and stats["hit_ratio"] == 1.0
+    assert stats["own_invalidations"] == 1 and stats["invalidations"] == 0
+
+async def test_write_from_another_worker_invalidates(redis_client, redis_server, invalidator):
+    """
+    Tests that a change made by another client drops the local copy and the next read sees it.
+    """
+    # 1. Arrange
+    cache = invalidator.caches[0]
+    memory = MemoryHandler(redis_client=redis_client, cache=cache)
+    await memory.update_thread_activity("5411", "resp_1")
+    assert (await memory.get_thread_state("5411"))["thread_id"] == "resp_1"
+    other = Redis(host=redis_server[0], port=redis_server[1], decode_responses=True)
+
+    # 2. Act
+    other.hset("session:5411", "thread_id", "resp_other")
+    await settle(invalidator, 2)
+    state = await memory.get_thread_state("5411")
+
+    # 3. Assert
+    assert state["thread_id"] == "resp_other"
+    assert cache.stats()["invalidations"] == 1
+    other.close()
+
+async def test_invalidation_during_a_read_is_not_cached():
+    """
+    Tests that a value read while someone else changed the key is not stored, while the
+    worker's own announced write is.
+    """
+    cache = LocalCache("sessions", "session:")
+    cache.active = True
+
+    token = cache.begin("session:1")
+    cache.invalidate("session:1")
+    cache.finish(token, {"thread_id": "viejo"})
+    token = cache.begin("session:2", writes=True)
+    cache.invalidate("session:2")
+    cache.finish(token, {"thread_id": "nuevo"})
+
+    assert cache.stats()["entries"] == 1
+    assert cache.get("session:2") == {"thread_id": "nuevo"}
+
+async def test_lost_listener_bypasses_the_cache(redis_client, invalidator):
+    """
+    Tests that while the invalidation connection is down reads go to Redis, and that the cache
+    comes back empty once it reconnects.
+    """
+    # 1. Arrange
+    cache = invalidator.caches[0]
+    memory = MemoryHandler(redis_client=redis_client, cache=cache)
+    await memory.update_thread_activity("5411", "resp_1")
+
+    # 2. Act
+    await redis_client.client_kill_filter(_type="pubsub")
+    for _ in range(100):
+        if invalidator.errors:
+            break
+        await asyncio.sleep(0.01)
+    bypassed = cache.active
+    await redis_client.hset("session:5411", "thread_id", "resp_2")
+    state = await memory.get_thread_state("5411")
+    reconnected = await invalidator.wait_connected()
+
+    # 3. Assert
+    assert bypassed is False and state["thread_id"] == "resp_2"
+    assert reconnected and invalidator.connects == 2
+    assert cache.stats()["entries"] == 0
+
+async def test_file_links_are_cached(redis_client, invalidator):
+    """
+    Tests that a file mapping is resolved locally after it is created and dropped when it is
+    deleted in Redis.
+    """
+    # 1. Arrange
+    cache = invalidator.caches[1]
+    mapper = FileMappingService(redis_client=redis_client, cache=cache, breaker=CircuitBreaker())
+
+    # 2. Act
+    file_id = await mapper.create_mapping("https://sharepoint/staging/foto.jpg")
+    await settle(invalidator, 1)
+    link = await mapper.get_link(file_id)
+    await redis_client.delete(f"file_map:{file_id}")
+    await settle(invalidator, 2)
+
+    # 3. Assert
+    assert link == "https://sharepoint/staging/foto.jpg"
+    assert await mapper.get_link(file_id) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["invalidations"] == 1
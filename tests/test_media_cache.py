@@ -0,0 +1,80 @@
+import pytest
+from src.modules.media_cache import MediaCache
+from src.modules.redis_resilience import CircuitBreaker
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_cache(redis_client, ttl_seconds=60):
+    return MediaCache(ttl_seconds=ttl_seconds, redis_client=redis_client, breaker=CircuitBreaker())
+
+
+async def test_miss_then_hit(redis_client):
+    """
+    Tests that a stored upload is returned for the same sender and hash, and counted.
+    """
+    # 1. Arrange
+    cache = make_cache(redis_client)
+
+    # 2. Act
+    first = await cache.lookup("5411", "abc")
+    await cache.store("5411", "abc", "https://sp/staging/a.jpg", "FILE_1")
+    second = await cache.lookup("5411", "abc")
+
+    # 3. Assert
+    assert first is None
+    assert second == {"url": "https://sp/staging/a.jpg", "file_id": "FILE_1"}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert 0 < await redis_client.ttl("media_sha256:5411:abc") <= 60
+
+async def test_entries_are_scoped_by_sender(redis_client):
+    """
+    Tests that the same content sent by another number is not reused.
+    """
+    cache = make_cache(redis_client)
+    await cache.store("5411", "abc", "https://sp/staging/a.jpg", "FILE_1")
+
+    assert await cache.lookup("5422", "abc") is None
+
+async def test_invalidate_url_forgets_hash(redis_client):
+    """
+    Tests that moving a file out of staging drops its cache entry.
+    """
+    cache = make_cache(redis_client)
+    await cache.store("5411", "abc", "https://sp/staging/a.jpg", "FILE_1")
+
+    await cache.invalidate_url("https://sp/staging/a.jpg")
+
+    assert await cache.lookup("5411", "abc") is None
+    assert cache.stats()["invalidations"] == 1
+
+async def test_disabled_with_zero_ttl(redis_client):
+    """
+    Tests that a TTL of 0 disables the cache without touching Redis.
+    """
+    cache = make_cache(redis_client, ttl_seconds=0)
+    await cache.store("5411", "abc", "https://sp/staging/a.jpg", "FILE_1")
+
+    assert await cache.lookup("5411", "abc") is None
+    assert await redis_client.dbsize() == 0
+
+async def test_redis_errors_are_treated_as_miss():
+    """
+    Tests that a failing Redis never breaks the media flow, and that connection errors reach the
+    breaker so later lookups skip Redis.
+    """
+    class BrokenRedis:
+        calls = 0
+
+        async def hgetall(self, key):
+            BrokenRedis.calls += 1
+            raise ConnectionError("down")
+
+    breaker = CircuitBreaker(failures=1, reset_seconds=60)
+    cache = MediaCache(ttl_seconds=60, redis_client=BrokenRedis(), breaker=breaker)
+
+    assert await cache.lookup("5411", "abc") is None
+    assert await cache.lookup("5411", "abc") is None
+    assert cache.stats()["errors"] == 2
+    assert BrokenRedis.calls == 1 and breaker.state == "open"
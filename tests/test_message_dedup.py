@@ -0,0 +1,139 @@
+import asyncio
+import time
+import pytest
+from src.modules.message_dedup import MessageDeduplicator
+from src.modules.redis_resilience import CircuitBreaker
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeRedis:
+    """Minimal stand-in for the SET NX / DELETE calls used by the deduplicator."""
+
+    def __init__(self):
+        self.store = {}
+        self.calls = 0
+
+    async def set(self, key, value, nx=False, ex=None):
+        self.calls += 1
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    async def delete(self, key):
+        self.store.pop(key, None)
+
+
+@pytest.fixture
+def redis_client():
+    return FakeRedis()
+
+
+def make_dedup(redis_client, **kwargs):
+    options = dict(ttl_seconds=60, local_size=10, breaker=CircuitBreaker(failures=2, reset_seconds=60))
+    options.update(kwargs)
+    return MessageDeduplicator(redis_client=redis_client, **options)
+
+
+async def test_first_delivery_is_not_duplicate(redis_client):
+    """
+    Tests that a new message id passes and is registered in Redis with the prefix.
+    """
+    dedup = make_dedup(redis_client)
+
+    assert await dedup.is_duplicate("wamid.1") is False
+    assert "wamid:wamid.1" in redis_client.store
+
+async def test_redelivery_is_resolved_locally(redis_client):
+    """
+    Tests that a repeated id is dropped by the local cache without a Redis round trip.
+    """
+    dedup = make_dedup(redis_client)
+    await dedup.is_duplicate("wamid.1")
+
+    assert await dedup.is_duplicate("wamid.1") is True
+    assert redis_client.calls == 1
+    assert dedup.stats()["local_duplicates"] == 1
+
+async def test_duplicate_seen_by_another_worker(redis_client):
+    """
+    Tests that an id registered by another process is detected through Redis.
+    """
+    other_worker = make_dedup(redis_client)
+    dedup = make_dedup(redis_client)
+    await other_worker.is_duplicate("wamid.1")
+
+    assert await dedup.is_duplicate("wamid.1") is True
+    assert dedup.stats()["redis_duplicates"] == 1
+
+async def test_forget_allows_redelivery(redis_client):
+    """
+    Tests that a forgotten id is accepted again.
+    """
+    dedup = make_dedup(redis_client)
+    await dedup.is_duplicate("wamid.1")
+    await dedup.forget("wamid.1")
+
+    assert await dedup.is_duplicate("wamid.1") is False
+
+async def test_local_cache_is_bounded(redis_client):
+    """
+    Tests that the local cache evicts the oldest ids beyond its size.
+    """
+    dedup = make_dedup(redis_client, local_size=2)
+    for n in range(5):
+        await dedup.is_duplicate(f"wamid.{n}")
+
+    assert dedup.stats()["local_cache_size"] == 2
+
+async def test_redis_failure_fails_open():
+    """
+    Tests that messages are processed when Redis is unavailable.
+    """
+    class BrokenRedis:
+        async def set(self, *args, **kwargs):
+            raise ConnectionError("down")
+
+    dedup = make_dedup(BrokenRedis())
+
+    assert await dedup.is_duplicate("wamid.1") is False
+    assert dedup.stats()["failed_open"] == 1
+
+async def test_hung_redis_fails_open_quickly_and_opens_the_circuit():
+    """
+    Tests that a Redis that never answers costs at most the dedup timeout per message, without
+    blocking the event loop, and that the breaker opens so later messages skip Redis entirely.
+    """
+    # 1. Arrange
+    class HungRedis:
+        calls = 0
+
+        async def set(self, *args, **kwargs):
+            HungRedis.calls += 1
+            await asyncio.sleep(60)
+
+    breaker = CircuitBreaker(failures=2, reset_seconds=60)
+    dedup = make_dedup(HungRedis(), breaker=breaker, timeout_seconds=0.05)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    # 2. Act
+    background = asyncio.create_task(ticker())
+    started = time.monotonic()
+    results = [await dedup.is_duplicate(f"wamid.{n}") for n in range(4)]
+    elapsed = time.monotonic() - started
+    background.cancel()
+
+    # 3. Assert
+    assert results == [False] * 4
+    assert elapsed < 0.5
+    assert ticks >= 5
+    assert HungRedis.calls == 2
+    assert breaker.state == "open"
+    assert dedup.stats()["failed_open"] == 4
@@ -0,0 +1,190 @@
+from types import SimpleNamespace
+import pytest
+from src.modules import responses_tooled as rt
+from src.modules.model_router import ModelRoute, ModelRouter
+from src.modules.redis_resilience import CircuitBreaker
+from src.modules.usage_ledger import TurnLedger, current_turn
+from src.utils.settings import settings
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeRedis:
+    """Minimal stand-in for the string calls used by the override store."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def delete(self, key):
+        return int(self.data.pop(key, None) is not None)
+
+
+class FakeOpenAI:
+    """Answers the first request of each model with `calls[model]`, and everything else with text."""
+
+    def __init__(self, calls: dict):
+        self.calls = calls
+        self.requests = []
+
+    async def create_response(self, **request):
+        self.requests.append(request)
+        n = len(self.requests)
+        usage = SimpleNamespace(input_tokens=100, output_tokens=10, input_tokens_details=None)
+        arguments = self.calls.get(request["model"]) if request["input"][0].get("role") == "user" else None
+        if arguments is None:
+            return SimpleNamespace(id=f"resp_{n}", output=[], output_text="listo", usage=usage)
+        call = SimpleNamespace(type="function_call", name="get_client", call_id=f"call_{n}", arguments=arguments)
+        return SimpleNamespace(id=f"resp_{n}", output=[call], output_text="", usage=usage)
+
+
+def make_router(**kwargs):
+    options = dict(large_model="gpt-4o", small_model="gpt-4o-mini", max_chars=160,
+                   tool_keywords=["cuit", "pedido"], override_ttl_seconds=60, sticky=True,
+                   redis_client=FakeRedis(), breaker=CircuitBreaker())
+    options.update(kwargs)
+    return ModelRouter(**options)
+
+
+@pytest.mark.parametrize("message, files_id, tier, reason", [
+    ("Hola, ¿a qué hora abren?", None, "small", "simple"),
+    ("Gracias!!", None, "small", "simple"),
+    ("Quiero ver mis pedidos", None, "large", "tool_likely"),
+    ("20-12345678-9", None, "large", "tool_likely"),
+    ("te mando la foto", ["FILE_1"], "large", "files"),
+    ("contame " * 30, None, "large", "long_message"),
+])
+async def test_turns_are_routed_by_local_heuristics(message, files_id, tier, reason):
+    """
+    Tests that short plain messages go to the small model and the rest to the large one.
+    """
+    router = make_router()
+
+    route = await router.choose(message, files_id=files_id, phone="5411")
+
+    assert (route.tier, route.reason) == (tier, reason)
+
+async def test_thread_override_wins():
+    """
+    Tests that a pinned model is used for every turn of that number until it is cleared.
+    """
+    # 1. Arrange
+    router = make_router()
+    await router.set_override("5411", "gpt-4o-mini")
+
+    # 2. Act
+    pinned = await router.choose("Quiero ver mis pedidos", phone="5411")
+    other = await router.choose("Quiero ver mis pedidos", phone="5422")
+    await router.clear_override("5411")
+    cleared = await router.choose("Quiero ver mis pedidos", phone="5411")
+
+    # 3. Assert
+    assert (pinned.model, pinned.reason) == ("gpt-4o-mini", "override:manual")
+    assert other.model == cleared.model == "gpt-4o"
+
+async def test_override_is_not_reported_when_redis_is_down(dead_redis_client):
+    """
+    Tests that setting an override without Redis returns None instead of an override that
+    was never stored.
+    """
+    router = make_router(redis_client=dead_redis_client, breaker=CircuitBreaker(failures=1))
+
+    override = await router.set_override("5411", "gpt-4o")
+
+    assert override is None
+
+@pytest.mark.parametrize("previous, output, model, reason", [
+    (("gpt-4o", "large", "tool_likely"), '{"id": "1"}', "gpt-4o-mini", "step:tool_output"),
+    (("gpt-4o-mini", "small", "simple"), '{"error": "cliente no encontrado"}', "gpt-4o", "step:tool_error"),
+    (("gpt-4o-mini", "small", "simple"), '{"rows": "' + "x" * 300 + '"}', "gpt-4o", "step:long_tool_output"),
+])
+async def test_each_tool_step_is_routed_by_its_outputs(previous, output, model, reason):
+    """
+    Tests that the step after the tools run is routed again from what they returned.
+    """
+    router = make_router(max_tool_output_chars=200)
+    route = ModelRoute(*previous)
+
+    step = router.choose_step(route, [{"type": "function_call_output", "call_id": "call_1", "output": output}])
+
+    assert (step.model, step.reason) == (model, reason)
+
+async def test_escalated_and_pinned_routes_hold_for_every_step():
+    """
+    Tests that an escalation or a thread override is kept for the remaining steps of the turn.
+    """
+    router = make_router()
+    escalated = ModelRoute("gpt-4o", "large", "simple")
+    escalated.escalated = True
+    pinned = ModelRoute("gpt-4o", "large", "override:manual")
+    outputs = [{"type": "function_call_output", "call_id": "call_1", "output": '{"id": "1"}'}]
+
+    assert router.choose_step(escalated, outputs) is escalated
+    assert router.choose_step(pinned, outputs) is pinned
+
+async def test_answer_after_small_tool_output_goes_to_the_small_model(monkeypatch):
+    """
+    Tests that a turn started on the large model because it needed a tool answers with the
+    small one once the tool output is short and without errors.
+    """
+    # 1. Arrange
+    router = make_router()
+    openai = FakeOpenAI({"gpt-4o": '{"cuit": "20123456789"}'})
+
+    async def get_client(arguments):
+        return {"id": "1"}
+
+    monkeypatch.setattr(rt, "model_router", router)
+    monkeypatch.setattr(rt, "get_openai_service", lambda: openai)
+    monkeypatch.setattr(rt, "TOOL_HANDLERS", {"get_client": get_client})
+    monkeypatch.setattr(settings, "OPENAI_STREAMING", False)
+
+    # 2. Act
+    text, _ = await rt.responses_tooled("Mi cuit es 20123456789", client_phone="5411", thread_id="resp_0")
+
+    # 3. Assert
+    assert text == "listo"
+    assert [r["model"] for r in openai.requests] == ["gpt-4o", "gpt-4o-mini"]
+    assert router.stats()["reasons"]["step:tool_output"] == 1
+
+async def test_malformed_tool_call_escalates_to_the_large_model(monkeypatch):
+    """
+    Tests that a small-model step with an invalid tool call is discarded and repeated with the
+    large model, the choice is recorded in the turn and the thread stays on the large model.
+    """
+    # 1. Arrange
+    router = make_router()
+    openai = FakeOpenAI({"gpt-4o-mini": '{"numero": "20123456789"}', "gpt-4o": '{"cuit": "20123456789"}'})
+    executed = []
+
+    async def get_client(arguments):
+        executed.append(arguments)
+        return {"id": "1"}
+
+    monkeypatch.setattr(rt, "model_router", router)
+    monkeypatch.setattr(rt, "get_openai_service", lambda: openai)
+    monkeypatch.setattr(rt, "TOOL_HANDLERS", {"get_client": get_client})
+    monkeypatch.setattr(settings, "OPENAI_STREAMING", False)
+    ledger = TurnLedger("5411")
+    token = current_turn.set(ledger)
+
+    # 2. Act
+    try:
+        text, _ = await rt.responses_tooled("hola", client_phone="5411", thread_id="resp_0")
+    finally:
+        current_turn.reset(token)
+
+    # 3. Assert
+    assert text == "listo"
+    assert [r["model"] for r in openai.requests] == ["gpt-4o-mini", "gpt-4o", "gpt-4o"]
+    assert openai.requests[1]["input"] == openai.requests[0]["input"]
+    assert executed == [{"cuit": "20123456789"}]
+    assert ledger.route == {"model": "gpt-4o", "tier": "large", "reason": "simple", "escalated": True}
+    assert [r["model"] for r in ledger.rounds] == ["gpt-4o-mini", "gpt-4o", "gpt-4o"]
+    assert await router.get_override("5411") == {"model": "gpt-4o", "reason": "escalation"}
+    assert router.stats()["escalations"] == 1
@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from src.modules.openai_client import ModelLimiter, LLMQueueTimeout
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_limit_caps_concurrent_calls():
+    """
+    Tests that no more than the configured number of calls run at once for a model.
+    """
+    # 1. Arrange
+    limiter = ModelLimiter(default_limit=2, limits={}, queue_timeout=5)
+    running = 0
+    peak = 0
+
+    async def call():
+        nonlocal running, peak
+        async with limiter.slot("gpt-4o"):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    # 2. Act
+    await asyncio.gather(*(call() for _ in range(6)))
+
+    # 3. Assert
+    assert peak == 2
+    stats = limiter.stats()["gpt-4o"]
+    assert stats["completed"] == 6
+    assert stats["max_in_flight"] == 2
+    assert stats["in_flight"] == 0
+
+async def test_models_have_independent_limits():
+    """
+    Tests that a saturated model does not block calls to another model.
+    """
+    limiter = ModelLimiter(default_limit=1, limits={"whisper-1": 1}, queue_timeout=0.05)
+
+    async with limiter.slot("gpt-4o"):
+        async with limiter.slot("whisper-1"):
+            assert limiter.stats()["gpt-4o"]["in_flight"] == 1
+            assert limiter.stats()["whisper-1"]["in_flight"] == 1
+
+async def test_queue_timeout_raises():
+    """
+    Tests that a call waiting longer than the queue timeout fails and is counted.
+    """
+    limiter = ModelLimiter(default_limit=1, limits={}, queue_timeout=0.02)
+
+    async with limiter.slot("gpt-4o"):
+        with pytest.raises(LLMQueueTimeout):
+            async with limiter.slot("gpt-4o"):
+                pass
+
+    stats = limiter.stats()["gpt-4o"]
+    assert stats["timeouts"] == 1
+    assert stats["queued"] == 0
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from src.modules import outbound_dispatcher as outbound
+from src.modules.outbound_dispatcher import OutboundDispatcher, TokenBucket, split_message
+from src.modules.redis_resilience import CircuitBreaker
+
+pytestmark = pytest.mark.asyncio
+
+
+def graph_client(monkeypatch, statuses):
+    """Points the dispatcher at a mock Graph API answering with `statuses` in order (200 afterwards)."""
+    bodies = []
+
+    def handler(request):
+        bodies.append(request.read())
+        status = statuses.pop(0) if statuses else 200
+        return httpx.Response(status, json={"messages": [{"id": f"wamid.{len(bodies)}"}]})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(outbound, "get_http_client", lambda: client)
+    return bodies
+
+
+def make_dispatcher(redis_client, **kwargs):
+    options = dict(phone_number_id="123", rate=1000, burst=1000, max_attempts=3, retry_backoff=0.001,
+                   retry_interval=0, retry_max_age=3600, max_length=50, redis_client=redis_client,
+                   breaker=CircuitBreaker())
+    options.update(kwargs)
+    return OutboundDispatcher(**options)
+
+async def test_split_message_prefers_paragraphs():
+    """
+    Tests that long text is cut between paragraphs, in order and within the limit.
+    """
+    text = "Primer párrafo corto.\n\nSegundo párrafo algo más largo.\n\nTercero."
+
+    parts = split_message(text, limit=40)
+
+    assert parts == ["Primer párrafo corto.", "Segundo párrafo algo más largo.", "Tercero."]
+    assert all(len(part) <= 40 for part in parts)
+
+async def test_split_message_without_separators():
+    """
+    Tests that a text with no break points is cut at the limit.
+    """
+    assert split_message("x" * 25, limit=10) == ["x" * 10, "x" * 10, "x" * 5]
+
+async def test_long_reply_is_sent_in_order(monkeypatch, redis_client):
+    """
+    Tests that every part of a split reply is posted, in order.
+    """
+    # 1. Arrange
+    bodies = graph_client(monkeypatch, [])
+    dispatcher = make_dispatcher(redis_client)
+
+    # 2. Act
+    response = await dispatcher.send_text("5411", "Uno uno uno uno uno.\n\nDos dos dos dos dos.\n\nTres tres tres.")
+
+    # 3. Assert
+    assert response is not None
+    assert [b"Uno" in body for body in bodies] == [True, False]
+    assert dispatcher.stats()["split_messages"] == 1
+
+async def test_retries_on_429_and_5xx(monkeypatch, redis_client):
+    """
+    Tests that throttling and server errors are retried until the send succeeds.
+    """
+    bodies = graph_client(monkeypatch, [429, 503])
+    dispatcher = make_dispatcher(redis_client)
+
+    response = await dispatcher.send_text("5411", "Hola")
+
+    assert response["messages"][0]["id"] == "wamid.3"
+    assert len(bodies) == 3
+    assert dispatcher.stats()["retried"] == 2
+
+async def test_client_error_is_not_retried(monkeypatch, redis_client):
+    """
+    Tests that a permanent 4xx fails immediately and is not persisted.
+    """
+    bodies = graph_client(monkeypatch, [400])
+    dispatcher = make_dispatcher(redis_client)
+
+    assert await dispatcher.send_text("5411", "Hola") is None
+    assert len(bodies) == 1
+    assert dispatcher.stats()["failed"] == 1
+    assert dispatcher.stats()["retry_queue"] == 0
+
+async def test_exhausted_retries_are_persisted_and_recovered(monkeypatch, redis_client):
+    """
+    Tests that the unsent parts go to the retry queue and are delivered later.
+    """
+    # 1. Arrange
+    graph_client(monkeypatch, [500, 500, 500])
+    dispatcher = make_dispatcher(redis_client)
+
+    # 2. Act
+    first = await dispatcher.send_text("5411", "Hola")
+    processed = await dispatcher.retry_pending()
+
+    # 3. Assert
+    assert first is None
+    assert processed == 1
+    stats = dispatcher.stats()
+    assert stats["persisted"] == 1
+    assert stats["recovered"] == 1
+    assert stats["retry_queue"] == 0
+
+async def test_expired_entries_are_dropped(monkeypatch, redis_client):
+    """
+    Tests that an entry older than the retry window is discarded without sending.
+    """
+    bodies = graph_client(monkeypatch, [])
+    dispatcher = make_dispatcher(redis_client, retry_max_age=10)
+    await dispatcher._persist("123", "5411", ["Hola"], created_at=time.time() - 60, attempts=0)
+
+    await dispatcher.retry_pending()
+
+    assert bodies == []
+    assert dispatcher.stats()["expired"] == 1
+    assert await redis_client.exists("outbound:queue:123:5411") == 0
+
+async def test_later_replies_wait_behind_pending_ones(monkeypatch, redis_client):
+    """
+    Tests that while a recipient has a reply in the retry queue, the next replies to that
+    recipient are queued behind it and go out in order, while other recipients are not held.
+    """
+    # 1. Arrange
+    bodies = graph_client(monkeypatch, [500, 500, 500])
+    dispatcher = make_dispatcher(redis_client)
+    await dispatcher.send_text("5411", "Primera")
+
+    # 2. Act
+    held = await dispatcher.send_text("5411", "Segunda")
+    other = await dispatcher.send_text("5422", "Otra")
+    processed = await dispatcher.retry_pending()
+
+    # 3. Assert
+    assert held is None and other is not None
+    sent = bodies[3:]
+    assert [b"Otra" in sent[0], b"Primera" in sent[1], b"Segunda" in sent[2]] == [True, True, True]
+    assert processed == 1
+    stats = dispatcher.stats()
+    assert stats["held"] == 1 and stats["recovered"] == 2 and stats["retry_queue"] == 0
+    assert await redis_client.exists("outbound:queue:123:5411") == 0
+
+async def test_failed_retry_keeps_the_rest_queued(monkeypatch, redis_client):
+    """
+    Tests that when the oldest pending reply fails again, it stays at the head of the queue with
+    its remaining parts and the replies behind it are not sent.
+    """
+    # 1. Arrange
+    bodies = graph_client(monkeypatch, [500, 500, 500])
+    dispatcher = make_dispatcher(redis_client)
+    await dispatcher.send_text("5411", "Primera")
+    await dispatcher.send_text("5411", "Segunda")
+    graph_client(monkeypatch, [503, 503, 503])
+
+    # 2. Act
+    await dispatcher.retry_pending()
+
+    # 3. Assert
+    queue = [json.loads(raw) for raw in await redis_client.lrange("outbound:queue:123:5411", 0, -1)]
+    assert [entry["parts"] for entry in queue] == [["Primera"], ["Segunda"]]
+    assert queue[0]["attempts"] == 1 and queue[1]["attempts"] == 0
+    assert await redis_client.zscore("outbound:retry", "123:5411") is not None
+
+async def test_token_bucket_paces_sends():
+    """
+    Tests that the bucket allows the burst and then waits for new tokens.
+    """
+    bucket = TokenBucket(rate=100, capacity=2)
+
+    started = time.monotonic()
+    await asyncio.gather(*(bucket.acquire() for _ in range(4)))
+
+    assert time.monotonic() - started >= 0.015
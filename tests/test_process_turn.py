@@ -0,0 +1,114 @@
+import pytest
+import whatsapp
+from src.modules.turn_queue import TurnNotRetryable
+from src.modules.whatsapp_handler import WhatsAppMessage
+from src.utils.settings import settings
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def turn(monkeypatch):
+    """process_turn without Redis or WhatsApp: returns the messages sent to the client."""
+    sent = []
+
+    async def send_text_message(to, message):
+        sent.append(message)
+        return {"messages": [{"id": f"wamid.out{len(sent)}"}]}
+
+    async def ensure_budget(ledger):
+        pass
+
+    async def commit(ledger):
+        return ledger.entry({})
+
+    monkeypatch.setattr(whatsapp, "send_text_message", send_text_message)
+    monkeypatch.setattr(whatsapp.usage_ledger, "ensure_budget", ensure_budget)
+    monkeypatch.setattr(whatsapp.usage_ledger, "commit", commit)
+    monkeypatch.setattr(settings, "TURN_DEADLINE_SECONDS", 0)
+    return sent
+
+
+async def test_failure_before_any_side_effect_is_retried(turn, monkeypatch):
+    """
+    Tests that an error before replying or running tools reaches the queue as is, so the turn
+    is retried, and nothing is sent to the client.
+    """
+    # 1. Arrange
+    async def failing_turn(msgs, from_number, ledger):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(whatsapp, "_process_turn", failing_turn)
+
+    # 2. Act / 3. Assert
+    with pytest.raises(RuntimeError):
+        await whatsapp.process_turn([WhatsAppMessage("wamid.1", "5491100000000", "text", text="hola")])
+    assert turn == []
+
+async def test_failure_after_a_tool_ran_is_not_retried(turn, monkeypatch):
+    """
+    Tests that an error after a tool ran is not retried, since replaying the turn would run the
+    tool again, and that the client, still without an answer, is told once.
+    """
+    # 1. Arrange
+    async def failing_turn(msgs, from_number, ledger):
+        ledger.record_side_effect("tool:contact")
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(whatsapp, "_process_turn", failing_turn)
+
+    # 2. Act
+    with pytest.raises(TurnNotRetryable) as error:
+        await whatsapp.process_turn([WhatsAppMessage("wamid.1", "5491100000000", "text", text="hola")])
+
+    # 3. Assert
+    assert "tool:contact" in str(error.value)
+    assert turn == [settings.TURN_ERROR_MESSAGE]
+
+async def test_failure_after_replying_is_not_retried(turn, monkeypatch):
+    """
+    Tests that an error after the answer was sent (e.g. saving the thread) neither replays the
+    turn nor sends anything else.
+    """
+    # 1. Arrange
+    async def failing_turn(msgs, from_number, ledger):
+        await whatsapp.send_reply(from_number, "respuesta", ledger)
+        raise RuntimeError("session store unavailable")
+
+    monkeypatch.setattr(whatsapp, "_process_turn", failing_turn)
+
+    # 2. Act
+    with pytest.raises(TurnNotRetryable):
+        await whatsapp.process_turn([WhatsAppMessage("wamid.1", "5491100000000", "text", text="hola")])
+
+    # 3. Assert
+    assert turn == ["respuesta"]
+
+async def test_notice_about_a_failed_message_does_not_count_as_the_reply(turn, monkeypatch):
+    """
+    Tests that when a batch has an audio that could not be downloaded and the model call then
+    fails, the notice about the audio does not stop the turn from being retried.
+    """
+    # 1. Arrange
+    async def download_media(**kwargs):
+        return None
+
+    async def get_thread_state(phone):
+        return {"thread_id": "resp_1"}
+
+    async def responses_tooled(**kwargs):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(whatsapp, "download_media", download_media)
+    monkeypatch.setattr(whatsapp.memory_handler, "get_thread_state", get_thread_state)
+    monkeypatch.setattr(whatsapp, "responses_tooled", responses_tooled)
+    msgs = [WhatsAppMessage("wamid.1", "5491100000000", "audio", media_id="media_1"),
+            WhatsAppMessage("wamid.2", "5491100000000", "text", text="quiero hacer un pedido")]
+
+    # 2. Act
+    with pytest.raises(RuntimeError) as error:
+        await whatsapp.process_turn(msgs)
+
+    # 3. Assert
+    assert not isinstance(error.value, TurnNotRetryable)
+    assert turn == ["No pude descargar tu audio."]
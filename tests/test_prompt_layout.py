@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+from src.modules.prompt_layout import build_new_thread_input, encode_catalog
+from src.modules.responses_tooled import PromptCacheMetrics
+
+PRODUCTS = [
+    {"id": "P2", "name": "Almendras | 1kg", "price": 1500.0, "stock": float("nan")},
+    {"id": "P1", "name": "Nueces", "price": 999.5, "stock": 3.0},
+]
+
+
+def test_catalog_is_compact_and_deterministic():
+    """
+    Tests that the catalog is a sorted pipe table whose bytes and version don't depend on row order.
+    """
+    # 1. Arrange / 2. Act
+    table, version = encode_catalog(PRODUCTS)
+    reordered_table, reordered_version = encode_catalog(list(reversed(PRODUCTS)))
+
+    # 3. Assert
+    assert table == "id|name|price|stock\nP1|Nueces|999.5|3\nP2|Almendras / 1kg|1500|"
+    assert (reordered_table, reordered_version) == (table, version)
+
+def test_catalog_version_changes_with_content():
+    """
+    Tests that any change in the catalog produces a new version.
+    """
+    changed = [dict(PRODUCTS[0], price=1600.0), PRODUCTS[1]]
+
+    assert encode_catalog(changed)[1] != encode_catalog(PRODUCTS)[1]
+
+def test_static_prefix_is_shared_between_users():
+    """
+    Tests that the system message and catalog come first and are byte-identical for every customer.
+    """
+    registered = build_new_thread_input("SYSTEM", PRODUCTS, "Hola", user_information="{'id': '1'}")
+    unregistered = build_new_thread_input("SYSTEM", PRODUCTS, "Buenas", client_phone="5411", files_id=["FILE_1"])
+
+    assert registered[:2] == unregistered[:2]
+    assert registered[0] == {"role": "system", "content": "SYSTEM"}
+    assert encode_catalog(PRODUCTS)[1] in registered[1]["content"]
+    assert unregistered[-1]["content"] == "Id de los archivos adjuntos: ['FILE_1']"
+
+def test_cached_tokens_are_reported():
+    """
+    Tests that the cached share of the input tokens is accumulated from the usage details.
+    """
+    metrics = PromptCacheMetrics()
+    metrics.record(SimpleNamespace(input_tokens=4000, input_tokens_details=SimpleNamespace(cached_tokens=3000)))
+    metrics.record(SimpleNamespace(input_tokens=1000, input_tokens_details=None))
+
+    stats = metrics.stats()
+    assert stats["cached_tokens"] == 3000
+    assert stats["cached_ratio"] == 0.6
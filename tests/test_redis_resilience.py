@@ -0,0 +1,123 @@
+import time
+import pytest
+from redis.exceptions import ConnectionError
+from src.modules.chat_memory import MemoryHandler
+from src.modules.file_mapping_service import FileMappingService
+from src.modules.local_cache import LocalCache
+from src.modules.redis_resilience import CircuitBreaker, FallbackStore, RedisUnavailable
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_memory(redis_client, breaker, fallback):
+    return MemoryHandler(redis_client=redis_client, cache=LocalCache("sessions", "session:"),
+                         breaker=breaker, fallback=fallback)
+
+
+async def test_breaker_opens_and_recovers_with_a_probe():
+    """
+    Tests that the circuit opens after consecutive failures, rejects calls without trying, lets
+    a single probe through after the reset time and closes when it succeeds.
+    """
+    # 1. Arrange
+    breaker = CircuitBreaker(failures=2, reset_seconds=0.05)
+
+    # 2. Act
+    for _ in range(2):
+        with pytest.raises(RedisUnavailable):
+            with breaker.guard():
+                raise ConnectionError("connection refused")
+    rejected = breaker.allow()
+    time.sleep(0.06)
+    probe, second = breaker.allow(), breaker.allow()
+    breaker.record_success()
+
+    # 3. Assert
+    assert rejected is False
+    assert probe is True and second is False
+    assert breaker.state == "closed"
+    assert breaker.stats()["trips"] == 1 and breaker.stats()["rejected"] == 2
+
+async def test_sessions_survive_an_outage_and_are_reconciled(redis_client, dead_redis_client):
+    """
+    Tests that with Redis down the thread keeps advancing in memory from the last known state,
+    and that the turns written meanwhile reach Redis once it is back.
+    """
+    # 1. Arrange
+    breaker = CircuitBreaker(failures=1, reset_seconds=0.05)
+    fallback = FallbackStore("sessions", ttl_seconds=60)
+    memory = make_memory(redis_client, breaker, fallback)
+    await memory.update_thread_activity("5411", "resp_1", tokens=100)
+
+    # 2. Act
+    memory._redis = dead_redis_client
+    during = await memory.update_thread_activity("5411", "resp_2", tokens=50)
+    read = await memory.get_thread_state("5411")
+    memory._redis = redis_client
+    time.sleep(0.06)
+    after = await memory.get_thread_state("5411")
+
+    # 3. Assert
+    assert during["thread_id"] == "resp_2" and during["turns"] == 2 and during["tokens"] == 150
+    assert read == during
+    assert after["thread_id"] == "resp_2" and after["turns"] == 2
+    assert (await redis_client.hgetall("session:5411"))["thread_id"] == "resp_2"
+    assert await redis_client.ttl("session:5411") > 0
+    assert fallback.stats()["reconciled"] == 1 and fallback.stats()["pending"] == 0
+    assert breaker.state == "closed"
+
+async def test_newer_state_in_redis_wins_the_reconciliation(redis_client, dead_redis_client):
+    """
+    Tests that a thread written in memory during the outage does not overwrite a more recent
+    turn that another worker saved in Redis.
+    """
+    breaker = CircuitBreaker(failures=1, reset_seconds=0)
+    fallback = FallbackStore("sessions", ttl_seconds=60)
+    memory = make_memory(dead_redis_client, breaker, fallback)
+    await memory.update_thread_activity("5411", "resp_local")
+    await redis_client.hset("session:5411", mapping={"thread_id": "resp_other", "last_activity": time.time()})
+
+    memory._redis = redis_client
+    state = await memory.get_thread_state("5411")
+
+    assert state["thread_id"] == "resp_other"
+    assert fallback.stats()["conflicts"] == 1
+
+async def test_file_mappings_work_without_redis(redis_client, dead_redis_client):
+    """
+    Tests that a mapping created while Redis is down resolves from memory and is stored in Redis,
+    with its remaining lifetime, once it recovers.
+    """
+    # 1. Arrange
+    breaker = CircuitBreaker(failures=1, reset_seconds=0)
+    fallback = FallbackStore("file_links", ttl_seconds=7200)
+    mapper = FileMappingService(redis_client=dead_redis_client, cache=LocalCache("file_links", "file_map:"),
+                                breaker=breaker, fallback=fallback)
+
+    # 2. Act
+    file_id = await mapper.create_mapping("https://sharepoint/staging/foto.jpg")
+    during = await mapper.get_link(file_id)
+    mapper._redis = redis_client
+    after = await mapper.get_link(file_id)
+
+    # 3. Assert
+    assert file_id and during == after == "https://sharepoint/staging/foto.jpg"
+    assert await redis_client.get(f"file_map:{file_id}") == "https://sharepoint/staging/foto.jpg"
+    assert 7000 < await redis_client.ttl(f"file_map:{file_id}") <= 7200
+    assert fallback.stats()["degraded_writes"] == 1 and fallback.stats()["reconciled"] == 1
+
+async def test_fallback_is_bounded_with_ttl():
+    """
+    Tests that the in-memory fallback drops expired keys and evicts the least recently used ones,
+    counting lost pending writes.
+    """
+    fallback = FallbackStore("sessions", ttl_seconds=60, max_entries=2)
+
+    fallback.put("session:1", {"turns": 1}, dirty=True)
+    fallback.put("session:2", {"turns": 1}, ttl_seconds=0.01)
+    fallback.put("session:3", {"turns": 1})
+    time.sleep(0.02)
+
+    assert fallback.get("session:1") is None and fallback.get("session:2") is None
+    assert fallback.get("session:3") == {"turns": 1}
+    assert fallback.stats()["dropped"] == 1 and fallback.stats()["pending"] == 0
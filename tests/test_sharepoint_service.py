@@ -0,0 +1,120 @@
+import asyncio
+import io
+import os
+import json
+import time
+import pandas as pd
+import pytest
+import pytest_asyncio
+from fastapi.responses import JSONResponse
+from loadtest.run import LIBRARY, SITE_PATH, serve
+from loadtest.stubs import Fault, Recorder, build_workbook, sharepoint_app
+from src.modules.sharepoint_service import SharePointService
+from src.utils.settings import settings
+from conftest import _free_port
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def sharepoint(tmp_path, monkeypatch):
+    """
+    SharePointService talking to the SharePoint stand-in served on a local port. Yields the
+    service, the recorder, the upload session operations received, in order, and a list of
+    operations whose next answer is lost (processed by the stand-in, answered with a 500).
+    """
+    port = _free_port()
+    recorder = Recorder()
+    app = sharepoint_app(recorder, Fault(latency_ms=20), SITE_PATH, {f"{LIBRARY}/db.xlsx": build_workbook()})
+    operations, lose_next = [], []
+
+    @app.middleware("http")
+    async def upload_session_faults(request, call_next):
+        response = await call_next(request)
+        operation = request.url.path.rsplit("/", 1)[-1].split("(")[0]
+        if operation in ("startUpload", "continueUpload", "finishUpload", "GetUploadStatus"):
+            operations.append(operation)
+        if operation in lose_next:
+            lose_next.remove(operation)
+            return JSONResponse({"error": {"message": "Service Unavailable"}}, status_code=500)
+        return response
+
+    server, task = await serve(app, port)
+    config = tmp_path / "sharepoint_config.json"
+    folders = {"mother": LIBRARY, "staging": f"{LIBRARY}/Staging"}
+    config.write_text(json.dumps({"test": {"site_url": f"http://127.0.0.1:{port}{SITE_PATH}",
+                                           "libraries": {"documents": {"folders": folders}}}}))
+    monkeypatch.setattr(settings, "SHAREPOINT_CONFIG_PATH", str(config))
+    monkeypatch.setattr(settings, "SHAREPOINT_ACCESS_TOKEN", "test")
+    monkeypatch.setattr(SharePointService, "_instances", {})
+    yield SharePointService(client_name="test"), recorder, operations, lose_next
+    server.should_exit = True
+    await task
+
+
+async def test_added_row_is_written_without_blocking_the_loop(sharepoint):
+    """
+    Tests that adding a row downloads, rewrites and uploads the workbook in a worker thread,
+    so the event loop keeps running meanwhile, and that the row is in the uploaded file.
+    """
+    # 1. Arrange
+    service, recorder, _, _ = sharepoint
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    # 2. Act
+    background = asyncio.create_task(ticker())
+    started = time.monotonic()
+    await service.add_row_to_worksheet("mother", "db.xlsx", "phones", {"user_id": "1", "phone_number": "5411"})
+    elapsed = time.monotonic() - started
+    background.cancel()
+    content = await service._read_file_shared("mother", "db.xlsx")
+
+    # 3. Assert
+    phones = pd.read_excel(io.BytesIO(content), sheet_name="phones", engine="openpyxl")
+    assert phones["phone_number"].astype(str).tolist() == ["541100000000", "5411"]
+    assert recorder.samples["sharepoint_upload"]
+    assert ticks >= elapsed / 0.005 / 3
+
+async def test_large_file_is_uploaded_in_chunks(sharepoint):
+    """
+    Tests that a file bigger than the chunk size goes through an upload session, one request
+    per chunk, and arrives complete.
+    """
+    # 1. Arrange
+    service, _, operations, _ = sharepoint
+    content = os.urandom(200 * 1024)
+
+    # 2. Act
+    url = await asyncio.to_thread(service.upload_stream, "staging", "foto.jpg", io.BytesIO(content),
+                                  len(content), chunk_size=64 * 1024)
+    uploaded = await service._read_file_shared("staging", "foto.jpg")
+
+    # 3. Assert
+    assert url.endswith("/foto.jpg")
+    assert uploaded == content
+    assert operations == ["startUpload", "continueUpload", "continueUpload", "finishUpload"]
+
+async def test_failed_chunk_resumes_from_the_server_offset(sharepoint):
+    """
+    Tests that when a chunk reaches SharePoint but its answer is lost, the upload asks the
+    session for its offset and continues from there instead of resending or restarting.
+    """
+    # 1. Arrange
+    service, _, operations, lose_next = sharepoint
+    content = os.urandom(200 * 1024)
+    lose_next.append("continueUpload")
+
+    # 2. Act
+    await asyncio.to_thread(service.upload_stream, "staging", "doc.pdf", io.BytesIO(content),
+                            len(content), chunk_size=64 * 1024)
+    uploaded = await service._read_file_shared("staging", "doc.pdf")
+
+    # 3. Assert
+    assert uploaded == content
+    assert operations == ["startUpload", "continueUpload", "GetUploadStatus", "continueUpload", "finishUpload"]
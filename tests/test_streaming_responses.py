@@ -0,0 +1,102 @@
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from openai import AsyncOpenAI
+from loadtest.stubs import _response, response_events, scripted_output, sse_stream
+from src.modules import responses_tooled as rt
+from src.modules.model_router import ModelRouter
+from src.modules.openai_client import OpenAIService
+from src.utils.settings import settings
+
+pytestmark = pytest.mark.asyncio
+
+GENERATION_SECONDS = 0.4
+TOOL_SECONDS = 0.2
+
+
+@pytest.fixture
+def timeline():
+    return {"tool_started": [], "stream_finished": None}
+
+
+@pytest.fixture
+def service(timeline):
+    """OpenAIService backed by the recorded-stream stand-in, replayed over a mock transport."""
+    async def handler(request):
+        body = json.loads(request.content)
+        events = response_events(_response(scripted_output(body["input"]), body["model"], 10, 5))
+
+        async def stream():
+            async for chunk in sse_stream(events, GENERATION_SECONDS):
+                yield chunk
+            timeline["stream_finished"] = time.monotonic()
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=stream())
+
+    openai = OpenAIService(api_key="sk-test", base_url="http://openai.test/v1")
+    openai.client = AsyncOpenAI(api_key="sk-test", base_url="http://openai.test/v1",
+                                http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return openai
+
+
+@pytest.fixture
+def handlers(monkeypatch, timeline):
+    def tool(name):
+        async def run(arguments):
+            timeline["tool_started"].append((name, time.monotonic()))
+            await asyncio.sleep(TOOL_SECONDS)
+            return {"tool": name}
+        return run
+
+    monkeypatch.setattr(rt, "TOOL_HANDLERS", {"get_client_orders": tool("get_client_orders"),
+                                              "get_client": tool("get_client")})
+    monkeypatch.setattr(settings, "OPENAI_STREAMING", True)
+
+async def test_tools_start_before_the_stream_ends(service, handlers, timeline):
+    """
+    Tests that each tool call starts while the model is still streaming the rest of the response.
+    """
+    # 1. Arrange
+    user_input = [{"role": "user", "content": "Quiero ver mis pedidos, mi cuit es 20123456789"}]
+
+    # 2. Act
+    response, outputs, _ = await rt.model_step(service, "5411", model="gpt-4o", input=user_input)
+    finished = time.monotonic()
+
+    # 3. Assert
+    assert [name for name, _ in timeline["tool_started"]] == ["get_client_orders", "get_client"]
+    assert all(at < timeline["stream_finished"] for _, at in timeline["tool_started"])
+    assert [o["call_id"] for o in outputs] == [item.call_id for item in response.output]
+    # Waiting for the whole response first would leave the full TOOL_SECONDS after the stream ends
+    assert finished - timeline["stream_finished"] < TOOL_SECONDS - 0.05
+
+async def test_escalatable_model_runs_tools_after_validating_the_step(service, handlers, timeline, monkeypatch):
+    """
+    Tests that when a malformed call could still send the step to the large model, no tool starts
+    until the whole stream has been read and validated.
+    """
+    # 1. Arrange
+    router = ModelRouter(large_model="gpt-4o", small_model="gpt-4o-mini", redis_client=object())
+    monkeypatch.setattr(rt, "model_router", router)
+    user_input = [{"role": "user", "content": "Quiero ver mis pedidos, mi cuit es 20123456789"}]
+
+    # 2. Act
+    response, outputs, _ = await rt.model_step(service, "5411", model="gpt-4o-mini", input=user_input)
+
+    # 3. Assert
+    assert [name for name, _ in timeline["tool_started"]] == ["get_client_orders", "get_client"]
+    assert all(at >= timeline["stream_finished"] for _, at in timeline["tool_started"])
+    assert [o["call_id"] for o in outputs] == [item.call_id for item in response.output]
+
+async def test_final_text_is_assembled_from_deltas(service, handlers, monkeypatch):
+    """
+    Tests the full tool loop in streaming mode returns the text of the last step.
+    """
+    monkeypatch.setattr(rt, "get_openai_service", lambda: service)
+
+    text, response_id = await rt.responses_tooled("Quiero ver mis pedidos", thread_id="resp_previous",
+                                                  client_phone="5411")
+
+    assert text == "Listo, ya lo revisé. ¿Necesitás algo más?"
+    assert response_id.startswith("resp_")
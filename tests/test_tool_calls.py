@@ -0,0 +1,70 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from src.modules import responses_tooled as rt
+from src.utils.settings import settings
+
+pytestmark = pytest.mark.asyncio
+
+
+def call(name: str, call_id: str, arguments: str = "{}"):
+    return SimpleNamespace(type="function_call", name=name, call_id=call_id, arguments=arguments)
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    async def slow(arguments):
+        await asyncio.sleep(0.1)
+        return {"ok": arguments.get("n")}
+
+    async def hang(arguments):
+        await asyncio.sleep(10)
+
+    async def broken(arguments):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(rt, "TOOL_HANDLERS", {"slow": slow, "hang": hang, "broken": broken})
+    monkeypatch.setattr(rt, "tool_metrics", rt.ToolMetrics())
+    monkeypatch.setattr(settings, "TOOL_CALL_TIMEOUTS", {"hang": 0.2})
+
+async def test_calls_run_concurrently_in_order(handlers):
+    """
+    Tests that the calls of one step overlap and their outputs keep the model's call order.
+    """
+    # 1. Arrange
+    calls = [call("slow", f"call_{n}", f'{{"n": {n}}}') for n in range(3)]
+
+    # 2. Act
+    started = time.monotonic()
+    outputs = await rt.run_tool_calls(calls, client_phone="5411")
+    elapsed = time.monotonic() - started
+
+    # 3. Assert
+    assert elapsed < 0.25
+    assert [o["call_id"] for o in outputs] == ["call_0", "call_1", "call_2"]
+    assert outputs[2]["output"] == '{"ok":2}'
+
+async def test_failures_and_timeouts_are_isolated(handlers):
+    """
+    Tests that a hanging or failing tool does not prevent the others from returning.
+    """
+    outputs = await rt.run_tool_calls(
+        [call("hang", "call_a"), call("broken", "call_b"), call("slow", "call_c", '{"n": 1}')], client_phone="5411")
+
+    assert "no respondió a tiempo" in outputs[0]["output"]
+    assert "boom" in outputs[1]["output"]
+    assert outputs[2]["output"] == '{"ok":1}'
+
+async def test_latency_is_recorded_per_tool(handlers):
+    """
+    Tests that each tool gets its own latency, error and timeout counters.
+    """
+    await rt.run_tool_calls([call("hang", "call_a"), call("broken", "call_b"), call("slow", "call_c")],
+                            client_phone="5411")
+
+    stats = rt.tool_metrics.stats()
+    assert stats["hang"]["timeouts"] == 1
+    assert stats["broken"]["errors"] == 1
+    assert stats["slow"]["calls"] == 1
+    assert stats["slow"]["avg_seconds"] >= 0.1
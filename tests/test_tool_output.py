@@ -0,0 +1,107 @@
+import json
+import pandas as pd
+import pytest
+from src.modules.tool_output import ToolOutputEncoder
+from tools.query_handler import ORDERS_OUTPUT
+
+pytestmark = pytest.mark.asyncio
+
+
+def client_orders(count: int = 20) -> dict:
+    """Orders shaped like handle_get_client_orders builds them from the SharePoint sheets."""
+    orders = pd.DataFrame([{"id": f"O{n}", "user_id": "1", "fecha": f"2024-01-{n + 1:02d} 10:00:00",
+                            "status": "delivered" if n % 4 else "pending", "notes": None}
+                           for n in range(count)]).to_dict("records")
+    for order in orders:
+        details = pd.DataFrame([{"id": "D1", "order_id": order["id"], "product_id": "P1", "quantity": 2,
+                                 "unit_price": 100.0, "internal_code": "x"}])
+        order["details"] = details.drop(columns=["id", "order_id"]).to_dict("records")
+    return {"orders": orders}
+
+
+def make_encoder(**kwargs):
+    options = dict(max_tokens=1500, max_tokens_per_tool={}, page_size=5)
+    options.update(kwargs)
+    return ToolOutputEncoder(**options)
+
+
+async def test_first_page_has_latest_orders_and_totals():
+    """
+    Tests that the first page is compact JSON with the latest orders, only the declared fields
+    and the totals over every order.
+    """
+    # 1. Arrange
+    encoder = make_encoder()
+
+    # 2. Act
+    text = encoder.encode("get_client_orders", client_orders(), {"user_id": "1", "offset": None}, ORDERS_OUTPUT)
+
+    # 3. Assert
+    output = json.loads(text)
+    assert text == json.dumps(output, ensure_ascii=False, separators=(",", ":"))
+    assert [order["id"] for order in output["orders"]] == ["O19", "O18", "O17", "O16", "O15"]
+    assert output["orders"][0] == {"id": "O19", "fecha": "2024-01-20 10:00:00", "status": "delivered",
+                                   "details": [{"product_id": "P1", "quantity": 2, "unit_price": 100}]}
+    assert output["summary"]["orders"] == 20
+    assert output["summary"]["amount"] == 4000
+    assert output["summary"]["by_status"] == {"pending": 5, "delivered": 15}
+    assert output["next_offset"] == 5 and "offset=5" in output["truncated"]
+
+async def test_empty_cells_count_as_zero_in_the_totals():
+    """
+    Tests that details with empty quantity or price cells (NaN from pandas) count as 0 instead of
+    turning the totals into NaN.
+    """
+    # 1. Arrange
+    orders = client_orders(2)
+    orders["orders"][0]["details"][0]["quantity"] = float("nan")
+    orders["orders"][1]["details"].append({"product_id": "P2", "quantity": 3, "unit_price": float("nan")})
+
+    # 2. Act
+    output = json.loads(make_encoder().encode("get_client_orders", orders, {"offset": None}, ORDERS_OUTPUT))
+
+    # 3. Assert
+    assert output["summary"]["units"] == 5
+    assert output["summary"]["amount"] == 200
+
+async def test_next_page_follows_the_offset():
+    """
+    Tests that the offset from the marker returns the following orders without repeating the totals.
+    """
+    encoder = make_encoder()
+
+    output = json.loads(encoder.encode("get_client_orders", client_orders(), {"offset": 15}, ORDERS_OUTPUT))
+
+    assert [order["id"] for order in output["orders"]] == ["O4", "O3", "O2", "O1", "O0"]
+    assert "summary" not in output
+    assert "next_offset" not in output and "truncated" not in output
+
+async def test_token_ceiling_shrinks_the_page():
+    """
+    Tests that a page over the tool's token ceiling drops orders and points the model at the next ones.
+    """
+    # 1. Arrange
+    encoder = make_encoder(max_tokens_per_tool={"get_client_orders": 120})
+
+    # 2. Act
+    text = encoder.encode("get_client_orders", client_orders(), {"offset": None}, ORDERS_OUTPUT)
+
+    # 3. Assert
+    output = json.loads(text)
+    assert len(text) <= 120 * 4
+    assert 1 <= len(output["orders"]) < 5
+    assert output["next_offset"] == len(output["orders"])
+    assert encoder.stats()["get_client_orders"]["truncated"] == 1
+
+async def test_undeclared_output_is_cut_with_a_marker():
+    """
+    Tests that a tool without a spec is sent as compact JSON and cut at the ceiling with a marker.
+    """
+    encoder = make_encoder(max_tokens=50)
+
+    short = encoder.encode("get_client", {"client": {"id": "1", "name": "Ana", "email": None}})
+    long = json.loads(encoder.encode("contact_company", {"message": "x" * 1000}))
+
+    assert short == '{"client":{"id":"1","name":"Ana"}}'
+    assert len(long["partial"]) == 200
+    assert "se cortó" in long["truncated"]
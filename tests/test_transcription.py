@@ -0,0 +1,147 @@
+import time
+import httpx
+import numpy as np
+import pytest
+from openai import AsyncOpenAI
+from loadtest.stubs import TRANSCRIPTS, Fault, Recorder, openai_app, synthetic_voice_note
+from src.modules import audio_processing, transcription
+from src.modules.openai_client import OpenAIService
+from src.modules.redis_resilience import CircuitBreaker
+from src.modules.transcription import Transcriber
+
+pytestmark = pytest.mark.asyncio
+
+requires_av = pytest.mark.skipif(not audio_processing.available(), reason="PyAV no está instalado")
+
+
+class FakeRedis:
+    """Minimal stand-in for the string calls used by the transcript cache."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+
+@pytest.fixture
+def recorder():
+    return Recorder()
+
+
+@pytest.fixture
+def stand_in(monkeypatch, recorder):
+    """OpenAIService talking to the OpenAI stand-in in-process."""
+    app = openai_app(recorder, Fault(), Fault())
+    openai = OpenAIService(api_key="sk-test", base_url="http://openai.test/v1")
+    openai.client = AsyncOpenAI(api_key="sk-test", base_url="http://openai.test/v1",
+                                http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=app)))
+    monkeypatch.setattr(transcription, "get_openai_service", lambda: openai)
+    return openai
+
+
+def make_transcriber(**kwargs):
+    options = dict(model="whisper-1", response_format="json", segment_seconds=30, min_silence=0.4,
+                   silence_db=-40, cache_ttl_seconds=60, redis_client=FakeRedis(),
+                   breaker=CircuitBreaker())
+    options.update(kwargs)
+    return Transcriber(**options)
+
+
+async def test_split_points_prefer_silences_near_the_target():
+    """
+    Tests that cuts land in the middle of the silence closest to each segment target.
+    """
+    # 1. Arrange: 100 s of speech at -20 dBFS with 1 s pauses at 25 s, 33 s and 61 s
+    levels = np.full(5000, -20.0)
+    for pause in (25, 33, 61):
+        levels[pause * 50:(pause + 1) * 50] = -60.0
+
+    # 2. Act
+    cuts = audio_processing.split_points(levels, segment_seconds=30, min_silence=0.4, silence_db=-40)
+
+    # 3. Assert
+    assert cuts == [pytest.approx(33.5), pytest.approx(61.5)]
+
+@requires_av
+async def test_long_note_is_transcribed_in_parallel_segments(stand_in, recorder):
+    """
+    Tests that a long voice note is split at silences, the segments are transcribed concurrently
+    and the texts are stitched back in order.
+    """
+    # 1. Arrange
+    note = synthetic_voice_note(90)
+    segments = [data for data, _ in audio_processing.prepare(note, 30, 0.4, -40).parts]
+    durations = [int(len(audio_processing.decode_mono(segment)) / 16000) for segment in segments]
+    expected = " ".join(TRANSCRIPTS[seconds % len(TRANSCRIPTS)] for seconds in durations)
+    transcriber = make_transcriber()
+
+    # 2. Act
+    started = time.monotonic()
+    result = await transcriber.transcribe(note)
+    elapsed = time.monotonic() - started
+
+    # 3. Assert
+    assert result.segments == len(segments) == 3
+    assert result.text == expected
+    assert 85 < result.duration < 90  # sin el silencio de los extremos
+    calls = recorder.samples["openai_transcription"]
+    assert len(calls) == 3
+    assert elapsed < sum(calls)
+
+@requires_av
+async def test_repeated_note_is_served_from_the_cache(stand_in, recorder):
+    """
+    Tests that a redelivered note with the same bytes is not sent to the API again.
+    """
+    # 1. Arrange
+    note = synthetic_voice_note(10)
+    transcriber = make_transcriber(response_format="text")
+
+    # 2. Act
+    first = await transcriber.transcribe(note)
+    second = await transcriber.transcribe(note)
+
+    # 3. Assert
+    assert first.text in TRANSCRIPTS and not first.cached
+    assert second.text == first.text and second.cached
+    assert len(recorder.samples["openai_transcription"]) == 1
+    assert transcriber.stats()["cache_hits"] == 1
+
+async def test_undecodable_audio_is_sent_whole(stand_in, recorder):
+    """
+    Tests that audio that cannot be analysed still gets transcribed in a single call.
+    """
+    transcriber = make_transcriber(response_format="verbose_json")
+
+    result = await transcriber.transcribe(b"not really audio" * 100)
+
+    assert result.text in TRANSCRIPTS
+    assert result.segments == 1
+    assert result.duration == pytest.approx(0.1)
+    assert len(recorder.samples["openai_transcription"]) == 1
+
+async def test_redis_outage_transcribes_without_cache(stand_in, recorder):
+    """
+    Tests that with Redis down the note is still transcribed and the breaker sees the failures.
+    """
+    # 1. Arrange
+    class BrokenRedis:
+        async def get(self, key):
+            raise ConnectionError("down")
+
+        async def set(self, key, value, ex=None):
+            raise ConnectionError("down")
+
+    breaker = CircuitBreaker(failures=2, reset_seconds=60)
+    transcriber = make_transcriber(redis_client=BrokenRedis(), breaker=breaker)
+
+    # 2. Act
+    result = await transcriber.transcribe(b"not really audio" * 100)
+
+    # 3. Assert
+    assert result.text in TRANSCRIPTS and not result.cached
+    assert breaker.state == "open"
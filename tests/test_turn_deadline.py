@@ -0,0 +1,129 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from src.modules import responses_tooled as rt
+from src.modules.turn_deadline import TurnDeadline, TurnDeadlineExceeded, current_deadline, turn_timeout
+from src.utils.settings import settings
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeOpenAI:
+    """Answers every tooled request with a call to `tool`, and tool_choice="none" requests with text."""
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.requests = []
+
+    async def create_response(self, **request):
+        self.requests.append(request)
+        n = len(self.requests)
+        if request.get("tool_choice") == "none":
+            return SimpleNamespace(id=f"resp_{n}", output=[], output_text="respuesta parcial", usage=None)
+        call = SimpleNamespace(type="function_call", name=self.tool, call_id=f"call_{n}", arguments="{}")
+        return SimpleNamespace(id=f"resp_{n}", output=[call], output_text="", usage=None)
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    async def hang(arguments):
+        await asyncio.sleep(10)
+
+    async def fast(arguments):
+        return {"ok": True}
+
+    monkeypatch.setattr(rt, "TOOL_HANDLERS", {"hang": hang, "fast": fast})
+    monkeypatch.setattr(rt, "tool_metrics", rt.ToolMetrics())
+    monkeypatch.setattr(settings, "OPENAI_STREAMING", False)
+    monkeypatch.setattr(settings, "TURN_ANSWER_RESERVE_SECONDS", 0.6)
+
+    def install(tool: str, budget: float):
+        openai = FakeOpenAI(tool)
+        monkeypatch.setattr(rt, "get_openai_service", lambda: openai)
+        deadline = TurnDeadline(budget)
+        return openai, deadline, current_deadline.set(deadline)
+    return install
+
+
+async def test_stage_timeouts_are_capped_by_the_remaining_budget():
+    """
+    Tests that a stage gets the smaller of its own timeout and what is left of the turn.
+    """
+    # 1. Arrange
+    deadline = TurnDeadline(2.0, started_at=time.monotonic() - 1.5)
+
+    # 2. Act
+    token = current_deadline.set(deadline)
+    try:
+        capped, floor = turn_timeout(30), TurnDeadline(1.0, started_at=0).timeout(30)
+    finally:
+        current_deadline.reset(token)
+
+    # 3. Assert
+    assert 0.4 < capped <= 0.5
+    assert floor == 0.5
+    assert turn_timeout(30) == 30
+
+async def test_slow_tool_turns_into_a_partial_answer(agent):
+    """
+    Tests that a tool step that would overrun is cut at the deadline minus the reserve, and the
+    model is asked to answer without tools using the same input.
+    """
+    # 1. Arrange
+    openai, deadline, token = agent("hang", budget=1.5)
+
+    # 2. Act
+    started = time.monotonic()
+    try:
+        text, response_id = await rt.responses_tooled("hola", client_phone="5411")
+    finally:
+        current_deadline.reset(token)
+    elapsed = time.monotonic() - started
+
+    # 3. Assert
+    assert text == "respuesta parcial" and response_id == "resp_2"
+    assert elapsed < 1.5
+    wrap_up = openai.requests[-1]
+    assert wrap_up["tool_choice"] == "none"
+    assert wrap_up["previous_response_id"] is None
+    assert wrap_up["input"][-1] == {"role": "developer", "content": rt.WRAP_UP_MESSAGE}
+    assert wrap_up["input"][-2] == {"role": "user", "content": "hola"}
+    assert "llm" in deadline.stages
+
+async def test_model_calls_are_capped(agent, monkeypatch):
+    """
+    Tests that a model that keeps calling tools is stopped after TURN_MAX_MODEL_CALLS and
+    answers with the outputs it already has.
+    """
+    # 1. Arrange
+    monkeypatch.setattr(settings, "TURN_MAX_MODEL_CALLS", 3)
+    openai, deadline, token = agent("fast", budget=30)
+
+    # 2. Act
+    try:
+        text, _ = await rt.responses_tooled("hola", client_phone="5411", thread_id="resp_0")
+    finally:
+        current_deadline.reset(token)
+
+    # 3. Assert
+    assert len(openai.requests) == 4
+    wrap_up = openai.requests[-1]
+    assert wrap_up["previous_response_id"] == "resp_3"
+    assert wrap_up["input"][0]["call_id"] == "call_3"
+    assert deadline.stages["tool:fast"] >= 0
+
+async def test_no_time_left_raises_for_the_fallback(agent):
+    """
+    Tests that when not even the reserve is left the turn fails fast so the caller can send the fallback.
+    """
+    # 1. Arrange
+    openai, deadline, token = agent("fast", budget=0.2)
+
+    # 2. Act / 3. Assert
+    try:
+        with pytest.raises(TurnDeadlineExceeded):
+            await rt.responses_tooled("hola", client_phone="5411")
+    finally:
+        current_deadline.reset(token)
+    assert openai.requests == []
@@ -0,0 +1,265 @@
+import asyncio
+import pytest
+from src.modules.turn_queue import TurnQueue, TurnNotRetryable
+
+# Pytest marker for async functions
+pytestmark = pytest.mark.asyncio
+
+async def test_turns_are_processed_in_background():
+    """
+    Tests that enqueue returns immediately and the workers run the handler.
+    """
+    # 1. Arrange
+    processed = []
+
+    async def handler(items):
+        item, = items
+        await asyncio.sleep(0.01)
+        processed.append(item)
+
+    queue = TurnQueue(handler=handler, maxsize=10, workers=2, drain_timeout=1, debounce=0)
+    queue.start()
+
+    # 2. Act
+    assert queue.enqueue("111", "a") is True
+    assert queue.enqueue("222", "b") is True
+    assert processed == []
+    await queue.stop()
+
+    # 3. Assert
+    assert sorted(processed) == ["a", "b"]
+    stats = queue.stats()
+    assert stats["processed"] == 2
+    assert stats["depth"] == 0
+
+async def test_enqueue_rejects_when_full():
+    """
+    Tests that a full queue rejects new turns instead of blocking the webhook.
+    """
+    # 1. Arrange
+    release = asyncio.Event()
+
+    async def handler(items):
+        item, = items
+        await release.wait()
+
+    queue = TurnQueue(handler=handler, maxsize=2, workers=1, drain_timeout=1, debounce=0)
+    queue.start()
+
+    # 2. Act
+    queue.enqueue("111", 1)
+    queue.enqueue("111", 2)
+    accepted = queue.enqueue("222", 3)
+    release.set()
+    await queue.stop()
+
+    # 3. Assert
+    assert accepted is False
+    assert queue.stats()["rejected"] == 1
+
+async def test_same_sender_is_sequential_and_senders_run_in_parallel():
+    """
+    Tests that turns of one sender never overlap and keep their order,
+    while different senders are processed concurrently.
+    """
+    # 1. Arrange
+    running = {}
+    max_running_per_sender = {}
+    max_running_total = 0
+    order = []
+
+    async def handler(items):
+        nonlocal max_running_total
+        item, = items
+        sender, n = item
+        running[sender] = running.get(sender, 0) + 1
+        max_running_per_sender[sender] = max(max_running_per_sender.get(sender, 0), running[sender])
+        max_running_total = max(max_running_total, sum(running.values()))
+        await asyncio.sleep(0.01)
+        order.append(item)
+        running[sender] -= 1
+
+    queue = TurnQueue(handler=handler, maxsize=100, workers=4, drain_timeout=2, debounce=0)
+    queue.start()
+
+    # 2. Act
+    for n in range(5):
+        for sender in ("a", "b", "c"):
+            queue.enqueue(sender, (sender, n))
+    await queue.stop()
+
+    # 3. Assert
+    assert max_running_per_sender == {"a": 1, "b": 1, "c": 1}
+    assert max_running_total == 3
+    for sender in ("a", "b", "c"):
+        assert [n for s, n in order if s == sender] == [0, 1, 2, 3, 4]
+
+async def test_failed_turn_is_retried_before_next_turn_of_sender():
+    """
+    Tests at-least-once delivery: a failing turn is retried in place and
+    the following turn of the same sender waits for it.
+    """
+    # 1. Arrange
+    calls = []
+
+    async def handler(items):
+        item, = items
+        calls.append(item)
+        if item == "flaky" and calls.count("flaky") == 1:
+            raise RuntimeError("boom")
+
+    queue = TurnQueue(handler=handler, maxsize=10, workers=2, drain_timeout=1,
+                      max_attempts=3, retry_backoff=0, debounce=0)
+    queue.start()
+
+    # 2. Act
+    queue.enqueue("111", "flaky")
+    queue.enqueue("111", "next")
+    await queue.stop()
+
+    # 3. Assert
+    assert calls == ["flaky", "flaky", "next"]
+    stats = queue.stats()
+    assert stats["retried"] == 1
+    assert stats["processed"] == 2
+
+async def test_turn_is_dropped_after_max_attempts():
+    """
+    Tests that a turn that keeps failing is discarded and the sender's mailbox moves on.
+    """
+    # 1. Arrange
+    processed = []
+
+    async def handler(items):
+        item, = items
+        if item == "boom":
+            raise RuntimeError("boom")
+        processed.append(item)
+
+    queue = TurnQueue(handler=handler, maxsize=10, workers=1, drain_timeout=1,
+                      max_attempts=2, retry_backoff=0, debounce=0)
+    queue.start()
+
+    # 2. Act
+    queue.enqueue("111", "boom")
+    queue.enqueue("111", "ok")
+    await queue.stop()
+
+    # 3. Assert
+    assert processed == ["ok"]
+    assert queue.stats()["failed"] == 1
+
+async def test_retry_backoff_does_not_hold_a_worker():
+    """
+    Tests that while a failed turn waits for its retry, the only worker serves other senders.
+    """
+    # 1. Arrange
+    calls = []
+
+    async def handler(items):
+        item, = items
+        calls.append(item)
+        if item == "flaky" and calls.count("flaky") == 1:
+            raise RuntimeError("boom")
+
+    queue = TurnQueue(handler=handler, maxsize=10, workers=1, drain_timeout=2,
+                      max_attempts=3, retry_backoff=0.2, debounce=0)
+    queue.start()
+
+    # 2. Act
+    queue.enqueue("111", "flaky")
+    queue.enqueue("222", "other")
+    await asyncio.sleep(0.1)
+    during_backoff = list(calls)
+    await queue.stop()
+
+    # 3. Assert
+    assert during_backoff == ["flaky", "other"]
+    assert calls == ["flaky", "other", "flaky"]
+    assert queue.stats()["retried"] == 1
+
+async def test_turn_with_side_effects_is_not_retried():
+    """
+    Tests that a turn failing with TurnNotRetryable (it already replied or ran tools) is
+    discarded at once instead of being replayed, and the sender's mailbox moves on.
+    """
+    # 1. Arrange
+    calls = []
+
+    async def handler(items):
+        item, = items
+        calls.append(item)
+        if item == "late_failure":
+            raise TurnNotRetryable("reply already sent")
+
+    queue = TurnQueue(handler=handler, maxsize=10, workers=1, drain_timeout=1,
+                      max_attempts=3, retry_backoff=0, debounce=0)
+    queue.start()
+
+    # 2. Act
+    queue.enqueue("111", "late_failure")
+    queue.enqueue("111", "next")
+    await queue.stop()
+
+    # 3. Assert
+    assert calls == ["late_failure", "next"]
+    stats = queue.stats()
+    assert stats["retried"] == 0
+    assert stats["failed"] == 1 and stats["not_retried"] == 1
+
+async def test_burst_from_one_sender_is_coalesced_into_one_turn():
+    """
+    Tests that messages arriving inside the debounce window are delivered together,
+    while a message after the window starts a new turn.
+    """
+    # 1. Arrange
+    turns = []
+
+    async def handler(items):
+        turns.append(items)
+
+    queue = TurnQueue(handler=handler, maxsize=10, workers=2, drain_timeout=1,
+                      debounce=0.05, max_debounce_wait=1)
+    queue.start()
+
+    # 2. Act
+    for text in ("hola", "quería", "consultar"):
+        queue.enqueue("111", text)
+        await asyncio.sleep(0.01)
+    queue.enqueue("222", "otro")
+    await asyncio.sleep(0.15)
+    queue.enqueue("111", "gracias")
+    await queue.stop()
+
+    # 3. Assert
+    assert ["hola", "quería", "consultar"] in turns
+    assert ["otro"] in turns
+    assert ["gracias"] in turns
+    stats = queue.stats()
+    assert stats["coalesced_turns"] == 1
+    assert stats["coalesced_messages"] == 2
+    assert stats["messages"] == 5
+
+async def test_debounce_is_capped_by_max_wait():
+    """
+    Tests that a sender who never pauses still gets a turn after max_debounce_wait.
+    """
+    # 1. Arrange
+    turns = []
+
+    async def handler(items):
+        turns.append(items)
+
+    queue = TurnQueue(handler=handler, maxsize=100, workers=1, drain_timeout=1,
+                      debounce=0.05, max_debounce_wait=0.1)
+    queue.start()
+
+    # 2. Act
+    for n in range(12):
+        queue.enqueue("111", n)
+        await asyncio.sleep(0.02)
+    await queue.stop()
+
+    # 3. Assert
+    assert len(turns) >= 2
+    assert [n for turn in turns for n in turn] == list(range(12))
@@ -0,0 +1,144 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from src.modules import responses_tooled as rt
+from src.modules.redis_resilience import CircuitBreaker
+from src.modules.usage_ledger import UsageLedger, TurnLedger, TokenBudgetExceeded, current_turn
+from src.utils.settings import settings
+
+pytestmark = pytest.mark.asyncio
+
+PRICES = {"gpt-4o": {"input": 2.0, "cached_input": 1.0, "output": 10.0}, "whisper-1": {"audio_minute": 0.006}}
+
+
+def usage(input_tokens, output_tokens, cached_tokens=0):
+    return SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens,
+                           input_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+
+
+def make_ledger(redis_client, **kwargs):
+    options = dict(budget=0, budgets={}, prices=PRICES, redis_client=redis_client, breaker=CircuitBreaker())
+    options.update(kwargs)
+    return UsageLedger(**options)
+
+
+async def test_turns_are_aggregated_per_phone_and_day(redis_client):
+    """
+    Tests that committed turns add up tokens, tools, audio and cost in the phone's daily hash.
+    """
+    # 1. Arrange
+    ledger = make_ledger(redis_client)
+    first = TurnLedger("5411")
+    first.record_round("gpt-4o", usage(1000, 100, cached_tokens=600), 0.8)
+    first.record_tool("get_client", 0.25)
+    first.record_round("gpt-4o", usage(1200, 50, cached_tokens=1000), 0.4)
+    second = TurnLedger("5411")
+    second.record_transcription("whisper-1", audio_seconds=30, seconds=1.2)
+    second.record_round("gpt-4o", usage(500, 20), 0.3)
+
+    # 2. Act
+    await ledger.commit(first)
+    await ledger.commit(second)
+    report = await ledger.query("5411")
+
+    # 3. Assert
+    totals = report["totals"]
+    assert totals["turns"] == 2
+    assert totals["model_calls"] == 3
+    assert totals["input_tokens"] == 2700
+    assert totals["cached_tokens"] == 1600
+    assert totals["output_tokens"] == 170
+    assert totals["transcription_ms"] == 30000
+    assert report["tools"] == {"get_client": {"calls": 1, "ms": 250}}
+    assert report["models"] == {"gpt-4o": 3}
+    expected_cost = ((1100 * 2.0 + 1600 * 1.0 + 170 * 10.0) / 1_000_000) + 0.003
+    assert totals["cost_usd"] == pytest.approx(expected_cost)
+    assert [turn["model_calls"] for turn in report["recent_turns"]] == [1, 2]
+    assert await ledger.top() == [{"phone": "5411", "total_tokens": 2870}]
+    assert report["degraded"] is False
+
+async def test_budget_counts_stored_and_in_flight_tokens(redis_client):
+    """
+    Tests that the daily budget includes the running turn and honours per-phone overrides.
+    """
+    # 1. Arrange
+    ledger = make_ledger(redis_client, budget=1000, budgets={"5422": 0})
+    earlier = TurnLedger("5411")
+    earlier.record_round("gpt-4o", usage(700, 100), 0.1)
+    await ledger.commit(earlier)
+    running = TurnLedger("5411")
+
+    # 2. Act / 3. Assert
+    await ledger.ensure_budget(running)
+    running.record_round("gpt-4o", usage(150, 50), 0.1)
+    with pytest.raises(TokenBudgetExceeded):
+        await ledger.ensure_budget(running)
+    assert ledger.stats()["budget_blocks"] == 1
+    await ledger.ensure_budget(TurnLedger("5422"))
+    assert (await ledger.query("5411"))["budget_remaining"] == 200
+
+async def test_reports_degrade_when_redis_is_down(dead_redis_client):
+    """
+    Tests that with Redis down the budget is not enforced, the turn is still returned and the
+    usage queries answer empty and flagged instead of failing.
+    """
+    # 1. Arrange
+    ledger = UsageLedger(budget=10, budgets={}, prices=PRICES, redis_client=dead_redis_client,
+                         breaker=CircuitBreaker(failures=1, reset_seconds=60))
+    turn = TurnLedger("5411")
+    turn.record_round("gpt-4o", usage(700, 100), 0.1)
+
+    # 2. Act
+    await ledger.ensure_budget(turn)
+    entry = await ledger.commit(turn)
+    report = await ledger.query("5411")
+    ranking = await ledger.top()
+
+    # 3. Assert
+    assert entry["input_tokens"] == 700
+    assert report["degraded"] is True and report["totals"] == {} and report["recent_turns"] == []
+    assert ranking is None
+    assert ledger.stats()["committed"] == 0 and ledger.stats()["errors"] == 4
+
+
+class FakeOpenAI:
+    def __init__(self):
+        self.calls = 0
+
+    async def create_response(self, **request):
+        self.calls += 1
+        tool_calls = [SimpleNamespace(type="function_call", name="slow", call_id="call_1", arguments="{}")]
+        return SimpleNamespace(id="resp", output=tool_calls, output_text="", usage=usage(400, 30, 100))
+
+
+async def test_model_step_feeds_the_current_turn(monkeypatch, redis_client):
+    """
+    Tests that a model step records its round trip and tools in the turn ledger, and is
+    refused before calling the model once the budget is spent.
+    """
+    # 1. Arrange
+    async def slow(arguments):
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    monkeypatch.setattr(rt, "TOOL_HANDLERS", {"slow": slow})
+    monkeypatch.setattr(rt, "usage_ledger", make_ledger(redis_client, budget=400))
+    monkeypatch.setattr(settings, "OPENAI_STREAMING", False)
+    openai = FakeOpenAI()
+    turn = TurnLedger("5411")
+    token = current_turn.set(turn)
+
+    # 2. Act
+    try:
+        await rt.model_step(openai, "5411", model="gpt-4o", input=[])
+        with pytest.raises(TokenBudgetExceeded):
+            await rt.model_step(openai, "5411", model="gpt-4o", input=[])
+    finally:
+        current_turn.reset(token)
+
+    # 3. Assert
+    assert openai.calls == 1
+    assert turn.rounds[0]["input_tokens"] == 400 and turn.rounds[0]["cached_tokens"] == 100
+    assert turn.system_version == rt.SYSTEM_MESSAGE_VERSION
+    assert [tool["name"] for tool in turn.tools] == ["slow"]
+    assert turn.tools[0]["seconds"] >= 0.05
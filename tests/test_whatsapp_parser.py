@@ -0,0 +1,61 @@
+import json
+import pytest
+from src.modules.whatsapp_handler import decode_webhook, WhatsAppMessage
+
+
+def _body(value: dict) -> bytes:
+    return json.dumps({"entry": [{"changes": [{"field": "messages", "value": value}]}]}).encode()
+
+def test_decode_text_message():
+    """
+    Tests that a text message becomes a typed record with its body.
+    """
+    body = _body({"messages": [{"from": "5491122334455", "id": "wamid.1", "timestamp": "1",
+                                "type": "text", "text": {"body": "hola"}}]})
+
+    messages = decode_webhook(body)
+
+    assert len(messages) == 1
+    msg = messages[0]
+    assert isinstance(msg, WhatsAppMessage)
+    assert (msg.id, msg.sender, msg.type, msg.text) == ("wamid.1", "5491122334455", "text", "hola")
+    assert msg.media_id is None
+
+def test_decode_media_messages():
+    """
+    Tests that audio, image and document messages expose their media id and mime type.
+    """
+    body = _body({"messages": [
+        {"from": "1", "id": "a", "type": "audio", "audio": {"id": "m1", "mime_type": "audio/ogg"}},
+        {"from": "1", "id": "b", "type": "image", "image": {"id": "m2", "mime_type": "image/jpeg"}},
+        {"from": "1", "id": "c", "type": "document", "document": {"id": "m3", "mime_type": "application/pdf"}},
+    ]})
+
+    audio, image, document = decode_webhook(body)
+
+    assert (audio.media_id, audio.mime_type) == ("m1", "audio/ogg")
+    assert (image.media_id, image.mime_type) == ("m2", "image/jpeg")
+    assert (document.media_id, document.filename) == ("m3", "archivo")
+
+def test_status_only_payload_skips_decoding():
+    """
+    Tests that delivery/read receipts return no messages.
+    """
+    body = _body({"statuses": [{"id": "wamid.1", "status": "read"}]})
+
+    assert decode_webhook(body) == []
+
+def test_invalid_json_raises_value_error():
+    """
+    Tests that a malformed body with messages raises ValueError for the webhook to reject.
+    """
+    with pytest.raises(ValueError):
+        decode_webhook(b'{"messages": [')
+
+def test_records_use_slots():
+    """
+    Tests that message records don't carry a per-instance __dict__.
+    """
+    msg = WhatsAppMessage(id="1", sender="2", type="text")
+
+    assert not hasattr(msg, "__dict__")
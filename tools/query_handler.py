@@ -1,14 +1,18 @@
+import asyncio
 import logging
 import uuid
 from datetime import datetime
 import pytz
+import pandas as pd
 from src.modules.gspread_conexion import leer_google_sheet, crear_pedido_completo, add_phone_to_client
 from src.utils.config import config
 from src.utils.settings import settings
 from src.modules.sharepoint_service import SharePointService
 from src.modules.file_mapping_service import FileMappingService
+from src.modules.media_cache import media_cache
 from src.modules.gmail_connection import send_notification, NotificacionSchema
 from src.utils.db_connection import get_products
+from src.modules.tool_output import OutputSpec
 
 logger = logging.getLogger(__name__)
 
@@ -128,6 +132,44 @@ async def handle_get_client_orders(arguments):
         return {"error": "Error al obtener las compras del cliente."}
 
 
+def _number(value):
+    """Empty Excel cells come back as NaN (truthy), so they are coerced to 0 explicitly."""
+    return 0 if value is None or pd.isna(value) else value
+
+
+def summarize_orders(orders: list) -> dict:
+    """
+    Aggregate totals over all of a client's orders, sent with the first page of get_client_orders.
+    """
+    by_status = {}
+    units = amount = 0
+    for order in orders:
+        status = order.get("status") or "unknown"
+        by_status[status] = by_status.get(status, 0) + 1
+        for detail in order.get("details", []):
+            quantity = _number(detail.get("quantity"))
+            units += quantity
+            amount += quantity * _number(detail.get("unit_price"))
+    dates = sorted(str(order["fecha"]) for order in orders if order.get("fecha"))
+    return {
+        "orders": len(orders),
+        "units": units,
+        "amount": round(amount, 2),
+        "by_status": by_status,
+        "first_order": dates[0] if dates else None,
+        "last_order": dates[-1] if dates else None,
+    }
+
+
+# Only these fields reach the model; the latest orders come first, paged with `offset`
+ORDERS_OUTPUT = OutputSpec(
+    fields={"orders": ["id", "fecha", "status", "details"], "details": ["product_id", "quantity", "unit_price"]},
+    list_key="orders",
+    sort_by="fecha",
+    summary=summarize_orders,
+)
+
+
 async def handle_get_client(arguments):
     """
     Finds a client by their CUIT in the SharePoint Excel file.
@@ -213,7 +255,7 @@ async def handle_contact_company(arguments):
 
             # 1. Obtener la URL temporal del archivo en 'staging'
             file_mapping_service = FileMappingService()
-            file_info = file_mapping_service.get_link(file_id)
+            file_info = await file_mapping_service.get_link(file_id)
 
             logger.info(f"File info retrieved: {file_info}")
             
@@ -230,7 +272,8 @@ async def handle_contact_company(arguments):
 
             # 2. Mover el archivo a la carpeta de destino
             sharepoint_service = SharePointService(client_name="Celula") ## revisar este hardcoding
-            final_file_url = sharepoint_service.move_file(
+            final_file_url = await asyncio.to_thread(
+                sharepoint_service.move_file,
                 source_file_url=server_relative_url,
                 dest_folder_key=type_of_contact, # La clave de la carpeta es el tipo de contacto
                 file_name=file_name
@@ -244,6 +287,8 @@ async def handle_contact_company(arguments):
                 return {"error": "Failed to move the file in SharePoint."}
             
             logger.info(f"File moved successfully. New URL: {final_file_url}")
+            # The staging copy no longer exists, so a resend of the same file must upload again
+            await media_cache.invalidate_url(source_file_url)
 
         # 3. Enviar la notificación por correo
         success = await send_notification(NotificacionSchema(
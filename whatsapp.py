@@ -1,25 +1,66 @@
-from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi import FastAPI, Request, HTTPException, Query, Header, Depends
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio
 import hmac
 import hashlib
-from src.modules.whatsapp_handler import download_media, send_text_message, parse_whatsapp_message
-from src.modules.openai_client import OpenAIService
-from src.modules.responses_tooled import responses_tooled
+import time
+from src.modules.whatsapp_handler import download_media, send_text_message, decode_webhook, WhatsAppMessage
+from src.modules.openai_client import get_openai_service, close_openai_service
+from src.modules.responses_tooled import (
+    responses_tooled, tool_metrics, prompt_cache_metrics, SYSTEM_MESSAGE_VERSION)
+from src.modules.answer_cache import answer_cache
+from src.modules.usage_ledger import usage_ledger, current_turn, TurnLedger, TokenBudgetExceeded
+from src.modules.turn_deadline import (
+    TurnDeadline, TurnDeadlineExceeded, current_deadline, deadline_metrics, turn_stage, turn_timeout)
+from src.modules.prompt_layout import encode_catalog
 from src.modules.chat_memory import memory_handler
+from src.modules.local_cache import cache_invalidator
+from src.modules.conversation_compaction import conversation_compactor, summary_message
+from src.modules.turn_queue import TurnQueue, TurnNotRetryable
+from src.modules.message_dedup import message_dedup
+from src.modules.media_cache import media_cache
+from src.modules.transcription import transcriber
+from src.modules.model_router import model_router
+from src.modules.tool_output import tool_output_encoder
+from src.modules.outbound_dispatcher import outbound_dispatcher
+from src.modules.http_conexion import get_http_client, close_http_client
+from src.modules.redis_conexion import close_async_redis_client
+from src.modules.redis_resilience import resilience_stats
 from src.utils.db_connection import get_client_by_phone, get_products
 from src.utils.settings import settings
 from src.utils.logger import get_logger
 
 logger = get_logger(__name__)
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_http_client()
+    if settings.OPENAI_WARMUP:
+        await get_openai_service().warm_up()
+    if settings.LOCAL_CACHE_ENABLED:
+        cache_invalidator.start()
+    turn_queue.start()
+    outbound_dispatcher.start()
+    yield
+    await turn_queue.stop()
+    await outbound_dispatcher.stop()
+    await cache_invalidator.stop()
+    transcriber.close()
+    await close_openai_service()
+    await close_http_client()
+    await close_async_redis_client()
+
+app = FastAPI(lifespan=lifespan)
 
 VERIFY_TOKEN = settings.WHATSAPP_VERIFY_TOKEN
 APP_SECRET = settings.APP_SECRET
+ADMIN_TOKEN = settings.ADMIN_TOKEN
 ACCESS_TOKEN = settings.WHATSAPP_ACCESS_TOKEN
 PHONE_NUMBER_ID = settings.PHONE_NUMBER_ID
 API_VERSION = settings.WHATSAPP_API_VERSION
 
-agent = OpenAIService()
-
 @app.post("/webhook")
 async def receive_webhook(request: Request):
     logger.info("📩 Entró al endpoint POST")
@@ -33,123 +74,326 @@ async def receive_webhook(request: Request):
         # raise HTTPException(status_code=403, detail="Invalid signature")
 
     # --- Parseo de datos ---
-    data = await request.json()
-    messages = parse_whatsapp_message(data)
-    logger.debug(f"Received data: {data}")
-    files_id = None
+    try:
+        messages = decode_webhook(body_bytes)
+    except ValueError as e:
+        logger.error(f"Payload inválido: {e}")
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
     if not messages:
-        logger.warning("No se encontraron mensajes en el payload.")
+        logger.debug("Payload sin mensajes (sólo estados).")
         return {"status": "no messages"}
+    logger.debug(f"Mensajes recibidos: {messages}")
 
-    # --- Loop principal ---
-    productos = None
+    # --- Encolado: los turnos se procesan en segundo plano ---
     for msg in messages:
-        if msg["from"].startswith("549"):
-            from_number = msg["from"].replace("549", "54", 1)
-            logger.info(f"🇦🇷 Número argentino detectado. Normalizado a: {from_number}")
-        else:
-            from_number = msg["from"]
-            logger.info(f"🌐 Número internacional detectado: {from_number}")
-        msg_type = msg["type"]
-        user_message = None
-
-        logger.info(f"📨 Mensaje de {from_number} - tipo: {msg_type}")
-
-        thread_id = memory_handler.get_or_create_thread(from_number)
-        if not thread_id:
-            productos = await get_products()
-            user_info = None
-            user_info = await get_client_by_phone(from_number)
-            if user_info:
-                logger.info(f"👤 Información del usuario: {user_info}")
-
-        if msg_type == "text":
-            user_message = msg.get("text")
-            logger.info(f"💬 Texto recibido: {user_message}")
-            if not user_message:
-                await send_text_message(to=from_number, message="Perdón, no puedo procesar tu mensaje.")
-                continue
-
-        elif msg_type == "audio":
-            media_id = msg.get("audio_id")
-            audio_bytes = await download_media(
-                media_id=media_id,
-                media_type='audio',
-                from_number=from_number,
-                timestamp=msg.get("timestamp")
-            )
-
-            if audio_bytes:
-                try:
-                    transcription = await agent.transcribe_audio(audio_bytes=audio_bytes, language="es")
-                    user_message = transcription.text
-                    logger.info(f"📝 Transcripción: {user_message}")
-                except Exception as e:
-                    logger.error(f"❌ Error procesando audio: {e}", exc_info=True)
-                    await send_text_message(to=from_number, message="Hubo un error al procesar tu audio.")
-                    continue
-            else:
-                await send_text_message(to=from_number, message="No pude descargar tu audio.")
-                continue
-
-        elif msg_type == "image":
-            media_id = msg.get("image_id")
-            image_id = await download_media(
-                media_id=media_id,
-                media_type='image',
-                from_number=from_number,
-                timestamp=msg.get("timestamp"),
-                mime_type=msg.get("mime_type")
-            )
-
-            if image_id:
-                files_id = [image_id]
-                user_message = f"Archivo enviado: {image_id}"
-                logger.info(f"✅ Imagen descargada y mapeada con éxito. ID: {image_id}")
-            else:
-                await send_text_message(to=from_number, message="No pude descargar tu imagen.")
-                continue
-
-        elif msg_type == "document":
-            media_id = msg.get("document_id")
-            document_id = await download_media(
-                media_id=media_id,
-                media_type='document',
-                from_number=from_number,
-                timestamp=msg.get("timestamp"),
-                original_filename=msg.get("filename"),
-                mime_type=msg.get("mime_type")
-            )
-
-            if document_id:
-                files_id = [document_id]
-                user_message = f"Archivo enviado: {document_id}"
-                logger.info(f"✅ Documento descargado y mapeado con éxito. ID: {document_id}")
-            else:
-                await send_text_message(to=from_number, message="No pude descargar tu archivo.")
-                continue
+        if await message_dedup.is_duplicate(msg.id):
+            logger.info(f"♻️ Mensaje duplicado descartado: {msg.id}")
+            continue
+        if not turn_queue.enqueue(normalize_number(msg.sender), msg):
+            # Meta reintentará la entrega: se libera el id para no descartarlo como duplicado.
+            await message_dedup.forget(msg.id)
+            raise HTTPException(status_code=503, detail="Turn queue full")
+
+    return {"status": "received"}
+
+def normalize_number(number: str) -> str:
+    """Normaliza los números argentinos (549...) al formato que espera la API (54...)."""
+    if number.startswith("549"):
+        return number.replace("549", "54", 1)
+    return number
+
+async def resolve_message(msg: WhatsAppMessage, from_number: str):
+    """
+    Convierte un mensaje entrante en texto para el agente.
+    Descarga y transcribe audios, sube imágenes/documentos y devuelve (texto, ids_de_archivos).
+    Si el mensaje no se puede procesar, avisa al usuario y devuelve (None, []).
+    """
+    msg_type = msg.type
+    logger.info(f"📨 Mensaje de {from_number} - tipo: {msg_type}")
 
+    if msg_type == "text":
+        user_message = msg.text
+        logger.info(f"💬 Texto recibido: {user_message}")
+        if not user_message:
+            await send_text_message(to=from_number, message="Perdón, no puedo procesar tu mensaje.")
+            return None, []
+        return user_message, []
+
+    elif msg_type == "audio":
+        media_id = msg.media_id
+        audio_bytes = await download_media(
+            media_id=media_id,
+            media_type='audio',
+            from_number=from_number,
+            timestamp=msg.timestamp
+        )
+
+        if audio_bytes:
+            try:
+                start = time.monotonic()
+                transcription = await asyncio.wait_for(transcriber.transcribe(audio_bytes, language="es"),
+                                                       timeout=turn_timeout())
+                ledger = current_turn.get()
+                if ledger is not None:
+                    # Una transcripción reutilizada de la caché no se factura
+                    audio_seconds = 0.0 if transcription.cached else transcription.duration or 0.0
+                    ledger.record_transcription(transcriber.model, audio_seconds, time.monotonic() - start)
+                user_message = transcription.text
+                logger.info(f"📝 Transcripción: {user_message}")
+                return user_message, []
+            except Exception as e:
+                logger.error(f"❌ Error procesando audio: {e}", exc_info=True)
+                await send_text_message(to=from_number, message="Hubo un error al procesar tu audio.")
         else:
-            logger.warning(f"Tipo de mensaje no manejado: {msg_type}")
-            continue
+            await send_text_message(to=from_number, message="No pude descargar tu audio.")
+        return None, []
 
-        logger.info(f"🤖 Procesando mensaje del usuario: {user_message}, con archivos: {files_id}")
-        # --- Respuesta agente ---
-        respuesta, thread_id = await responses_tooled(
-            user_message=user_message,
-            client_phone=from_number,
-            thread_id=thread_id,
-            user_information=user_info if not thread_id else None,
-            files_id = files_id,
-            products=productos 
+    elif msg_type == "image":
+        media_id = msg.media_id
+        image_id = await download_media(
+            media_id=media_id,
+            media_type='image',
+            from_number=from_number,
+            timestamp=msg.timestamp,
+            mime_type=msg.mime_type
         )
 
-        response_message = await send_text_message(to=from_number, message=respuesta)
-        memory_handler.update_thread_activity(from_number, thread_id)
-        logger.info(f"✅ Respuesta enviada a {from_number}: {response_message}")
+        if image_id:
+            logger.info(f"✅ Imagen descargada y mapeada con éxito. ID: {image_id}")
+            return f"Archivo enviado: {image_id}", [image_id]
+        await send_text_message(to=from_number, message="No pude descargar tu imagen.")
+        return None, []
 
-    return {"status": "received"}
+    elif msg_type == "document":
+        media_id = msg.media_id
+        document_id = await download_media(
+            media_id=media_id,
+            media_type='document',
+            from_number=from_number,
+            timestamp=msg.timestamp,
+            original_filename=msg.filename,
+            mime_type=msg.mime_type
+        )
+
+        if document_id:
+            logger.info(f"✅ Documento descargado y mapeado con éxito. ID: {document_id}")
+            return f"Archivo enviado: {document_id}", [document_id]
+        await send_text_message(to=from_number, message="No pude descargar tu archivo.")
+        return None, []
+
+    logger.warning(f"Tipo de mensaje no manejado: {msg_type}")
+    return None, []
+
+async def process_turn(msgs: list):
+    """
+    Procesa un turno completo de un remitente: uno o más mensajes seguidos
+    (ráfaga) que se resuelven y se envían al agente en una sola llamada.
+    El consumo del turno (tokens, herramientas, audio, latencia) se registra al terminar.
+
+    El turno tiene un plazo de TURN_DEADLINE_SECONDS desde que el último mensaje llegó al
+    webhook; cada etapa recibe lo que queda. Si se agota, se le pide al modelo una respuesta
+    con lo que tiene o, si tampoco hay tiempo para eso, se envía TURN_FALLBACK_MESSAGE.
+
+    Un error antes de responder o de ejecutar herramientas se propaga y la cola reintenta el
+    turno. Después no: se le avisa al cliente (TURN_ERROR_MESSAGE) si todavía no recibió la respuesta
+    y el turno se descarta con `TurnNotRetryable`.
+    """
+    from_number = normalize_number(msgs[0].sender)
+    ledger = TurnLedger(from_number)
+    deadline = None
+    if settings.TURN_DEADLINE_SECONDS > 0:
+        deadline = TurnDeadline(settings.TURN_DEADLINE_SECONDS, started_at=max(msg.received_at for msg in msgs))
+        deadline.add("queue", deadline.elapsed())
+    token = current_turn.set(ledger)
+    deadline_token = current_deadline.set(deadline)
+    try:
+        await usage_ledger.ensure_budget(ledger)
+        await _process_turn(msgs, from_number, ledger)
+    except TokenBudgetExceeded as e:
+        ledger.outcome = "budget_exceeded"
+        logger.warning(f"💸 Presupuesto diario agotado: {e}")
+        await send_text_message(to=from_number, message=settings.TOKEN_BUDGET_MESSAGE)
+    except TurnDeadlineExceeded as e:
+        ledger.outcome = "deadline_fallback"
+        logger.warning(f"⏱️ Turno de {from_number} sin respuesta dentro del plazo: {e}")
+        await send_text_message(to=from_number, message=settings.TURN_FALLBACK_MESSAGE)
+    except Exception as e:
+        ledger.outcome = "error"
+        if not ledger.side_effects:
+            raise
+        if "reply" not in ledger.side_effects:
+            try:
+                await send_text_message(to=from_number, message=settings.TURN_ERROR_MESSAGE)
+            except Exception as send_error:
+                logger.error(f"No se pudo avisar del error a {from_number}: {send_error}")
+        raise TurnNotRetryable(f"{type(e).__name__}: {e} (después de {', '.join(ledger.side_effects)})") from e
+    finally:
+        current_deadline.reset(deadline_token)
+        current_turn.reset(token)
+        model_router.record_turn(await usage_ledger.commit(ledger))
+        if deadline is not None:
+            deadline_metrics.record(deadline, ledger.outcome)
+            if deadline.expired or ledger.outcome.startswith("deadline"):
+                logger.warning(f"⏱️ Turno de {from_number} excedió el plazo de {deadline.budget:.0f}s "
+                               f"({deadline.elapsed():.1f}s, {ledger.outcome}): {deadline.breakdown()}")
+
+async def send_reply(to: str, message: str, ledger: TurnLedger):
+    """
+    Envía la respuesta del turno. Si llegó, queda registrada: a partir de ahí el turno ya no se
+    reintenta. Los avisos (p. ej. "No pude descargar tu audio") no cuentan como respuesta.
+    """
+    response = await send_text_message(to=to, message=message)
+    if response is not None:
+        ledger.record_side_effect("reply")
+    return response
+
+async def _process_turn(msgs: list, from_number: str, ledger: TurnLedger):
+    if from_number != msgs[0].sender:
+        logger.info(f"🇦🇷 Número argentino detectado. Normalizado a: {from_number}")
+    else:
+        logger.info(f"🌐 Número internacional detectado: {from_number}")
+
+    texts = []
+    files_id = []
+    with turn_stage("resolve"):
+        for msg in msgs:
+            text, msg_files = await resolve_message(msg, from_number)
+            if text:
+                texts.append(text)
+                files_id.extend(msg_files)
+
+    if not texts:
+        ledger.outcome = "unresolved"
+        return
+    user_message = "\n".join(texts)
+    if len(msgs) > 1:
+        logger.info(f"🧩 {len(msgs)} mensajes de {from_number} agrupados en un solo turno.")
+
+    productos = None
+    user_info = None
+    history = None
+    new_thread = False
+    thread_state = await memory_handler.get_thread_state(from_number)
+    thread_id = thread_state.get("thread_id") if thread_state else None
+    summary = thread_state.get("summary") if thread_state else None
+    if not thread_id:
+        new_thread = True
+        with turn_stage("context"):
+            productos, user_info = await asyncio.gather(get_products(), get_client_by_phone(from_number))
+        if user_info:
+            logger.info(f"👤 Información del usuario: {user_info}")
+
+        # --- Caché de preguntas frecuentes (no aplica si el hilo viene de una compactación) ---
+        if not files_id and not summary:
+            cache_scope = "registered" if user_info else "unregistered"
+            catalog_version = encode_catalog(productos)[1]
+            cached = answer_cache.get(user_message, cache_scope, SYSTEM_MESSAGE_VERSION, catalog_version)
+            if cached:
+                logger.info(f"⚡ Respuesta de la caché para {from_number}: {cached}")
+                await send_reply(from_number, cached, ledger)
+                await answer_cache.remember_served(from_number, user_message, cached)
+                ledger.outcome = "answer_cache"
+                return
+        history = await answer_cache.pop_served(from_number)
+        if summary:
+            history = [summary_message(summary)] + history
+
+    logger.info(f"🤖 Procesando mensaje del usuario: {user_message}, con archivos: {files_id}")
+    # --- Respuesta agente ---
+    respuesta, thread_id = await responses_tooled(
+        user_message=user_message,
+        client_phone=from_number,
+        thread_id=thread_id,
+        user_information=user_info if not thread_id else None,
+        files_id = files_id or None,
+        products=productos,
+        history=history,
+    )
+
+    if new_thread and not files_id and not summary and ledger.tool_calls == 0:
+        private_values = (from_number, *(user_info or {}).values())
+        answer_cache.put(user_message, cache_scope, SYSTEM_MESSAGE_VERSION, catalog_version, respuesta,
+                         private_values=private_values)
+
+    with turn_stage("send"):
+        response_message = await send_reply(from_number, respuesta, ledger)
+    thread_state = await memory_handler.update_thread_activity(from_number, thread_id, tokens=ledger.total_tokens)
+    logger.info(f"✅ Respuesta enviada a {from_number}: {response_message}")
+
+    # --- Compactación del hilo, con la respuesta ya enviada ---
+    if conversation_compactor.trigger(thread_state):
+        with turn_stage("compaction"):
+            await conversation_compactor.compact(from_number, thread_state, memory_handler, ledger)
+
+turn_queue = TurnQueue(handler=process_turn)
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    """Endpoints de operación (/metrics, /usage, /model): piden "Authorization: Bearer ADMIN_TOKEN"."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="ADMIN_TOKEN no configurado")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Token inválido")
+
+@app.get("/metrics", dependencies=[Depends(require_admin)])
+def metrics():
+    """Métricas internas del procesamiento de turnos."""
+    return {
+        "turn_queue": turn_queue.stats(),
+        "dedup": message_dedup.stats(),
+        "media_cache": media_cache.stats(),
+        "outbound": outbound_dispatcher.stats(),
+        "openai": get_openai_service().stats(),
+        "tools": tool_metrics.stats(),
+        "tool_output": tool_output_encoder.stats(),
+        "prompt_cache": prompt_cache_metrics.stats(),
+        "answer_cache": answer_cache.stats(),
+        "usage": usage_ledger.stats(),
+        "deadline": deadline_metrics.stats(),
+        "transcription": transcriber.stats(),
+        "model_router": model_router.stats(),
+        "compaction": conversation_compactor.stats(),
+        "local_cache": cache_invalidator.stats(),
+        "redis": resilience_stats(),
+    }
+
+@app.get("/usage", dependencies=[Depends(require_admin)])
+async def usage_ranking(day: Optional[str] = None, limit: int = 20):
+    """Números con más tokens consumidos en el día (hoy por defecto, formato AAAA-MM-DD)."""
+    ranking = await usage_ledger.top(day, limit)
+    return {"day": day or usage_ledger.day(), "top": ranking or [], "degraded": ranking is None}
+
+@app.get("/usage/{phone}", dependencies=[Depends(require_admin)])
+async def usage_by_phone(phone: str, day: Optional[str] = None):
+    """Consumo de OpenAI de un número en el día: acumulados, herramientas, presupuesto y últimos turnos."""
+    return await usage_ledger.query(normalize_number(phone), day)
+
+@app.get("/model/{phone}", dependencies=[Depends(require_admin)])
+async def get_model_override(phone: str):
+    """Override de modelo vigente para el hilo de un número (None si se elige por turno)."""
+    phone = normalize_number(phone)
+    return {"phone": phone, "override": await model_router.get_override(phone)}
+
+@app.put("/model/{phone}", dependencies=[Depends(require_admin)])
+async def set_model_override(phone: str, model: str):
+    """
+    Fija el modelo del hilo de un número (hasta MODEL_OVERRIDE_TTL_SECONDS o hasta borrarlo).
+    Sólo MODEL_LARGE o MODEL_SMALL; 503 si Redis no responde y no quedó guardado.
+    """
+    if model not in {settings.MODEL_LARGE, settings.MODEL_SMALL} - {None, ""}:
+        raise HTTPException(status_code=422, detail=f"Modelo desconocido: {model}")
+    phone = normalize_number(phone)
+    override = await model_router.set_override(phone, model)
+    if override is None:
+        raise HTTPException(status_code=503, detail="No se pudo guardar el override (Redis no disponible)")
+    return {"phone": phone, "override": override}
+
+@app.delete("/model/{phone}", dependencies=[Depends(require_admin)])
+async def clear_model_override(phone: str):
+    """Vuelve a elegir el modelo turno a turno para ese número."""
+    phone = normalize_number(phone)
+    return {"phone": phone, "cleared": await model_router.clear_override(phone)}
 
 def verify_signature(request_body: bytes, signature_header: str):
     """Verifica la firma X-Hub-Signature-256 con HMAC SHA256"""